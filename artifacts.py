@@ -0,0 +1,165 @@
+"""
+Background writing of training artifacts (checkpoints, winners, plots, replays).
+
+Everything is written atomically: the data goes to a temporary file next to
+the target, which is then renamed over it, so a reader never sees a half
+written file and a crash never leaves one behind.
+"""
+import contextlib
+import gzip
+import os
+import pickle
+import queue
+import random
+import tempfile
+import threading
+import traceback
+import warnings
+
+import neat
+
+# mkstemp creates private files; artifacts get the usual permissions instead
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+def ensure_dir(filename):
+    """
+    create the directory a file will be written to, if needed
+    :param filename: location of the file
+    :return: None
+    """
+    directory = os.path.dirname(filename)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory, exist_ok=True)
+
+
+@contextlib.contextmanager
+def atomic_output(filename):
+    """
+    context manager giving a temporary path that replaces filename on success
+    :param filename: location of the final file
+    :return: temporary path with the same extension as filename
+    """
+    ensure_dir(filename)
+    directory, name = os.path.split(filename)
+    fd, tmp = tempfile.mkstemp(dir=directory or ".", prefix="." + name + ".",
+                               suffix=os.path.splitext(name)[1])
+    os.close(fd)
+    os.chmod(tmp, 0o666 & ~UMASK)
+    try:
+        yield tmp
+        os.replace(tmp, filename)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def atomic_write(filename, data):
+    """
+    atomically write bytes to a file
+    :param filename: location of the file
+    :param data: bytes
+    :return: None
+    """
+    with atomic_output(filename) as tmp:
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+
+def write_gzip(filename, data, compresslevel=5):
+    """
+    atomically write bytes to a gzip file
+    :param filename: location of the file
+    :param data: bytes
+    :param compresslevel: gzip compression level
+    :return: None
+    """
+    atomic_write(filename, gzip.compress(data, compresslevel))
+
+
+class ArtifactWriter:
+    """
+    Runs writing jobs on a background thread. The queue is bounded, so if
+    the disk can't keep up the producer eventually waits instead of
+    piling up snapshots in memory.
+    """
+
+    def __init__(self, maxsize=8):
+        """
+        Initialize the writer and start its thread
+        :param maxsize: number of jobs that may wait to be written
+        :return: None
+        """
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, fn, *args, block=True, **kwargs):
+        """
+        queue a job; fn(*args, **kwargs) runs on the writer thread
+        :param fn: callable that writes the artifact
+        :param block: wait for room in the queue, otherwise drop the job when full
+        :return: Bool, False if the job was dropped
+        """
+        try:
+            self.queue.put((fn, args, kwargs), block=block)
+            return True
+        except queue.Full:
+            warnings.warn("Artifact writer is falling behind, dropped {}".format(getattr(fn, "__name__", fn)))
+            return False
+
+    def close(self):
+        """
+        run everything still queued and stop the thread
+        :return: None
+        """
+        self.queue.put(None)
+        self.thread.join()
+
+    def _work(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            fn, args, kwargs = job
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                warnings.warn("Artifact job {} failed:\n{}".format(getattr(fn, "__name__", fn),
+                                                                   traceback.format_exc()))
+
+
+class AsyncCheckpointer(neat.Checkpointer):
+    """
+    A neat.Checkpointer that only pickles the population on the training
+    thread. Compressing and writing the snapshot is done by an ArtifactWriter.
+    """
+
+    def __init__(self, writer, generation_interval=100, time_interval_seconds=300,
+                 filename_prefix='neat-checkpoint-'):
+        """
+        Initialize the checkpointer
+        :param writer: ArtifactWriter that writes the checkpoints
+        :param generation_interval: maximum number of generations between checkpoints
+        :param time_interval_seconds: maximum number of seconds between checkpoints
+        :param filename_prefix: prefix for the filename (the end will be the generation number)
+        :return: None
+        """
+        neat.Checkpointer.__init__(self, generation_interval, time_interval_seconds, filename_prefix)
+        self.writer = writer
+
+    def __getstate__(self):
+        # the species set keeps a reference to its reporters, so this object ends
+        # up inside its own checkpoints; the writer thread can't be pickled
+        state = self.__dict__.copy()
+        state['writer'] = None
+        return state
+
+    def save_checkpoint(self, config, population, species_set, generation):
+        """ Snapshot the current simulation state and write it in the background. """
+        filename = '{0}{1}'.format(self.filename_prefix, generation)
+        print("Saving checkpoint to {0}".format(filename))
+
+        data = (generation, config, population, species_set, random.getstate())
+        self.writer.submit(write_gzip, filename, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
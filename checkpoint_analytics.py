@@ -0,0 +1,248 @@
+"""
+Mines the NEAT checkpoints for trends over a whole run.
+
+    python checkpoint_analytics.py extract checkpoints --out outputs/genomes.npz
+    python checkpoint_analytics.py summary outputs/genomes.npz
+
+`extract` unpickles the checkpoints in a process pool. Each worker boils its
+checkpoint down to a few NumPy columns, so only small arrays travel back to
+the parent, which writes one columnar .npz file. Queries then load those
+columns and never touch a pickle again.
+
+A neat checkpoint holds the population bred at the end of a generation,
+before it is evaluated. Only the elites carried over from the generation
+before still have a fitness, so most genome rows have fitness NaN. The
+fitness aggregates (fitness_trend) skip those rows and report how many rows
+they are over. The species fitness is that of the generation that bred the
+population.
+"""
+import argparse
+import glob
+import gzip
+import multiprocessing
+import os
+import pickle
+import re
+
+import numpy as np
+
+from artifacts import atomic_output
+from genome_graph import structural_hash
+
+WEIGHT_BINS = np.linspace(-30, 30, 61)
+
+GENOME_COLUMNS = ["generation", "key", "species", "fitness", "nodes", "connections", "enabled", "hash"]
+SPECIES_COLUMNS = ["generation", "species", "created", "last_improved", "size", "fitness"]
+
+
+def checkpoint_generation(filename):
+    """
+    the generation number at the end of a checkpoint file name
+    :param filename: e.g. checkpoints/ckpt-104
+    :return: int
+    """
+    return int(re.search(r"(\d+)$", filename).group(1))
+
+
+def extract_checkpoint(filename):
+    """
+    read one checkpoint and return its per-genome and per-species rows.
+    Runs in the worker processes.
+    :param filename: location of the checkpoint
+    :return: (genome columns, species columns, weight histogram)
+    """
+    with gzip.open(filename) as f:
+        generation, config, population, species_set, _ = pickle.load(f)
+
+    n = len(population)
+    genomes = {"generation": np.full(n, generation, dtype=np.int32),
+               "key": np.empty(n, dtype=np.int64),
+               "species": np.full(n, -1, dtype=np.int64),
+               "fitness": np.full(n, np.nan),
+               "nodes": np.empty(n, dtype=np.int32),
+               "connections": np.empty(n, dtype=np.int32),
+               "enabled": np.empty(n, dtype=np.int32),
+               "hash": np.empty(n, dtype=np.uint64)}
+    weights = []
+    for i, (key, g) in enumerate(population.items()):
+        genomes["key"][i] = key
+        genomes["species"][i] = species_set.genome_to_species.get(key, -1)
+        if g.fitness is not None:
+            genomes["fitness"][i] = g.fitness
+        genomes["nodes"][i] = len(g.nodes)
+        genomes["connections"][i] = len(g.connections)
+        genomes["enabled"][i] = sum(1 for cg in g.connections.values() if cg.enabled)
+        genomes["hash"][i] = structural_hash(g)
+        weights.extend(cg.weight for cg in g.connections.values())
+
+    species = list(species_set.species.values())
+    m = len(species)
+    rows = {"generation": np.full(m, generation, dtype=np.int32),
+            "species": np.array([s.key for s in species], dtype=np.int64),
+            "created": np.array([s.created for s in species], dtype=np.int32),
+            "last_improved": np.array([s.last_improved for s in species], dtype=np.int32),
+            "size": np.array([len(s.members) for s in species], dtype=np.int32),
+            "fitness": np.array([np.nan if s.fitness is None else s.fitness for s in species])}
+
+    histogram = np.histogram(np.clip(weights, WEIGHT_BINS[0], WEIGHT_BINS[-1]), bins=WEIGHT_BINS)[0]
+    return genomes, rows, histogram.astype(np.int32)
+
+
+def extract(directory, out, workers=None):
+    """
+    extract every checkpoint in a directory into one columnar .npz file
+    :param directory: directory holding the checkpoints
+    :param out: location of the .npz file
+    :param workers: number of worker processes, defaults to the CPU count
+    :return: number of checkpoints read
+    """
+    files = sorted(glob.glob(os.path.join(directory, "*-[0-9]*")), key=checkpoint_generation)
+    if not files:
+        raise ValueError("No checkpoints found in {}".format(directory))
+
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(extract_checkpoint, files, chunksize=1)
+
+    columns = {}
+    for name in GENOME_COLUMNS:
+        columns[name] = np.concatenate([r[0][name] for r in results])
+    for name in SPECIES_COLUMNS:
+        columns["species_" + name] = np.concatenate([r[1][name] for r in results])
+    columns["weight_generation"] = np.array([r[0]["generation"][0] for r in results], dtype=np.int32)
+    columns["weight_hist"] = np.stack([r[2] for r in results])
+    columns["weight_bins"] = WEIGHT_BINS
+
+    with atomic_output(out) as tmp:
+        with open(tmp, "wb") as f:
+            np.savez(f, **columns)
+    return len(files)
+
+
+def load_table(filename):
+    """
+    load the columns written by extract
+    :param filename: location of the .npz file
+    :return: dict of numpy arrays
+    """
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def size_trend(table):
+    """
+    mean network size of each checkpointed generation
+    :param table: dict of numpy arrays from load_table
+    :return: (generations, mean nodes, mean enabled connections)
+    """
+    generations, index = np.unique(table["generation"], return_inverse=True)
+    counts = np.bincount(index)
+    return (generations,
+            np.bincount(index, weights=table["nodes"]) / counts,
+            np.bincount(index, weights=table["enabled"]) / counts)
+
+
+def fitness_trend(table):
+    """
+    fitness of the genomes of each checkpointed generation that have one,
+    the elites; the not yet evaluated offspring (NaN) are left out
+    :param table: dict of numpy arrays from load_table
+    :return: (generations, number of genomes with a fitness, their mean fitness, their best fitness),
+             mean and best being NaN for a generation without any
+    """
+    generations, index = np.unique(table["generation"], return_inverse=True)
+    evaluated = ~np.isnan(table["fitness"])
+    counts = np.bincount(index[evaluated], minlength=len(generations))
+    totals = np.bincount(index[evaluated], weights=table["fitness"][evaluated], minlength=len(generations))
+    best = np.full(len(generations), -np.inf)
+    np.maximum.at(best, index[evaluated], table["fitness"][evaluated])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = totals / counts
+    best[counts == 0] = np.nan
+    return generations, counts, mean, best
+
+
+def best_fitness(table):
+    """
+    best species fitness of each checkpointed generation
+    :param table: dict of numpy arrays from load_table
+    :return: (generations, best fitness)
+    """
+    generations, index = np.unique(table["species_generation"], return_inverse=True)
+    best = np.full(len(generations), -np.inf)
+    np.fmax.at(best, index, table["species_fitness"])
+    return generations, best
+
+
+def fitness_jumps(table, min_jump=10.0):
+    """
+    checkpoints where the best fitness rose by at least min_jump
+    :param table: dict of numpy arrays from load_table
+    :param min_jump: smallest rise that counts as a jump
+    :return: List of (generation, previous best, new best)
+    """
+    generations, best = best_fitness(table)
+    rises = np.flatnonzero(np.diff(best) >= min_jump) + 1
+    return [(int(generations[i]), float(best[i - 1]), float(best[i])) for i in rises]
+
+
+def species_lineage(table):
+    """
+    lifetime of every species seen in the checkpoints
+    :param table: dict of numpy arrays from load_table
+    :return: dict species key -> (created, last checkpoint seen, peak size)
+    """
+    lineage = {}
+    for gen, sid, created, size in zip(table["species_generation"], table["species_species"],
+                                       table["species_created"], table["species_size"]):
+        first, last, peak = lineage.get(int(sid), (int(created), int(gen), 0))
+        lineage[int(sid)] = (first, max(last, int(gen)), max(peak, int(size)))
+    return lineage
+
+
+def summary(table):
+    """
+    print the headline trends of a run
+    :param table: dict of numpy arrays from load_table
+    :return: None
+    """
+    generations, nodes, enabled = size_trend(table)
+    print("{} genomes over {} checkpoints (generation {} to {})".format(
+        len(table["key"]), len(generations), generations[0], generations[-1]))
+    print("Mean nodes {:.1f} -> {:.1f}, mean enabled connections {:.1f} -> {:.1f}".format(
+        nodes[0], nodes[-1], enabled[0], enabled[-1]))
+    print("Distinct structures: {}".format(len(np.unique(table["hash"]))))
+
+    _, counts, mean, best = fitness_trend(table)
+    # the offspring in a checkpoint are not evaluated yet, only the elites have a fitness
+    print("Genomes with a fitness: {:.1f} of {:.1f} per checkpoint".format(
+        counts.mean(), len(table["key"]) / len(generations)))
+    if counts[-1]:
+        print("Elite fitness at the last checkpoint: mean {:.1f}, best {:.1f}".format(mean[-1], best[-1]))
+
+    lineage = species_lineage(table)
+    longest = sorted(lineage.items(), key=lambda item: item[1][1] - item[1][0], reverse=True)[:5]
+    print("Longest lived species:")
+    for sid, (created, last, peak) in longest:
+        print("  species {} created {} seen until {} peak size {}".format(sid, created, last, peak))
+
+    print("Fitness jumps:")
+    for gen, before, after in fitness_jumps(table):
+        print("  generation {}: {:.1f} -> {:.1f}".format(gen, before, after))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Analyse the NEAT checkpoints of a run.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    p = commands.add_parser("extract", help="read the checkpoints into a columnar .npz file")
+    p.add_argument("directory", nargs="?", default="checkpoints")
+    p.add_argument("--out", default="outputs/genomes.npz")
+    p.add_argument("--workers", type=int, default=None)
+    p = commands.add_parser("summary", help="print trends from an extracted table")
+    p.add_argument("table", nargs="?", default="outputs/genomes.npz")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        count = extract(args.directory, args.out, args.workers)
+        print("Extracted {} checkpoints into {}".format(count, args.out))
+    else:
+        summary(load_table(args.table))
@@ -0,0 +1,265 @@
+"""
+Compact storage of many genomes as flat arrays.
+
+A neat.DefaultGenome keeps a dict of gene objects, and every gene has its own
+__dict__, so a genome of ~25 nodes and ~25 connections takes about 13 KB.
+PackedGenomes keeps the genes of a whole batch in a handful of NumPy arrays
+instead, in the genomes' own dict order:
+
+    keys, fitness                 per genome
+    node_offsets                  genome i owns nodes node_offsets[i]:node_offsets[i + 1]
+    node_key, bias, response      per node
+    activation, aggregation       per node, ids into activation_names / aggregation_names
+    conn_offsets                  genome i owns connections conn_offsets[i]:conn_offsets[i + 1]
+    conn_in, conn_out             per connection
+    weight, enabled               per connection
+
+That is ~1 KB for the same genome. view(i) gives a light, read-only stand-in
+with the attributes create_network, export_genome and GenomeGraph read, and
+genome(i, config) rebuilds the exact neat genome.
+
+write(buf) lays the batch out in one flat buffer (e.g. a shared memory
+block): a header with the counts, the activation and aggregation names, then
+every array at an 8 byte aligned offset. from_buffer(buf) maps the arrays
+back without copying or unpickling anything, so processes sharing the buffer
+read the same genes, and writes to fitness land in the buffer.
+"""
+import numpy as np
+
+ARRAYS = ["keys", "fitness", "node_offsets", "node_key", "bias", "response", "activation", "aggregation",
+          "conn_offsets", "conn_in", "conn_out", "weight", "enabled"]
+
+# array name -> (dtype, what its length counts: genomes, genomes + 1, nodes or connections)
+LAYOUT = {"keys": (np.int64, "genomes"), "fitness": (np.float64, "genomes"),
+          "node_offsets": (np.int64, "offsets"), "node_key": (np.int64, "nodes"), "bias": (np.float64, "nodes"),
+          "response": (np.float64, "nodes"), "activation": (np.int8, "nodes"), "aggregation": (np.int8, "nodes"),
+          "conn_offsets": (np.int64, "offsets"), "conn_in": (np.int64, "connections"),
+          "conn_out": (np.int64, "connections"), "weight": (np.float64, "connections"),
+          "enabled": (bool, "connections")}
+# genomes, nodes, connections, bytes of names
+HEADER = 4
+
+
+def _align(size):
+    return -(-size // 8) * 8
+
+
+def _layout(genomes, nodes, connections, names_size):
+    """ offsets of the arrays in a buffer, and the buffer size """
+    counts = {"genomes": genomes, "offsets": genomes + 1, "nodes": nodes, "connections": connections}
+    offset = HEADER * 8 + _align(names_size)
+    offsets = {}
+    for name in ARRAYS:
+        dtype, count = LAYOUT[name]
+        offsets[name] = (offset, counts[count])
+        offset += _align(counts[count] * np.dtype(dtype).itemsize)
+    return offsets, offset
+
+
+class NodeView:
+    __slots__ = ("key", "bias", "response", "activation", "aggregation")
+
+    def __init__(self, key, bias, response, activation, aggregation):
+        self.key = key
+        self.bias = bias
+        self.response = response
+        self.activation = activation
+        self.aggregation = aggregation
+
+
+class ConnectionView:
+    __slots__ = ("key", "weight", "enabled")
+
+    def __init__(self, key, weight, enabled):
+        self.key = key
+        self.weight = weight
+        self.enabled = enabled
+
+
+class GenomeView:
+    """
+    The nodes and connections of one packed genome, as the few attributes the
+    network builders read. Its fitness can be set, like a genome's.
+    """
+    __slots__ = ("key", "fitness", "nodes", "connections")
+
+    def __init__(self, key, fitness, nodes, connections):
+        self.key = key
+        self.fitness = fitness
+        self.nodes = nodes
+        self.connections = connections
+
+
+class PackedGenomes:
+    """
+    A batch of genomes stored as flat arrays (see the module docstring)
+    """
+
+    def __init__(self, keys, fitness, node_offsets, node_key, bias, response, activation, aggregation,
+                 conn_offsets, conn_in, conn_out, weight, enabled, activation_names, aggregation_names):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.fitness = np.asarray(fitness, dtype=np.float64)
+        self.node_offsets = np.asarray(node_offsets, dtype=np.int64)
+        self.node_key = np.asarray(node_key, dtype=np.int64)
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.response = np.asarray(response, dtype=np.float64)
+        self.activation = np.asarray(activation, dtype=np.int8)
+        self.aggregation = np.asarray(aggregation, dtype=np.int8)
+        self.conn_offsets = np.asarray(conn_offsets, dtype=np.int64)
+        self.conn_in = np.asarray(conn_in, dtype=np.int64)
+        self.conn_out = np.asarray(conn_out, dtype=np.int64)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.enabled = np.asarray(enabled, dtype=bool)
+        self.activation_names = list(activation_names)
+        self.aggregation_names = list(aggregation_names)
+
+    @staticmethod
+    def pack(genomes):
+        """
+        copy the genes of many genomes into flat arrays
+        :param genomes: List of (genome id, genome) tuples
+        :return: PackedGenomes
+        """
+        activation_names, aggregation_names = {}, {}
+        keys, fitness, node_offsets, conn_offsets = [], [], [0], [0]
+        node_key, bias, response, activation, aggregation = [], [], [], [], []
+        conn_in, conn_out, weight, enabled = [], [], [], []
+        for key, g in genomes:
+            keys.append(key)
+            fitness.append(np.nan if g.fitness is None else g.fitness)
+            for k, ng in g.nodes.items():
+                node_key.append(k)
+                bias.append(ng.bias)
+                response.append(ng.response)
+                activation.append(activation_names.setdefault(ng.activation, len(activation_names)))
+                aggregation.append(aggregation_names.setdefault(ng.aggregation, len(aggregation_names)))
+            node_offsets.append(len(node_key))
+            for (a, b), cg in g.connections.items():
+                conn_in.append(a)
+                conn_out.append(b)
+                weight.append(cg.weight)
+                enabled.append(cg.enabled)
+            conn_offsets.append(len(conn_in))
+        return PackedGenomes(keys, fitness, node_offsets, node_key, bias, response, activation, aggregation,
+                             conn_offsets, conn_in, conn_out, weight, enabled,
+                             list(activation_names), list(aggregation_names))
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        """
+        :return: bytes held by the arrays (int)
+        """
+        return sum(getattr(self, name).nbytes for name in ARRAYS)
+
+    def arrays(self):
+        """
+        :return: dict of the flat arrays
+        """
+        return {name: getattr(self, name) for name in ARRAYS}
+
+    def _names(self):
+        return "\0".join(["\t".join(self.activation_names), "\t".join(self.aggregation_names)]).encode()
+
+    @property
+    def buffer_size(self):
+        """
+        :return: bytes write needs (int)
+        """
+        return _layout(len(self.keys), len(self.node_key), len(self.conn_in), len(self._names()))[1]
+
+    def write(self, buf, offset=0):
+        """
+        lay the batch out in a buffer, see from_buffer
+        :param buf: writable buffer of at least buffer_size bytes from offset
+        :param offset: where the batch starts in buf (a multiple of 8)
+        :return: bytes written (int)
+        """
+        names = self._names()
+        offsets, size = _layout(len(self.keys), len(self.node_key), len(self.conn_in), len(names))
+        np.ndarray(HEADER, np.int64, buf, offset)[:] = (len(self.keys), len(self.node_key), len(self.conn_in),
+                                                        len(names))
+        buf[offset + HEADER * 8:offset + HEADER * 8 + len(names)] = names
+        for name in ARRAYS:
+            at, count = offsets[name]
+            np.ndarray(count, LAYOUT[name][0], buf, offset + at)[:] = getattr(self, name)
+        return size
+
+    @staticmethod
+    def from_buffer(buf, offset=0):
+        """
+        map a batch laid out by write, the arrays are views into buf
+        :param buf: buffer holding the batch
+        :param offset: where the batch starts in buf
+        :return: PackedGenomes
+        """
+        genomes, nodes, connections, names_size = np.ndarray(HEADER, np.int64, buf, offset).tolist()
+        start = offset + HEADER * 8
+        activation_names, aggregation_names = bytes(buf[start:start + names_size]).decode().split("\0")
+        offsets, _ = _layout(genomes, nodes, connections, names_size)
+        arrays = [np.ndarray(count, LAYOUT[name][0], buf, offset + at) for name, (at, count) in offsets.items()]
+        return PackedGenomes(*arrays, activation_names.split("\t") if activation_names else [],
+                             aggregation_names.split("\t") if aggregation_names else [])
+
+    def slice(self, lo, hi):
+        """
+        genomes lo to hi as a batch of their own, sharing the gene arrays
+        :param lo: position of the first genome
+        :param hi: position after the last genome
+        :return: PackedGenomes
+        """
+        n0, n1 = self.node_offsets[lo], self.node_offsets[hi]
+        c0, c1 = self.conn_offsets[lo], self.conn_offsets[hi]
+        return PackedGenomes(self.keys[lo:hi], self.fitness[lo:hi], self.node_offsets[lo:hi + 1] - n0,
+                             self.node_key[n0:n1], self.bias[n0:n1], self.response[n0:n1],
+                             self.activation[n0:n1], self.aggregation[n0:n1], self.conn_offsets[lo:hi + 1] - c0,
+                             self.conn_in[c0:c1], self.conn_out[c0:c1], self.weight[c0:c1], self.enabled[c0:c1],
+                             self.activation_names, self.aggregation_names)
+
+    def view(self, i):
+        """
+        a read-only stand-in for genome i that networks can be built from
+        :param i: position of the genome in the batch
+        :return: GenomeView
+        """
+        lo, hi = self.node_offsets[i], self.node_offsets[i + 1]
+        nodes = {k: NodeView(k, b, r, self.activation_names[act], self.aggregation_names[agg])
+                 for k, b, r, act, agg in zip(self.node_key[lo:hi].tolist(), self.bias[lo:hi].tolist(),
+                                              self.response[lo:hi].tolist(), self.activation[lo:hi].tolist(),
+                                              self.aggregation[lo:hi].tolist())}
+        lo, hi = self.conn_offsets[i], self.conn_offsets[i + 1]
+        connections = {(a, b): ConnectionView((a, b), w, e)
+                       for a, b, w, e in zip(self.conn_in[lo:hi].tolist(), self.conn_out[lo:hi].tolist(),
+                                             self.weight[lo:hi].tolist(), self.enabled[lo:hi].tolist())}
+        fitness = float(self.fitness[i])
+        return GenomeView(int(self.keys[i]), None if np.isnan(fitness) else fitness, nodes, connections)
+
+    def views(self):
+        """
+        :return: List of (genome id, GenomeView) tuples, shaped like NEAT's genome lists
+        """
+        return [(int(key), self.view(i)) for i, key in enumerate(self.keys)]
+
+    def genome(self, i, config):
+        """
+        rebuild genome i as a neat genome, genes in their original order
+        :param i: position of the genome in the batch
+        :param config: neat.config.Config
+        :return: config.genome_type instance
+        """
+        genome_config = config.genome_config
+        view = self.view(i)
+        g = config.genome_type(view.key)
+        g.fitness = view.fitness
+        for k, nv in view.nodes.items():
+            ng = genome_config.node_gene_type(k)
+            ng.bias, ng.response = nv.bias, nv.response
+            ng.activation, ng.aggregation = nv.activation, nv.aggregation
+            g.nodes[k] = ng
+        for k, cv in view.connections.items():
+            cg = genome_config.connection_gene_type(k)
+            cg.weight, cg.enabled = cv.weight, cv.enabled
+            g.connections[k] = cg
+        return g
@@ -0,0 +1,199 @@
+"""
+Distills the winning network into a quantized decision table.
+
+The winner only ever turns left, right or not at all, decided from three
+inputs (Red X, Car X, Car Y). This samples that decision over the inputs
+the game can produce and stores it in a small int8 grid, so playing costs
+one array lookup per frame instead of a network activation.
+
+    python distill.py outputs/winner-road-fighter.json --out outputs/winner-road-fighter-table.npz
+"""
+import argparse
+import os
+import pickle
+
+import neat
+import numpy as np
+
+from artifacts import atomic_output
+from genome_graph import create_network
+from network_export import NumpyNetwork
+
+WIN_HEIGHT = 800
+
+ROAD_LEFT_BOUNDARY = 100
+ROAD_RIGHT_BOUNDARY = 340
+
+carsize = (33, 44)
+RED_VEL = 5
+RED_START_X = 250
+
+# the inputs road_fighter_ai feeds the network: the red car x, which moves
+# from its start in steps of RED_VEL, and the centre of the car ahead
+RED_X_RANGE = (ROAD_LEFT_BOUNDARY + (RED_START_X - ROAD_LEFT_BOUNDARY) % RED_VEL,
+               ROAD_RIGHT_BOUNDARY - carsize[0])
+CAR_X_RANGE = (ROAD_LEFT_BOUNDARY + round((2 * carsize[0] / 3) / 2),
+               ROAD_RIGHT_BOUNDARY - carsize[0] + round((2 * carsize[0] / 3) / 2))
+CAR_Y_RANGE = (-700 + round(carsize[1] / 2), WIN_HEIGHT + round(carsize[1] / 2))
+
+
+def decide(output):
+    """
+    the turn decision road_fighter_ai takes from a network output
+    :param output: the first network output (float)
+    :return: 1 for right, -1 for left, 0 for straight
+    """
+    if output > 0.5:
+        return 1
+    if output < -0.5:
+        return -1
+    return 0
+
+
+class DecisionTable:
+    """
+    A policy stored as a grid of decisions over (Red X, Car X, Car Y).
+    It has the same activate() method as a neat network, so it can be
+    used wherever the game expects one.
+    """
+
+    def __init__(self, table, lows, steps):
+        """
+        Initialize the table
+        :param table: int8 numpy array of decisions, one axis per input
+        :param lows: lowest value of each input
+        :param steps: width of a cell along each input
+        :return: None
+        """
+        self.table = table
+        self.lows = tuple(float(v) for v in lows)
+        self.steps = tuple(float(v) for v in steps)
+        self.shape = table.shape
+
+    def index(self, inputs):
+        """
+        grid cell of an input triple, clamped to the table
+        :param inputs: (red x, car x, car y)
+        :return: tuple of ints
+        """
+        return tuple(min(max(int((v - low) // step), 0), n - 1)
+                     for v, low, step, n in zip(inputs, self.lows, self.steps, self.shape))
+
+    def decide(self, inputs):
+        """
+        :param inputs: (red x, car x, car y)
+        :return: 1 for right, -1 for left, 0 for straight
+        """
+        return int(self.table[self.index(inputs)])
+
+    def activate(self, inputs):
+        """
+        drop-in for neat.nn.FeedForwardNetwork.activate
+        :param inputs: (red x, car x, car y)
+        :return: List with one output that maps back to the same decision
+        """
+        return [float(self.decide(inputs))]
+
+    def decide_batch(self, inputs):
+        """
+        :param inputs: (n, 3) numpy array
+        :return: (n,) int8 numpy array of decisions
+        """
+        cells = np.floor((inputs - np.array(self.lows)) / np.array(self.steps)).astype(np.int64)
+        cells = np.clip(cells, 0, np.array(self.shape) - 1)
+        return self.table[cells[:, 0], cells[:, 1], cells[:, 2]]
+
+    def save(self, filename):
+        """
+        atomically write the table to an .npz file
+        :param filename: location of the file
+        :return: None
+        """
+        with atomic_output(filename) as tmp:
+            with open(tmp, "wb") as f:
+                np.savez_compressed(f, table=self.table, lows=np.array(self.lows), steps=np.array(self.steps))
+
+    @staticmethod
+    def load(filename):
+        """
+        read a table written by save
+        :param filename: location of the file
+        :return: DecisionTable
+        """
+        with np.load(filename) as data:
+            return DecisionTable(data["table"], data["lows"], data["steps"])
+
+
+def network_decisions(net, inputs):
+    """
+    the decisions of a network for many inputs
+    :param net: object with an activate method
+    :param inputs: (n, 3) numpy array
+    :return: (n,) int8 numpy array of decisions
+    """
+    if hasattr(net, "activate_batch"):
+        outputs = net.activate_batch(inputs)[:, 0]
+        return np.where(outputs > 0.5, 1, np.where(outputs < -0.5, -1, 0)).astype(np.int8)
+    return np.array([decide(net.activate(row)[0]) for row in inputs.tolist()], dtype=np.int8)
+
+
+def distill(net, steps=(RED_VEL, 4, 8)):
+    """
+    sample a network at the centre of every grid cell
+    :param net: object with an activate method
+    :param steps: cell width along (red x, car x, car y)
+    :return: DecisionTable
+    """
+    ranges = (RED_X_RANGE, CAR_X_RANGE, CAR_Y_RANGE)
+    axes = []
+    for (low, high), step in zip(ranges, steps):
+        axes.append(np.arange(low, high + 1, step) + (step - 1) / 2.0)
+    # red x only takes values on its own step grid, so sample those exactly
+    axes[0] = np.arange(ranges[0][0], ranges[0][1] + 1, steps[0], dtype=float)
+
+    grid = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, 3)
+    table = network_decisions(net, grid).reshape([len(a) for a in axes])
+    return DecisionTable(table, [r[0] for r in ranges], steps)
+
+
+def agreement(table, net, samples=100000, seed=0):
+    """
+    fraction of random game inputs where the table and the network agree
+    :param table: DecisionTable
+    :param net: object with an activate method
+    :param samples: number of random inputs
+    :param seed: seed of the sampling
+    :return: float between 0 and 1
+    """
+    rng = np.random.default_rng(seed)
+    red_x = rng.integers(0, (RED_X_RANGE[1] - RED_X_RANGE[0]) // RED_VEL + 1, samples) * RED_VEL + RED_X_RANGE[0]
+    inputs = np.column_stack((red_x,
+                              rng.integers(CAR_X_RANGE[0], CAR_X_RANGE[1] + 1, samples),
+                              rng.integers(CAR_Y_RANGE[0], CAR_Y_RANGE[1] + 1, samples))).astype(float)
+    return float(np.mean(table.decide_batch(inputs) == network_decisions(net, inputs)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Distill the winner into a decision table.")
+    parser.add_argument("winner", nargs="?", default="outputs/winner-road-fighter.json",
+                        help="exported network (.json/.npz) or pickled genome (.pkl)")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(__file__), "config-feedforward.txt"))
+    parser.add_argument("--out", default="outputs/winner-road-fighter-table.npz")
+    parser.add_argument("--car-x-step", type=int, default=4)
+    parser.add_argument("--car-y-step", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.winner.endswith(".pkl"):
+        config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                                    neat.DefaultSpeciesSet, neat.DefaultStagnation,
+                                    args.config)
+        with open(args.winner, "rb") as f:
+            winner = pickle.load(f)
+        net = create_network(winner, config)
+    else:
+        net = NumpyNetwork.load(args.winner)
+
+    table = distill(net, (RED_VEL, args.car_x_step, args.car_y_step))
+    table.save(args.out)
+    print("Wrote {} cells to {}, agreement with the network {:.2%}".format(
+        table.table.size, args.out, agreement(table, net)))
@@ -0,0 +1,141 @@
+"""
+Long-lived process pool for headless evaluations.
+
+neat.ParallelEvaluator pickles every genome, and the config with it, for
+every task, and the workers build everything they need from scratch. An
+EvaluationPool starts its workers once, with the state every evaluation
+needs (config, fitness weights, ...), and keeps them for the whole run, so
+anything a worker caches stays warm from one generation to the next.
+
+Each generation the genomes are packed into flat arrays (see
+compact_genome.py), which are laid out in a shared memory block together
+with a result array. A job only carries the range of genomes to play and
+the arguments of the evaluation (seeds, ...). The worker maps the arrays
+straight from the block, builds the networks from them and writes the
+fitness into the result array, so no genome is pickled on the way.
+
+    pool = EvaluationPool(4, evaluate, state)
+    fitness = pool.evaluate(genomes, seeds)   # (len(genomes), len(seeds))
+    pool.close()
+
+evaluate(packed, state, *args) runs in the workers and must be a module
+level function.
+"""
+import multiprocessing
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from compact_genome import PackedGenomes
+from shutdown import ignore_interrupts
+
+# jobs per worker and evaluation; more than one evens out chunks of unequal cost
+CHUNKS_PER_WORKER = 2
+
+_evaluate = None
+_state = None
+_blocks = {}
+
+
+def _init(evaluate, state):
+    """ set up a worker with the state of the run """
+    global _evaluate, _state
+    ignore_interrupts()
+    _evaluate = evaluate
+    _state = state
+
+
+def _attach(name):
+    """ open a shared block the pool created """
+    block = shared_memory.SharedMemory(name=name)
+    # before Python 3.13 every process that opens a block also tracks it, and
+    # unlinks it when it exits; only the pool that created it should
+    resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+def _job(job):
+    """ evaluate genomes lo to hi of the block. Runs in the workers. """
+    name, lo, hi, results_offset, columns, args = job
+    block = _blocks.get(name)
+    if block is None:
+        # the pool replaces its block when it needs a bigger one
+        for old in _blocks.values():
+            old.close()
+        _blocks.clear()
+        block = _blocks[name] = _attach(name)
+    genomes = PackedGenomes.from_buffer(block.buf)
+    results = np.ndarray((len(genomes), columns), np.float64, block.buf, results_offset)
+    results[lo:hi] = _evaluate(genomes.slice(lo, hi), _state, *args)
+
+
+class EvaluationPool:
+    """
+    Worker processes that keep their state across generations (see the module docstring)
+    """
+
+    def __init__(self, workers, evaluate, state):
+        """
+        Start the workers
+        :param workers: number of worker processes
+        :param evaluate: function (PackedGenomes, state, seeds, *args) -> (len(genomes), len(seeds)) fitness
+        :param state: anything the workers need, sent to each worker once
+        :return: None
+        """
+        self.workers = workers
+        self.pool = multiprocessing.Pool(workers, initializer=_init, initargs=(evaluate, state))
+        self.block = None
+        # seconds spent packing and laying out the genomes, and in total, for the last evaluation
+        self.transfer_time = 0.0
+        self.total_time = 0.0
+
+    def _reserve(self, size):
+        """ the shared block, grown to hold at least size bytes """
+        if self.block is None or self.block.size < size:
+            if self.block is not None:
+                self.block.close()
+                self.block.unlink()
+                size = max(size, 2 * self.block.size)
+            self.block = shared_memory.SharedMemory(create=True, size=size)
+        return self.block
+
+    def evaluate(self, genomes, seeds, *args):
+        """
+        play the genomes on every seed in the workers
+        :param genomes: List of (genome id, genome) tuples
+        :param seeds: List of traffic seeds (int)
+        :param args: more arguments of the evaluate function
+        :return: (len(genomes), len(seeds)) numpy array of fitness
+        """
+        start = time.perf_counter()
+        seeds = list(seeds)
+        if not genomes:
+            return np.zeros((0, len(seeds)))
+        packed = PackedGenomes.pack(genomes)
+        results_offset = packed.buffer_size
+        block = self._reserve(results_offset + len(genomes) * len(seeds) * 8)
+        packed.write(block.buf)
+        bounds = np.linspace(0, len(genomes), min(len(genomes), self.workers * CHUNKS_PER_WORKER) + 1).astype(int)
+        jobs = [(block.name, lo, hi, results_offset, len(seeds), (seeds,) + args)
+                for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist())]
+        self.transfer_time = time.perf_counter() - start
+
+        self.pool.map(_job, jobs, chunksize=1)
+        fitness = np.ndarray((len(genomes), len(seeds)), np.float64, block.buf, results_offset).copy()
+        self.total_time = time.perf_counter() - start
+        return fitness
+
+    def close(self):
+        """
+        stop the workers and free the shared block
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.block is not None:
+            self.block.close()
+            self.block.unlink()
+            self.block = None
@@ -0,0 +1,105 @@
+"""
+Fitness shaping from per-agent event counters.
+
+During an episode the simulation only counts what happened to every red
+car, in NumPy arrays indexed by agent:
+
+    frames        frames survived
+    passed        cars passed (by any red car) while this one was alive
+    near_misses   frames spent level with a car and within NEAR_MISS_GAP pixels of it
+    jerk          sum of |change of steering| between frames, steering being -1, 0 or 1
+    crash         how the episode ended: CRASH_NONE, CRASH_COLLISION or CRASH_OFF_ROAD
+
+When the episode ends the counters are combined into a fitness with one
+weight per counter (and per crash type). The weights are read from the
+[Fitness] section of the NEAT config file, so trying another reward is a
+config change:
+
+    [Fitness]
+    frames    = 0.1
+    passed    = 5
+    collision = -1
+
+Missing weights keep their DEFAULT_WEIGHTS, which give the original fitness.
+"""
+import configparser
+
+import numpy as np
+
+CRASH_NONE = 0
+CRASH_COLLISION = 1
+CRASH_OFF_ROAD = 2
+
+NEAR_MISS_GAP = 10
+
+DEFAULT_WEIGHTS = {
+    "frames": 0.1,
+    "passed": 5.0,
+    "near_misses": 0.0,
+    "jerk": 0.0,
+    "collision": -1.0,
+    "off_road": 0.0,
+}
+
+
+class EpisodeEvents:
+    """
+    Event counters of every agent of one episode
+    """
+
+    def __init__(self, num_agents):
+        """
+        Initialize the counters at zero
+        :param num_agents: number of red cars in the episode
+        :return: None
+        """
+        self.frames = np.zeros(num_agents, dtype=np.int64)
+        self.passed = np.zeros(num_agents, dtype=np.int64)
+        self.near_misses = np.zeros(num_agents, dtype=np.int64)
+        self.jerk = np.zeros(num_agents, dtype=np.int64)
+        self.crash = np.zeros(num_agents, dtype=np.int8)
+        self.last_action = np.zeros(num_agents, dtype=np.int8)
+
+    def act(self, agents, actions):
+        """
+        record one frame of steering
+        :param agents: agent indices
+        :param actions: steering of each agent, -1 left, 0 straight, 1 right
+        :return: None
+        """
+        actions = np.asarray(actions, dtype=np.int8)
+        self.jerk[agents] += np.abs(actions - self.last_action[agents])
+        self.last_action[agents] = actions
+
+    def fitness(self, weights=None):
+        """
+        combine the counters
+        :param weights: dict of weights, missing ones default to DEFAULT_WEIGHTS
+        :return: numpy array with the fitness of every agent
+        """
+        w = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        return (w["frames"] * self.frames
+                + w["passed"] * self.passed
+                + w["near_misses"] * self.near_misses
+                + w["jerk"] * self.jerk
+                + w["collision"] * (self.crash == CRASH_COLLISION)
+                + w["off_road"] * (self.crash == CRASH_OFF_ROAD))
+
+
+def load_weights(filename, section="Fitness"):
+    """
+    read the fitness weights from a config file
+    :param filename: location of the config file
+    :param section: section holding the weights
+    :return: dict of weights
+    """
+    parser = configparser.ConfigParser()
+    parser.read(filename)
+    weights = dict(DEFAULT_WEIGHTS)
+    if parser.has_section(section):
+        for name, value in parser.items(section):
+            if name not in DEFAULT_WEIGHTS:
+                raise ValueError("Unknown fitness weight {!r} in {}, expected one of {}".format(
+                    name, filename, ", ".join(DEFAULT_WEIGHTS)))
+            weights[name] = float(value)
+    return weights
@@ -0,0 +1,175 @@
+"""
+Off-screen, low resolution grayscale rendering of the road fighter scene.
+
+Nothing in here needs a display: the sprites are loaded and downsampled once,
+and every frame is composed into a reused NumPy buffer.
+"""
+import os
+
+import numpy as np
+import pygame
+
+WIN_WIDTH = 400
+WIN_HEIGHT = 800
+
+FRAME_WIDTH = 42
+FRAME_HEIGHT = 84
+
+carsize = (33, 44)
+
+SPRITE_FILES = {
+    "red": "redcar.png",
+    "yellow": "yellowcar.png",
+    "blue": "bluecar.png",
+    "otherred": "otherredcar.png",
+}
+
+
+def to_gray(rgb):
+    """
+    convert a (w, h, 3) surfarray into a (h, w) uint8 grayscale array
+    :param rgb: numpy array in pygame surfarray layout
+    :return: numpy array
+    """
+    gray = rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+    return np.ascontiguousarray(gray.T.round().astype(np.uint8))
+
+
+def load_gray(path, size):
+    """
+    load an image, scale it to size and return its grayscale pixels and alpha mask
+    :param path: location of the image file
+    :param size: (width, height) of the result in frame pixels
+    :return: (gray, mask) numpy arrays of shape (height, width)
+    """
+    surface = pygame.transform.smoothscale(pygame.image.load(path), size)
+    gray = to_gray(pygame.surfarray.array3d(surface))
+    mask = np.ascontiguousarray(pygame.surfarray.array_alpha(surface).T > 127)
+    return gray, mask
+
+
+class FrameRenderer:
+    """
+    Draws the road, the traffic and the red cars into a low resolution
+    grayscale frame. The returned frame is always the same array, so copy
+    it (or push it into a FrameStack) before rendering the next one.
+    """
+
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, image_dir="images"):
+        """
+        Initialize the renderer
+        :param width: frame width in pixels (int)
+        :param height: frame height in pixels (int)
+        :param image_dir: directory holding the game sprites
+        :return: None
+        """
+        self.width = width
+        self.height = height
+        self.scale_x = width / WIN_WIDTH
+        self.scale_y = height / WIN_HEIGHT
+
+        road, _ = load_gray(os.path.join(image_dir, "base.png"), (width, height))
+        # two stacked copies of the road, so every scroll offset is a single slice
+        self.road_strip = np.concatenate((road, road))
+
+        sprite_size = (max(1, round(carsize[0] * self.scale_x)), max(1, round(carsize[1] * self.scale_y)))
+        self.sprites = {}
+        for color, filename in SPRITE_FILES.items():
+            self.sprites[color] = load_gray(os.path.join(image_dir, filename), sprite_size)
+
+        self.frame = np.zeros((height, width), dtype=np.uint8)
+
+    def draw_road(self, base_y):
+        """
+        copy the scrolled road into the frame
+        :param base_y: the y1 offset of the Base object (int)
+        :return: None
+        """
+        offset = int(base_y * self.scale_y) % self.height
+        self.frame[:] = self.road_strip[self.height - offset:2 * self.height - offset]
+
+    def draw_sprite(self, color, x, y):
+        """
+        draw one car sprite with its top left corner at window position (x, y)
+        :param color: Str, one of [red, yellow, blue, otherred]
+        :param x: window x pos (int)
+        :param y: window y pos (int)
+        :return: None
+        """
+        gray, mask = self.sprites[color]
+        h, w = gray.shape
+        fx = int(round(x * self.scale_x))
+        fy = int(round(y * self.scale_y))
+
+        x0, y0 = max(fx, 0), max(fy, 0)
+        x1, y1 = min(fx + w, self.width), min(fy + h, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        sx, sy = x0 - fx, y0 - fy
+        np.copyto(self.frame[y0:y1, x0:x1],
+                  gray[sy:sy + y1 - y0, sx:sx + x1 - x0],
+                  where=mask[sy:sy + y1 - y0, sx:sx + x1 - x0])
+
+    def render(self, base_y, othercars, redcars):
+        """
+        compose a full frame
+        :param base_y: the y1 offset of the Base object (int)
+        :param othercars: List of objects with x, y and color attributes
+        :param redcars: List of objects with x and y attributes
+        :return: (height, width) uint8 numpy array, reused between calls
+        """
+        self.draw_road(base_y)
+        for car in othercars:
+            self.draw_sprite(car.color, car.x, car.y)
+        for redcar in redcars:
+            self.draw_sprite("red", redcar.x, redcar.y)
+        return self.frame
+
+
+class FrameStack:
+    """
+    Ring buffer of the last num_frames frames.
+
+    Every frame is written twice, num_frames slots apart, so the newest
+    num_frames frames are always one contiguous slice of the buffer and
+    can be handed out as a view without copying.
+    """
+
+    def __init__(self, num_frames=4, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+        """
+        Initialize the ring buffer
+        :param num_frames: number of stacked frames (int)
+        :param width: frame width in pixels (int)
+        :param height: frame height in pixels (int)
+        :return: None
+        """
+        self.num_frames = num_frames
+        self.buffer = np.zeros((2 * num_frames, height, width), dtype=np.uint8)
+        self.pos = 0
+
+    def reset(self, frame):
+        """
+        fill every slot with the same frame, e.g. at the start of an episode
+        :param frame: (height, width) numpy array
+        :return: None
+        """
+        self.buffer[:] = frame
+        self.pos = 0
+
+    def push(self, frame):
+        """
+        append a frame, dropping the oldest one
+        :param frame: (height, width) numpy array
+        :return: None
+        """
+        self.buffer[self.pos] = frame
+        self.buffer[self.pos + self.num_frames] = frame
+        self.pos = (self.pos + 1) % self.num_frames
+
+    def observation(self):
+        """
+        the stacked frames, oldest first
+        :return: (num_frames, height, width) view into the ring buffer
+        """
+        return self.buffer[self.pos:self.pos + self.num_frames]
@@ -0,0 +1,167 @@
+"""
+Graph analysis of a NEAT genome, built once with adjacency lists.
+
+neat-python's own helpers (required_for_output, feed_forward_layers) rescan
+the whole connection list for every frontier and every node. Here each
+connection is visited a constant number of times, and the same graph is used
+for drawing (visualize.draw_net) and for building the network that plays.
+"""
+import hashlib
+from collections import deque
+
+import neat
+import numpy as np
+
+
+class GenomeGraph:
+    """
+    Adjacency lists of a feed-forward genome, and what can be derived from
+    them: reachability, topological order, depth and parameter count.
+    """
+
+    def __init__(self, genome, config, include_disabled=False):
+        """
+        Build the graph
+        :param genome: neat.DefaultGenome
+        :param config: neat.config.Config (or its genome_config)
+        :param include_disabled: also follow disabled connections
+        :return: None
+        """
+        genome_config = getattr(config, "genome_config", config)
+        self.genome = genome
+        self.input_keys = list(genome_config.input_keys)
+        self.output_keys = list(genome_config.output_keys)
+
+        # incoming links keep the genome's connection order, so sums are
+        # accumulated in the same order as neat.nn.FeedForwardNetwork
+        self.incoming = {}
+        self.outgoing = {}
+        self.connections = []
+        for cg in genome.connections.values():
+            if not (cg.enabled or include_disabled):
+                continue
+            a, b = cg.key
+            self.connections.append(cg)
+            self.incoming.setdefault(b, []).append((a, cg.weight))
+            self.outgoing.setdefault(a, []).append(b)
+
+    def ancestors(self, nodes):
+        """
+        every node with a path into one of nodes, plus nodes themselves
+        :param nodes: iterable of node keys
+        :return: set of node keys
+        """
+        seen = set(nodes)
+        pending = deque(seen)
+        while pending:
+            for a, _ in self.incoming.get(pending.popleft(), ()):
+                if a not in seen:
+                    seen.add(a)
+                    pending.append(a)
+        return seen
+
+    def required_nodes(self):
+        """
+        nodes needed to compute the outputs, like neat.graphs.required_for_output
+        :return: set of node keys (inputs excluded)
+        """
+        return self.ancestors(self.output_keys).difference(self.input_keys)
+
+    def layers(self):
+        """
+        required nodes grouped in evaluation layers, like neat.graphs.feed_forward_layers.
+        A node is evaluated once all of its inputs are; nodes that depend on
+        something never evaluated (e.g. a hidden node without inputs) are left out.
+        :return: List of Lists of node keys
+        """
+        required = self.required_nodes()
+        remaining = {n: len(self.incoming.get(n, ())) for n in required}
+        layers = []
+        current = list(self.input_keys)
+        while current:
+            layer = []
+            for a in current:
+                for b in self.outgoing.get(a, ()):
+                    if b in remaining:
+                        remaining[b] -= 1
+                        if remaining[b] == 0:
+                            layer.append(b)
+            if layer:
+                layers.append(layer)
+            current = layer
+        return layers
+
+    def topological_order(self):
+        """
+        :return: List of the evaluated node keys, every node after its inputs
+        """
+        return [n for layer in self.layers() for n in layer]
+
+    def depth(self):
+        """
+        :return: number of evaluation layers between the inputs and the outputs (int)
+        """
+        return len(self.layers())
+
+    def effective_parameters(self):
+        """
+        weights and biases that can change the output
+        :return: int
+        """
+        order = self.topological_order()
+        return len(order) + sum(len(self.incoming.get(n, ())) for n in order)
+
+    def node_evals(self, config):
+        """
+        the node_evals list neat.nn.FeedForwardNetwork is built from
+        :param config: neat.config.Config
+        :return: List of (node, activation, aggregation, bias, response, links)
+        """
+        genome_config = config.genome_config
+        node_evals = []
+        for node in self.topological_order():
+            ng = self.genome.nodes[node]
+            node_evals.append((node,
+                               genome_config.activation_defs.get(ng.activation),
+                               genome_config.aggregation_function_defs.get(ng.aggregation),
+                               ng.bias, ng.response, self.incoming[node]))
+        return node_evals
+
+    def edge_attributes(self):
+        """
+        Graphviz attributes of every connection in the graph, computed in bulk
+        :return: List of (input key, output key, attribute dict)
+        """
+        if not self.connections:
+            return []
+        weights = np.array([cg.weight for cg in self.connections])
+        enabled = np.array([cg.enabled for cg in self.connections])
+        styles = np.where(enabled, 'solid', 'dotted').tolist()
+        colors = np.where(weights > 0, 'green', 'red').tolist()
+        widths = (0.1 + np.abs(weights / 5.0)).tolist()
+        return [(cg.key[0], cg.key[1], {'style': style, 'color': color, 'penwidth': str(width)})
+                for cg, style, color, width in zip(self.connections, styles, colors, widths)]
+
+
+def structural_hash(genome):
+    """
+    hash of a genome's topology: its node keys and enabled connections
+    :param genome: neat.DefaultGenome
+    :return: int that fits in a uint64
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(repr(sorted(genome.nodes)).encode())
+    h.update(repr(sorted(k for k, cg in genome.connections.items() if cg.enabled)).encode())
+    return int.from_bytes(h.digest(), "little")
+
+
+def create_network(genome, config):
+    """
+    build the same network as neat.nn.FeedForwardNetwork.create in O(nodes + connections)
+    :param genome: neat.DefaultGenome
+    :param config: neat.config.Config
+    :return: neat.nn.FeedForwardNetwork
+    """
+    graph = GenomeGraph(genome, config)
+    return neat.nn.FeedForwardNetwork(config.genome_config.input_keys, config.genome_config.output_keys,
+                                      graph.node_evals(config))
@@ -0,0 +1,229 @@
+"""
+A bounded archive of the best genomes seen during a run.
+
+NEAT only hands back the single fittest genome, and that fitness comes from
+one episode on one traffic seed, so a lucky run can win. The hall of fame
+keeps the top genomes of every generation, one per structure (see
+genome_graph.structural_hash), and from time to time plays them all again on
+fresh seeds. The final winner is the entry with the best re-evaluated mean.
+
+A genome is played on fresh seeds before it enters, so every entry is ranked
+by a re-evaluated mean; a single lucky training episode never pushes a
+re-evaluated genome out.
+
+On disk the archive is a directory with one pickle per entry and an
+index.json describing them:
+
+    hall_of_fame/index.json
+    hall_of_fame/<hash>.pkl
+"""
+import bisect
+import copy
+import json
+import os
+import pickle
+import random
+
+import neat
+
+from artifacts import atomic_write
+from genome_graph import structural_hash
+
+INDEX_FILE = "index.json"
+
+
+def remove_file(filename):
+    """
+    delete a file if it exists
+    :param filename: location of the file
+    :return: None
+    """
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+
+
+class HallOfFame(neat.reporting.BaseReporter):
+    """
+    Keeps at most `capacity` genomes, ranked by their score: the mean of their
+    re-evaluations when they have any, else the fitness they were archived with.
+    """
+
+    def __init__(self, directory="hall_of_fame", capacity=20, per_generation=3,
+                 evaluate=None, interval=10, seeds=3, writer=None):
+        """
+        Initialize the archive
+        :param directory: where the genomes and the index are written
+        :param capacity: maximum number of genomes kept
+        :param per_generation: number of a generation's best genomes offered to the archive
+        :param evaluate: function(genomes, seeds) -> (len(genomes), len(seeds)) array of fitness,
+                         used to re-evaluate the archive; None never re-evaluates
+        :param interval: re-evaluate every this many generations
+        :param seeds: number of fresh seeds per re-evaluation
+        :param writer: ArtifactWriter that writes the files, None writes them directly
+        :return: None
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self.per_generation = per_generation
+        self.evaluate = evaluate
+        self.interval = interval
+        self.seeds = seeds
+        self.writer = writer
+        self.rng = random.Random()
+        self.generation = None
+
+        # structural hash -> entry dict, and (score, hash) pairs in ascending order
+        self.entries = {}
+        self.genomes = {}
+        self.ranking = []
+
+    def __getstate__(self):
+        # the archive is checkpointed with the species set; the writer thread
+        # and the evaluation function belong to the running process
+        state = self.__dict__.copy()
+        state['writer'] = None
+        state['evaluate'] = None
+        return state
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def score(entry):
+        """
+        :param entry: entry dict
+        :return: mean re-evaluated fitness, or the archived fitness if never re-evaluated
+        """
+        if entry["evaluations"]:
+            return entry["total"] / entry["evaluations"]
+        return entry["fitness"]
+
+    def _rank(self, h):
+        bisect.insort(self.ranking, (self.score(self.entries[h]), h))
+
+    def _unrank(self, h):
+        del self.ranking[bisect.bisect_left(self.ranking, (self.score(self.entries[h]), h))]
+
+    def _path(self, h):
+        return os.path.join(self.directory, "{:016x}.pkl".format(h))
+
+    def _write(self, fn, *args):
+        if self.writer is not None:
+            self.writer.submit(fn, *args)
+        else:
+            fn(*args)
+
+    def _save_index(self):
+        entries = sorted(self.entries.values(), key=self.score, reverse=True)
+        self._write(atomic_write, os.path.join(self.directory, INDEX_FILE),
+                    json.dumps(entries, indent=1).encode())
+
+    def add(self, genome, generation=None, fitness=()):
+        """
+        offer a genome to the archive. It is kept if its structure is new or
+        it scores above the genome archived with that structure, and it
+        ranks above the worst entry of a full archive. A genome replacing one
+        of the same structure starts its own evaluations, since its weights
+        differ.
+        :param genome: evaluated neat.DefaultGenome
+        :param generation: generation the genome comes from
+        :param fitness: fitness of the genome on fresh seeds; without any it
+                        ranks by its own fitness until it is re-evaluated
+        :return: Bool, True if the genome was archived
+        """
+        h = structural_hash(genome)
+        old = self.entries.get(h)
+        entry = {"hash": "{:016x}".format(h), "key": genome.key, "generation": generation,
+                 "fitness": genome.fitness, "evaluations": len(fitness), "total": float(sum(fitness))}
+        score = self.score(entry)
+        if old is not None and self.score(old) >= score:
+            return False
+        if old is None and len(self.entries) >= self.capacity and self.ranking[0][0] >= score:
+            return False
+
+        if old is not None:
+            self._unrank(h)
+        self.entries[h] = entry
+        self.genomes[h] = copy.deepcopy(genome)
+        self._rank(h)
+        self._write(atomic_write, self._path(h), pickle.dumps(self.genomes[h], protocol=pickle.HIGHEST_PROTOCOL))
+
+        while len(self.entries) > self.capacity:
+            _, worst = self.ranking.pop(0)
+            del self.entries[worst]
+            del self.genomes[worst]
+            self._write(remove_file, self._path(worst))
+        return True
+
+    def reevaluate(self, seeds=None):
+        """
+        play every archived genome on fresh seeds and add the results to their means
+        :param seeds: List of traffic seeds, defaults to `self.seeds` new random ones
+        :return: None
+        """
+        if self.evaluate is None or not self.entries:
+            return
+        if seeds is None:
+            seeds = [self.rng.randrange(2 ** 32) for _ in range(self.seeds)]
+        keys = list(self.entries)
+        genomes = [(self.entries[h]["key"], self.genomes[h]) for h in keys]
+        fitness = self.evaluate(genomes, seeds)
+        for h, row in zip(keys, fitness):
+            entry = self.entries[h]
+            self._unrank(h)
+            entry["evaluations"] += len(row)
+            entry["total"] += float(sum(row))
+            self._rank(h)
+            # the evaluation overwrites the fitness; keep the archived one on the genome
+            self.genomes[h].fitness = entry["fitness"]
+        self._save_index()
+
+    def best(self, n=1):
+        """
+        the top of the archive
+        :param n: number of genomes
+        :return: List of (entry dict, genome), best first
+        """
+        return [(self.entries[h], self.genomes[h]) for _, h in reversed(self.ranking[-n:])] if n > 0 else []
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        ranked = sorted((g for g in population.values() if g.fitness is not None),
+                        key=lambda g: g.fitness, reverse=True)
+        candidates = ranked[:self.per_generation]
+        fitness = [()] * len(candidates)
+        if self.evaluate is not None and candidates:
+            # on copies, since the evaluation overwrites the fitness of the population
+            seeds = [self.rng.randrange(2 ** 32) for _ in range(self.seeds)]
+            fitness = self.evaluate([(g.key, copy.deepcopy(g)) for g in candidates], seeds).tolist()
+        changed = False
+        for g, row in zip(candidates, fitness):
+            changed |= self.add(g, self.generation, row)
+
+        if self.evaluate is not None and self.generation is not None and (self.generation + 1) % self.interval == 0:
+            self.reevaluate()
+        elif changed:
+            self._save_index()
+
+    @classmethod
+    def load(cls, directory, **kwargs):
+        """
+        read an archive written by a previous run
+        :param directory: directory holding index.json and the genome pickles
+        :param kwargs: other HallOfFame arguments
+        :return: HallOfFame
+        """
+        hof = cls(directory, **kwargs)
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            entries = json.load(f)
+        for entry in entries:
+            h = int(entry["hash"], 16)
+            with open(hof._path(h), "rb") as f:
+                hof.genomes[h] = pickle.load(f)
+            hof.entries[h] = entry
+            hof._rank(h)
+        return hof
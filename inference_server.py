@@ -0,0 +1,408 @@
+"""
+Local inference service for an exported network.
+
+Loads an exported network (see network_export.py) once and answers turn
+decisions over HTTP and WebSocket, on localhost only. Requests that arrive
+within BATCH_WINDOW of each other are stacked and run through a single
+activate_batch call, so many clients cost about one forward pass.
+
+    python inference_server.py outputs/winner-road-fighter.json --port 8765
+
+    POST /act      {"inputs": [red_x, car_x, car_y]}
+                   -> {"output": 0.93, "action": "right"}
+    GET  /metrics  requests, batches, batch sizes, latency percentiles, throughput
+    GET  /ws       WebSocket; every text message is an /act request, answered in
+                   order, with its "id" echoed back when given
+
+The inputs are the ones road_fighter_ai.simulate feeds to the networks: the
+red car x, and the centre x and y of the car ahead. The action follows the
+same rule: right above 0.5, left below -0.5, straight otherwise.
+
+Only the standard library and NumPy are needed; the HTTP and WebSocket
+handling is the small subset that local clients use.
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+from network_export import NumpyNetwork
+
+HOST = "127.0.0.1"
+PORT = 8765
+
+# seconds a batch stays open for more requests after the first one arrives
+BATCH_WINDOW = 0.002
+MAX_BATCH = 512
+# latencies kept for the percentiles in /metrics
+LATENCY_WINDOW = 10000
+MAX_BODY = 1 << 20
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+# WebSocket close codes
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_UNSUPPORTED_DATA = 1003
+CLOSE_TOO_BIG = 1009
+
+
+class ProtocolError(Exception):
+    """
+    A WebSocket client broke the protocol; the connection is closed with `code`
+    """
+
+    def __init__(self, code, reason):
+        Exception.__init__(self, reason)
+        self.code = code
+
+
+def action(output):
+    """
+    the turn decision for a network output, as in road_fighter_ai.simulate
+    :param output: first output of the network (float)
+    :return: Str, one of [left, right, straight]
+    """
+    if output > 0.5:
+        return "right"
+    if output < -0.5:
+        return "left"
+    return "straight"
+
+
+class Batcher:
+    """
+    Collects concurrent requests and runs them through the network in batches
+    """
+
+    def __init__(self, network, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        """
+        Initialize the batcher
+        :param network: NumpyNetwork
+        :param window: seconds to wait for more requests once one is pending
+        :param max_batch: run the batch early once it holds this many requests
+        :return: None
+        """
+        self.network = network
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = []
+        self.full = None
+        self.task = None
+
+        self.started = time.monotonic()
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.busy_time = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    async def infer(self, inputs):
+        """
+        queue one request and wait for its batch
+        :param inputs: sequence of network inputs
+        :return: first network output (float)
+        """
+        # checked here, so a bad request fails on its own instead of with its batch
+        row = np.asarray(inputs, dtype=np.float64)
+        if row.shape != (self.network.num_inputs,):
+            raise ValueError("expected {0} numbers as inputs, got shape {1}".format(self.network.num_inputs,
+                                                                                   row.shape))
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((row, future, time.perf_counter()))
+        if self.task is None:
+            self._schedule()
+        elif len(self.pending) >= self.max_batch:
+            self.full.set()
+        return await future
+
+    def _schedule(self):
+        """ open a batch for the pending requests """
+        self.full = asyncio.Event()
+        if len(self.pending) >= self.max_batch:
+            self.full.set()
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        """ wait out the window, then answer up to max_batch pending requests """
+        try:
+            await asyncio.wait_for(self.full.wait(), self.window)
+        except asyncio.TimeoutError:
+            pass
+        batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        # requests beyond max_batch that arrived meanwhile go in the next batch
+        if self.pending:
+            self._schedule()
+        else:
+            self.task = None
+
+        start = time.perf_counter()
+        try:
+            outputs = self.network.activate_batch(np.stack([row for row, _, _ in batch]))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        end = time.perf_counter()
+
+        self.busy_time += end - start
+        self.requests += len(batch)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        for (_, future, queued), output in zip(batch, outputs[:, 0].tolist()):
+            self.latencies.append(end - queued)
+            if not future.done():
+                future.set_result(output)
+
+    def metrics(self):
+        """
+        :return: dict of counters, latency percentiles (ms) and throughput
+        """
+        uptime = time.monotonic() - self.started
+        latencies = np.array(self.latencies) * 1000
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist() if len(latencies) else (0.0, 0.0, 0.0)
+        return {
+            "uptime_s": uptime,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch": self.requests / self.batches if self.batches else 0.0,
+            "largest_batch": self.largest_batch,
+            "requests_per_s": self.requests / uptime if uptime > 0 else 0.0,
+            "forward_time_s": self.busy_time,
+            "latency_ms": {"p50": p50, "p90": p90, "p99": p99,
+                           "max": float(latencies.max()) if len(latencies) else 0.0},
+        }
+
+
+def answer(message, output):
+    """ the reply to one /act request """
+    reply = {"output": output, "action": action(output)}
+    if "id" in message:
+        reply["id"] = message["id"]
+    return reply
+
+
+class InferenceServer:
+    """
+    HTTP and WebSocket front end of a Batcher (see the module docstring)
+    """
+
+    def __init__(self, network, host=HOST, port=PORT, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        """
+        Initialize the server
+        :param network: NumpyNetwork
+        :param host: address to listen on, localhost by default
+        :param port: port to listen on, 0 picks a free one
+        :param window: batching window in seconds
+        :param max_batch: largest batch
+        :return: None
+        """
+        self.batcher = Batcher(network, window, max_batch)
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        """
+        start listening
+        :return: (host, port) the server listens on
+        """
+        self.server = await asyncio.start_server(self._connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.host, self.port
+
+    async def serve_forever(self):
+        """
+        start the server if needed and serve until cancelled
+        :return: None
+        """
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self):
+        """
+        stop listening
+        :return: None
+        """
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def _act(self, body):
+        """ run one /act request given as JSON bytes """
+        message = json.loads(body)
+        return answer(message, await self.batcher.infer(message["inputs"]))
+
+    async def _connection(self, reader, writer):
+        """ serve HTTP requests on a connection, until it closes or turns into a WebSocket """
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                method, path, _ = request.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    await self._respond(writer, 413, {"error": "body too large"}, close=True)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                if path == "/ws" and headers.get("upgrade", "").lower() == "websocket":
+                    if "sec-websocket-key" not in headers:
+                        await self._respond(writer, 400, {"error": "missing Sec-WebSocket-Key"}, close=True)
+                    else:
+                        await self._websocket(reader, writer, headers)
+                    break
+                close = headers.get("connection", "").lower() == "close"
+                if method == "POST" and path == "/act":
+                    try:
+                        status, reply = 200, await self._act(body)
+                    except (ValueError, KeyError, TypeError) as e:
+                        status, reply = 400, {"error": str(e)}
+                elif method == "GET" and path == "/metrics":
+                    status, reply = 200, self.batcher.metrics()
+                else:
+                    status, reply = 404, {"error": "not found"}
+                await self._respond(writer, status, reply, close)
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, reply, close=False):
+        """ write a JSON response """
+        body = json.dumps(reply).encode()
+        reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large"}[status]
+        writer.write("HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n"
+                     "Connection: {3}\r\n\r\n".format(status, reason, len(body),
+                                                      "close" if close else "keep-alive").encode() + body)
+        await writer.drain()
+
+    async def _websocket(self, reader, writer, headers):
+        """ answer /act messages over a WebSocket """
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+        writer.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                     b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+        await writer.drain()
+
+        # replies go out in request order, while later requests already join the batch
+        replies = asyncio.Queue()
+
+        async def send():
+            while True:
+                reply = await replies.get()
+                if reply is None:
+                    break
+                try:
+                    reply = await reply
+                except (ValueError, KeyError, TypeError) as e:
+                    reply = {"error": str(e)}
+                writer.write(_frame(0x1, json.dumps(reply).encode()))
+                await writer.drain()
+
+        sender = asyncio.get_running_loop().create_task(send())
+        # the data message being received, which may come in fragments
+        message_opcode = None
+        message = b""
+        try:
+            while True:
+                fin, opcode, payload = await _read_frame(reader)
+                if opcode >= 0x8:
+                    # control frames can come between the fragments of a message
+                    if not fin or len(payload) > 125:
+                        raise ProtocolError(CLOSE_PROTOCOL_ERROR, "bad control frame")
+                    if opcode == 0x8:
+                        writer.write(_frame(0x8, payload[:2]))
+                        break
+                    if opcode == 0x9:
+                        writer.write(_frame(0xA, payload))
+                    continue
+                if opcode == 0x0:
+                    if message_opcode is None:
+                        raise ProtocolError(CLOSE_PROTOCOL_ERROR, "continuation without a message")
+                elif message_opcode is not None:
+                    raise ProtocolError(CLOSE_PROTOCOL_ERROR, "new message before the last one ended")
+                else:
+                    message_opcode = opcode
+                message += payload
+                if len(message) > MAX_BODY:
+                    raise ProtocolError(CLOSE_TOO_BIG, "message too large")
+                if fin:
+                    if message_opcode != 0x1:
+                        raise ProtocolError(CLOSE_UNSUPPORTED_DATA, "only text messages are answered")
+                    replies.put_nowait(asyncio.ensure_future(self._act(message)))
+                    message_opcode = None
+                    message = b""
+        except ProtocolError as e:
+            writer.write(_frame(0x8, struct.pack("!H", e.code) + str(e).encode()))
+        finally:
+            replies.put_nowait(None)
+            await sender
+
+
+def _frame(opcode, payload):
+    """ a final, unmasked WebSocket frame """
+    if len(payload) < 126:
+        header = struct.pack("!BB", 0x80 | opcode, len(payload))
+    elif len(payload) < 1 << 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, len(payload))
+    return header + payload
+
+
+async def _read_frame(reader):
+    """ read one WebSocket frame; returns (final fragment, opcode, unmasked payload) """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack("!H", await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack("!Q", await reader.readexactly(8))
+    if length > MAX_BODY:
+        raise ProtocolError(CLOSE_TOO_BIG, "frame too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve the turn decisions of an exported network on localhost.")
+    parser.add_argument("network", help="exported network (.json or .npz)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--window", type=float, default=BATCH_WINDOW, help="batching window in seconds")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    args = parser.parse_args()
+
+    server = InferenceServer(NumpyNetwork.load(args.network), args.host, args.port, args.window, args.max_batch)
+
+    async def serve():
+        host, port = await server.start()
+        print("serving {0} on http://{1}:{2}".format(args.network, host, port))
+        await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
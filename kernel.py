@@ -0,0 +1,427 @@
+"""
+Array kernel for headless episodes.
+
+Since traffic comes from a TrafficSchedule, it does not depend on the red
+cars. road_fighter_ai.roll_traffic therefore plays the other cars of an
+episode once, with the game's own classes, and records what every frame
+looks like to the red cars, in segments of a few hundred frames:
+
+    obs_x, obs_y          per frame, the network inputs from the car ahead
+    car_offsets           frame f has the cars car_offsets[f]:car_offsets[f + 1], in update order
+    car_x, car_y          per car and frame, position after moving
+    car_pass              per car and frame, whether the car is passed on this frame
+
+play() then runs the red cars of a whole population on those arrays: every
+frame it evaluates the networks (NetworkBatch, exported networks back to
+back), steers, and tests passes, collisions, near misses and the road edges.
+It stops taking segments once every red car is dead, so the traffic is only
+rolled as far as the best car gets.
+It has two backends with the same results as road_fighter_ai.simulate:
+
+    "numba"   the frame loop compiled with Numba, cached on disk after the first call
+    "numpy"   every frame vectorized over the live agents, with no extra dependency
+
+BACKEND is "numba" when Numba is installed. To check both against simulate:
+
+    python kernel.py checkpoints/ckpt-959 --seeds 3
+"""
+import argparse
+import math
+import time
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+from fitness import EpisodeEvents, CRASH_COLLISION, CRASH_OFF_ROAD, NEAR_MISS_GAP
+from network_export import AGGREGATIONS, BATCH_ACTIVATIONS
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKEND = "numba" if numba is not None else "numpy"
+
+ROAD_LEFT_BOUNDARY = 100
+ROAD_RIGHT_BOUNDARY = 340
+
+RED_START = (250, 750)
+RED_VEL = 5
+RED_WIDTH = 33
+
+carsize = (33, 44)
+CAR_WIDTH = round(2 * carsize[0] / 3 + 2)
+CURRENTCAR_WIDTH = round(2 * carsize[0] / 3)
+HALF_HEIGHT = round(carsize[1] / 2)
+
+SUM, PRODUCT, MAX, MIN, MEAN = (AGGREGATIONS.index(name) for name in ["sum", "product", "max", "min", "mean"])
+
+Traffic = namedtuple("Traffic", ["obs_x", "obs_y", "car_offsets", "car_x", "car_y", "car_pass"])
+
+
+class NetworkBatch:
+    """
+    Exported networks (network_export.NumpyNetwork) back to back, with one
+    value vector per network in a shared flat array
+    """
+
+    def __init__(self, networks):
+        """
+        Concatenate the networks
+        :param networks: List of NumpyNetwork with one output each
+        :return: None
+        """
+        self.num_inputs = networks[0].num_inputs if networks else 3
+        self.size = len(networks)
+        node_offsets, value_offsets, link_offsets = [0], [0], [0]
+        output = []
+        for net in networks:
+            node_offsets.append(node_offsets[-1] + len(net.node_keys))
+            output.append(value_offsets[-1] + int(net.output_index[0]))
+            value_offsets.append(value_offsets[-1] + self.num_inputs + len(net.node_keys) + 1)
+        self.node_offsets = np.array(node_offsets, dtype=np.int64)
+        self.value_offsets = np.array(value_offsets, dtype=np.int64)
+        self.output = np.array(output, dtype=np.int64)
+
+        def concat(name, dtype):
+            parts = [getattr(net, name) for net in networks]
+            return np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+
+        self.bias = concat("bias", np.float64)
+        self.response = concat("response", np.float64)
+        self.activation = concat("activation", np.int64)
+        self.aggregation = concat("aggregation", np.int64)
+        self.link_weight = concat("conn_weight", np.float64)
+        # node i reads the links link_offsets[i]:link_offsets[i + 1], from
+        # link_src, an index into the flat value array
+        counts = [np.diff(net.conn_offsets) for net in networks]
+        self.link_offsets = np.concatenate([[0]] + counts).cumsum().astype(np.int64)
+        self.link_src = (np.concatenate([net.conn_src.astype(np.int64) + offset
+                                         for net, offset in zip(networks, value_offsets)])
+                         if networks else np.zeros(0, dtype=np.int64))
+        # the flat value slot every node writes
+        self.node_value = (np.concatenate([offset + net.num_inputs + np.arange(len(net.node_keys))
+                                           for net, offset in zip(networks, value_offsets)]).astype(np.int64)
+                           if networks else np.zeros(0, dtype=np.int64))
+
+
+def _activate(act, z):
+    """ network_export.SCALAR_ACTIVATIONS[act](z) """
+    if act == 0:
+        return 1.0 / (1.0 + math.exp(-max(-60.0, min(60.0, 5.0 * z))))
+    if act == 1:
+        return math.tanh(max(-60.0, min(60.0, 2.5 * z)))
+    if act == 2:
+        return math.sin(max(-60.0, min(60.0, 5.0 * z)))
+    if act == 3:
+        return math.exp(-5.0 * max(-3.4, min(3.4, z)) ** 2)
+    if act == 4:
+        return z if z > 0.0 else 0.0
+    if act == 5:
+        return 0.2 * math.log(1 + math.exp(max(-60.0, min(60.0, 5.0 * z))))
+    if act == 6:
+        return z
+    if act == 7:
+        return max(-1.0, min(1.0, z))
+    if act == 8:
+        return 0.0 if z == 0.0 else 1.0 / z
+    if act == 9:
+        return math.log(max(1e-7, z))
+    if act == 10:
+        return math.exp(max(-60.0, min(60.0, z)))
+    if act == 11:
+        return abs(z)
+    if act == 12:
+        return max(0.0, 1 - abs(z))
+    if act == 13:
+        return z ** 2
+    return z ** 3
+
+
+def _episode(obs_x, obs_y, car_offsets, car_x, car_y, car_pass,
+             node_offsets, value_offsets, output, bias, response, activation, aggregation,
+             link_offsets, link_src, link_weight, node_value,
+             red_x, alive, frames, passed, near_misses, jerk, crash, last_action):
+    """ the frame loop of the "numba" backend; the state and counters are updated in place, returns the score """
+    n = len(frames)
+    values = np.zeros(value_offsets[n])
+    dead = np.zeros(n, dtype=np.bool_)
+    live = 0
+    for a in range(n):
+        if alive[a]:
+            live += 1
+    score = 0
+    for f in range(len(obs_x)):
+        if live == 0:
+            break
+
+        for a in range(n):
+            if not alive[a]:
+                continue
+            frames[a] += 1
+            v = value_offsets[a]
+            values[v] = red_x[a]
+            values[v + 1] = obs_x[f]
+            values[v + 2] = obs_y[f]
+            for node in range(node_offsets[a], node_offsets[a + 1]):
+                agg = aggregation[node]
+                lo, hi = link_offsets[node], link_offsets[node + 1]
+                if agg == PRODUCT:
+                    s = 1.0
+                elif hi > lo and (agg == MAX or agg == MIN):
+                    s = values[link_src[lo]] * link_weight[lo]
+                else:
+                    s = 0.0
+                for k in range(lo, hi):
+                    x = values[link_src[k]] * link_weight[k]
+                    if agg == PRODUCT:
+                        s *= x
+                    elif agg == MAX:
+                        s = max(s, x)
+                    elif agg == MIN:
+                        s = min(s, x)
+                    else:
+                        s += x
+                if agg == MEAN and hi > lo:
+                    s /= hi - lo
+                values[node_value[node]] = _activate(activation[node], bias[node] + response[node] * s)
+            out = values[output[a]]
+            steer = 0
+            if out > 0.5:
+                steer = 1
+            if out < -0.5:
+                steer = -1
+            jerk[a] += abs(steer - last_action[a])
+            last_action[a] = steer
+            red_x[a] += RED_VEL * steer
+
+        add_car = False
+        for c in range(car_offsets[f], car_offsets[f + 1]):
+            if car_pass[c] and live > 0:
+                add_car = True
+            level = car_y[c] + HALF_HEIGHT >= RED_START[1] and car_y[c] <= RED_START[1] + HALF_HEIGHT
+            if not level:
+                continue
+            for a in range(n):
+                if alive[a] and not dead[a] and car_x[c] <= red_x[a] + CAR_WIDTH \
+                        and red_x[a] <= car_x[c] + CURRENTCAR_WIDTH:
+                    crash[a] = CRASH_COLLISION
+                    dead[a] = True
+                    live -= 1
+
+        if add_car:
+            score += 1
+            for a in range(n):
+                if alive[a] and not dead[a]:
+                    passed[a] += 1
+
+        for a in range(n):
+            if not alive[a] or dead[a]:
+                continue
+            for c in range(car_offsets[f], car_offsets[f + 1]):
+                if car_y[c] + HALF_HEIGHT >= RED_START[1] and car_y[c] <= RED_START[1] + HALF_HEIGHT:
+                    gap = max(car_x[c] - (red_x[a] + CAR_WIDTH), red_x[a] - (car_x[c] + CURRENTCAR_WIDTH))
+                    if 0 < gap <= NEAR_MISS_GAP:
+                        near_misses[a] += 1
+                        break
+            if red_x[a] < ROAD_LEFT_BOUNDARY or red_x[a] + RED_WIDTH > ROAD_RIGHT_BOUNDARY:
+                crash[a] = CRASH_OFF_ROAD
+                dead[a] = True
+                live -= 1
+
+        for a in range(n):
+            if dead[a]:
+                alive[a] = False
+                dead[a] = False
+    return score
+
+
+if numba is not None:
+    # compiled on first call, and cached on disk (in __pycache__) for later runs
+    _activate = numba.njit(cache=True)(_activate)
+    _episode_numba = numba.njit(cache=True)(_episode)
+
+
+def _run(episode, networks, traffic, events, red_x, alive):
+    return episode(traffic.obs_x, traffic.obs_y, traffic.car_offsets, traffic.car_x, traffic.car_y, traffic.car_pass,
+                   networks.node_offsets, networks.value_offsets, networks.output, networks.bias, networks.response,
+                   networks.activation, networks.aggregation, networks.link_offsets, networks.link_src,
+                   networks.link_weight, networks.node_value, red_x, alive,
+                   events.frames, events.passed, events.near_misses, events.jerk, events.crash, events.last_action)
+
+
+class _Program:
+    """ the nodes of the live networks grouped by their position in their network, for the "numpy" backend """
+
+    def __init__(self, networks, agents):
+        nodes_per_agent = np.diff(networks.node_offsets)[agents]
+        nodes = _ranges(networks.node_offsets[agents], nodes_per_agent)
+        step = np.arange(len(nodes)) - np.repeat(np.cumsum(nodes_per_agent) - nodes_per_agent, nodes_per_agent)
+        self.steps = []
+        for s in range(int(nodes_per_agent.max(initial=0))):
+            at = nodes[step == s]
+            counts = networks.link_offsets[at + 1] - networks.link_offsets[at]
+            links = _ranges(networks.link_offsets[at], counts)
+            starts = np.cumsum(counts) - counts
+            groups = []
+            for agg in np.unique(networks.aggregation[at]).tolist():
+                for act in np.unique(networks.activation[at]).tolist():
+                    sel = np.flatnonzero((networks.aggregation[at] == agg) & (networks.activation[at] == act))
+                    if len(sel):
+                        groups.append((agg, act, sel))
+            self.steps.append((at, networks.link_src[links], networks.link_weight[links], starts, counts, groups))
+
+
+def _ranges(starts, counts):
+    """ concatenation of the ranges starts[i]:starts[i] + counts[i] """
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(total)
+
+
+def _reduce(agg, products, starts, counts):
+    """ aggregate the link products of every node """
+    out = np.zeros(len(counts))
+    nonempty = counts > 0
+    if agg == PRODUCT:
+        out[:] = 1.0
+    if not nonempty.any():
+        return out
+    ufunc = {SUM: np.add, MEAN: np.add, PRODUCT: np.multiply, MAX: np.maximum, MIN: np.minimum}[agg]
+    out[nonempty] = ufunc.reduceat(products, starts[nonempty])
+    if agg == MEAN:
+        out[nonempty] /= counts[nonempty]
+    return out
+
+
+def _episode_numpy(networks, traffic, events, red_x, alive):
+    """ the "numpy" backend; the state and counters are updated in place, returns the score """
+    values = np.zeros(networks.value_offsets[networks.size])
+    agents = np.flatnonzero(alive)
+    program = _Program(networks, agents)
+    score = 0
+    for f in range(len(traffic.obs_x)):
+        if len(agents) == 0:
+            break
+        events.frames[agents] += 1
+
+        v = networks.value_offsets[agents]
+        values[v] = red_x[agents]
+        values[v + 1] = traffic.obs_x[f]
+        values[v + 2] = traffic.obs_y[f]
+        for at, src, weight, starts, counts, groups in program.steps:
+            products = values[src] * weight
+            for agg, act, sel in groups:
+                s = _reduce(agg, products, starts, counts)[sel]
+                z = networks.bias[at[sel]] + networks.response[at[sel]] * s
+                values[networks.node_value[at[sel]]] = BATCH_ACTIVATIONS[act](z)
+        out = values[networks.output[agents]]
+        steering = np.where(out > 0.5, 1, 0)
+        steering[out < -0.5] = -1
+        events.act(agents, steering)
+        red_x[agents] += RED_VEL * steering
+
+        lo, hi = traffic.car_offsets[f], traffic.car_offsets[f + 1]
+        car_x, car_y = traffic.car_x[lo:hi], traffic.car_y[lo:hi]
+        x = red_x[agents]
+        dead = np.zeros(len(agents), dtype=bool)
+        add_car = False
+        near = np.zeros(len(agents), dtype=bool)
+        for c in range(hi - lo):
+            if traffic.car_pass[lo + c] and not dead.all():
+                add_car = True
+            if car_y[c] + HALF_HEIGHT >= RED_START[1] and car_y[c] <= RED_START[1] + HALF_HEIGHT:
+                gap = np.maximum(car_x[c] - (x + CAR_WIDTH), x - (car_x[c] + CURRENTCAR_WIDTH))
+                crashed = (gap <= 0) & ~dead
+                events.crash[agents[crashed]] = CRASH_COLLISION
+                dead |= crashed
+                near |= (gap > 0) & (gap <= NEAR_MISS_GAP)
+
+        if add_car:
+            score += 1
+            events.passed[agents[~dead]] += 1
+        events.near_misses[agents[near & ~dead]] += 1
+        off_road = ~dead & ((x < ROAD_LEFT_BOUNDARY) | (x + RED_WIDTH > ROAD_RIGHT_BOUNDARY))
+        events.crash[agents[off_road]] = CRASH_OFF_ROAD
+        dead |= off_road
+
+        if dead.any():
+            alive[agents[dead]] = False
+            agents = agents[~dead]
+            program = _Program(networks, agents)
+    return score
+
+
+def play(networks, traffic, backend=None):
+    """
+    play one episode with a red car per network
+    :param networks: NetworkBatch
+    :param traffic: Traffic of the episode, or an iterable of consecutive Traffic segments
+                    (see road_fighter_ai.roll_traffic)
+    :param backend: "numba" or "numpy", None uses BACKEND
+    :return: (score of the episode, EpisodeEvents)
+    """
+    backend = backend or BACKEND
+    if backend == "numba" and numba is None:
+        warnings.warn("The numba backend needs the missing optional dependency (numba), using numpy")
+        backend = "numpy"
+    if backend == "numba":
+        episode = lambda *args: _run(_episode_numba, *args)
+    elif backend == "numpy":
+        episode = _episode_numpy
+    elif backend == "python":
+        # the numba backend's loop, interpreted; slow, for checking it without Numba
+        episode = lambda *args: _run(_episode, *args)
+    else:
+        raise ValueError("Unknown backend {!r}".format(backend))
+
+    events = EpisodeEvents(networks.size)
+    red_x = np.full(networks.size, RED_START[0], dtype=np.int64)
+    alive = np.ones(networks.size, dtype=bool)
+    score = 0
+    for segment in [traffic] if isinstance(traffic, Traffic) else traffic:
+        if not alive.any():
+            break
+        score += episode(networks, segment, events, red_x, alive)
+    return score, events
+
+
+if __name__ == '__main__':
+    import gzip
+    import os
+    import pickle
+
+    parser = argparse.ArgumentParser(description="Check the kernel backends against road_fighter_ai.simulate.")
+    parser.add_argument("checkpoint", help="NEAT checkpoint to take the genomes from")
+    parser.add_argument("--seeds", type=int, default=3, help="number of episodes")
+    parser.add_argument("--frames", type=int, default=3000, help="frame limit of each episode")
+    parser.add_argument("--python", action="store_true", help="also check the interpreted numba loop")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import road_fighter_ai
+    from network_export import export_genome
+
+    with gzip.open(args.checkpoint) as f:
+        _, config, population, _, _ = pickle.load(f)
+    genomes = list(population.items())
+    networks = NetworkBatch([export_genome(g, config) for _, g in genomes])
+    backends = ["numpy"] + (["numba"] if numba is not None else []) + (["python"] if args.python else [])
+
+    failed = False
+    for seed in range(args.seeds):
+        start = time.perf_counter()
+        score, _ = road_fighter_ai.simulate(genomes, config, seed, max_frames=args.frames)
+        expected = np.array([g.fitness for _, g in genomes])
+        line = "seed {}: simulate {:.3f}s".format(seed, time.perf_counter() - start)
+        for backend in backends:
+            start = time.perf_counter()
+            got_score, events = play(networks, road_fighter_ai.roll_traffic(seed, args.frames), backend)
+            fitness = events.fitness(road_fighter_ai.FITNESS_WEIGHTS)
+            same = got_score == score and np.allclose(fitness, expected)
+            failed |= not same
+            line += ", {} {:.3f}s {}".format(backend, time.perf_counter() - start, "ok" if same else "DIFFERENT")
+        print(line)
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,116 @@
+"""
+Memory footprint of training, per genome, per network and per agent.
+
+Sizes are measured with tracemalloc on real genomes (e.g. from a late
+checkpoint, where networks have grown), then scaled up to a population size:
+
+    python memory_profile.py checkpoints/ckpt-999 --pop-size 50000
+
+road_fighter_ai prints the same report every generation when MEMORY_PROFILE
+is set.
+"""
+import argparse
+import gc
+import gzip
+import pickle
+import tracemalloc
+
+from compact_genome import PackedGenomes
+from genome_graph import create_network
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+MB = 1024 * 1024
+
+
+def allocated(fn):
+    """
+    bytes still allocated by the objects fn creates
+    :param fn: function without arguments
+    :return: (result of fn, bytes)
+    """
+    gc.collect()
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    if started:
+        tracemalloc.stop()
+    return result, size
+
+
+def profile(genomes, config, make_agent=None):
+    """
+    measure the cost of each part of an evaluation, per item
+    :param genomes: List of (genome id, genome) tuples to measure on
+    :param config: neat.config.Config
+    :param make_agent: function without arguments that creates the per-agent game state, None skips it
+    :return: dict name -> bytes per item
+    """
+    n = max(len(genomes), 1)
+    data = pickle.dumps(genomes, protocol=pickle.HIGHEST_PROTOCOL)
+    sizes = {
+        "genome": allocated(lambda: pickle.loads(data))[1] / n,
+        "packed genome": PackedGenomes.pack(genomes).nbytes / n,
+        "checkpointed genome": len(data) / n,
+        "checkpointed genome (gzip)": len(gzip.compress(data, 5)) / n,
+        "network": allocated(lambda: [create_network(g, config) for _, g in genomes])[1] / n,
+    }
+    if make_agent is not None:
+        sizes["agent"] = allocated(lambda: [make_agent() for _ in range(n)])[1] / n
+    return sizes
+
+
+def peak_rss():
+    """
+    :return: peak resident memory of this process in bytes, None where unknown
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def report(sizes, pop_size):
+    """
+    print the sizes per item and scaled to a population
+    :param sizes: dict from profile
+    :param pop_size: population size to project to
+    :return: None
+    """
+    print("Memory per item and for a population of {}:".format(pop_size))
+    for name, size in sizes.items():
+        print("  {:<28} {:>10,.0f} B {:>10,.1f} MB".format(name, size, size * pop_size / MB))
+
+    # reproduction builds the next population while the current one is alive,
+    # and a checkpoint pickles it in memory before it is written
+    peak = (2 * sizes["genome"] + sizes["network"] + sizes.get("agent", 0)
+            + sizes["checkpointed genome"]) * pop_size
+    print("  {:<28} {:>23,.1f} MB".format("estimated peak", peak / MB))
+    rss = peak_rss()
+    if rss is not None:
+        print("  {:<28} {:>23,.1f} MB".format("peak RSS so far", rss / MB))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report the memory footprint of training.")
+    parser.add_argument("checkpoint", help="NEAT checkpoint to measure genomes from")
+    parser.add_argument("--pop-size", type=int, default=None, help="population to project to, defaults to the config's")
+    parser.add_argument("--no-agents", action="store_true", help="don't measure the game objects (needs pygame)")
+    args = parser.parse_args()
+
+    with gzip.open(args.checkpoint) as f:
+        _, config, population, _, _ = pickle.load(f)
+
+    make_agent = None
+    if not args.no_agents:
+        from road_fighter_ai import RedCar
+        make_agent = lambda: RedCar(250, 750)
+
+    report(profile(list(population.items()), config, make_agent), args.pop_size or config.pop_size)
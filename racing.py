@@ -0,0 +1,71 @@
+"""
+Racing evaluation of a population, in the style of successive halving.
+
+A single episode is a noisy fitness: the same genome can crash early on one
+traffic seed and drive on for minutes on another. Giving every genome many
+episodes is expensive, and most of them are spent on genomes that are
+clearly bad after the first one. Racing plays everyone on a few seeds, keeps
+the best 1/eta of them, gives those eta times more seeds, and so on:
+
+    round 0   n genomes        x 1 seed
+    round 1   n / 2 genomes    x 2 seeds
+    round 2   n / 4 genomes    x 4 seeds
+
+With the defaults that is 3n episodes for up to 7 per survivor, instead of 7n
+for evaluating everyone uniformly.
+
+The genomes end up with different sample counts, so their means are shrunk
+towards the population's first-round mean with `prior_weight` pseudo-episodes.
+A genome with one lucky episode then can't outrank one that held up over many.
+"""
+import math
+
+import numpy as np
+
+
+def race(genomes, evaluate, rng, rounds=3, eta=2, first_seeds=1, prior_weight=1.0):
+    """
+    evaluate genomes with successive halving
+    :param genomes: List of (genome id, genome) tuples
+    :param evaluate: function(genomes, seeds) -> (len(genomes), len(seeds)) array of fitness
+    :param rng: random.Random that draws the traffic seeds
+    :param rounds: number of halving rounds
+    :param eta: survivors of a round are the best 1/eta, and get eta times more seeds
+    :param first_seeds: seeds everyone is played on in the first round
+    :param prior_weight: pseudo-episodes of the first-round mean added to every genome
+    :return: (corrected fitness, number of episodes of each genome), numpy arrays in genomes order
+    """
+    n = len(genomes)
+    totals = np.zeros(n)
+    counts = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        return totals, counts
+
+    alive = np.arange(n)
+    prior = 0.0
+    num_seeds = first_seeds
+    for r in range(rounds):
+        seeds = [rng.randrange(2 ** 32) for _ in range(num_seeds)]
+        fitness = np.asarray(evaluate([genomes[i] for i in alive], seeds), dtype=float)
+        totals[alive] += fitness.sum(axis=1)
+        counts[alive] += len(seeds)
+        if r == 0:
+            prior = float(fitness.mean())
+        if r == rounds - 1 or len(alive) == 1:
+            break
+
+        means = totals[alive] / counts[alive]
+        keep = max(1, math.ceil(len(alive) / eta))
+        alive = alive[np.argsort(-means, kind="stable")[:keep]]
+        num_seeds *= eta
+
+    return (totals + prior_weight * prior) / (counts + prior_weight), counts
+
+
+def uniform_episodes(n, rounds=3, eta=2, first_seeds=1):
+    """
+    episodes needed to give every genome as many seeds as a race gives its finalists
+    :param n: number of genomes
+    :return: int
+    """
+    return n * first_seeds * sum(eta ** r for r in range(rounds))
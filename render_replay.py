@@ -0,0 +1,162 @@
+"""
+Renders a replay log written during training to PNG frames or a video file.
+
+    python render_replay.py replays/gen-0042.npz --frames frames/gen-0042
+    python render_replay.py replays/gen-0042.npz --video gen-0042.mp4
+
+Writing video needs the optional imageio package (with its ffmpeg plugin).
+No display is needed, everything is drawn on an off-screen surface.
+"""
+import argparse
+import os
+import warnings
+
+import numpy as np
+import pygame
+
+from replay import COLORS, load_replay
+
+try:
+    import imageio
+except ImportError:
+    imageio = None
+
+WIN_WIDTH = 400
+WIN_HEIGHT = 800
+
+carsize = (33, 44)
+
+
+def load_sprites(image_dir="images"):
+    """
+    load the sprites used by the game, without needing a display
+    :param image_dir: directory holding the game sprites
+    :return: dict of pygame surfaces
+    """
+    def load(name, size):
+        return pygame.transform.scale(pygame.image.load(os.path.join(image_dir, name)), size)
+
+    return {"red": load("redcar.png", carsize),
+            "yellow": load("yellowcar.png", carsize),
+            "blue": load("bluecar.png", carsize),
+            "otherred": load("otherredcar.png", carsize),
+            "base": load("base.png", (WIN_WIDTH, WIN_HEIGHT)),
+            "crash": load("crash_1.png", (60, 60))}
+
+
+def replay_frames(replay, sprites, font=None):
+    """
+    draws the replay one frame at a time
+    :param replay: dict of numpy arrays from replay.load_replay
+    :param sprites: dict of pygame surfaces from load_sprites
+    :param font: pygame font for the frame counter, or None
+    :return: generator of pygame surfaces (the same surface every time)
+    """
+    win = pygame.Surface((WIN_WIDTH, WIN_HEIGHT))
+    actions = replay["actions"]
+    frame_vel = int(replay["frame_vel"])
+    red_x = int(replay["start"][0]) + int(replay["red_vel"]) * np.cumsum(actions, dtype=np.int64)
+    red_y = int(replay["start"][1])
+    # -1 when the episode was cut off before the car crashed; older replays
+    # do not say, so they are drawn without the crash
+    death_frame = int(replay.get("death_frame", -1))
+
+    spawns = {}
+    for i, (frame, color, _, x, y) in enumerate(replay["spawns"]):
+        spawns.setdefault(int(frame), []).append((i, COLORS[color], int(x), int(y)))
+    moves = {}
+    for frame, car, x in replay["moves"]:
+        moves.setdefault(int(frame), []).append((int(car), int(x)))
+    removals = {}
+    for frame, car in replay["removals"]:
+        removals.setdefault(int(frame), []).append(int(car))
+
+    cars = {}
+    y1, y2 = 0, WIN_HEIGHT
+    for frame in range(len(actions)):
+        # the road scrolls exactly like Base.move
+        y1 += frame_vel
+        y2 += frame_vel
+        if y1 > WIN_HEIGHT:
+            y1 = y2 - WIN_HEIGHT
+        if y2 > WIN_HEIGHT:
+            y2 = y1 - WIN_HEIGHT
+
+        for car in cars.values():
+            car[2] += frame_vel
+        for car in removals.get(frame, []):
+            cars.pop(car, None)
+        for i, color, x, y in spawns.get(frame, []):
+            cars[i] = [color, x, y]
+        for car, x in moves.get(frame, []):
+            cars[car][1] = x
+
+        win.blit(sprites["base"], (0, y1))
+        win.blit(sprites["base"], (0, y2))
+        for color, x, y in cars.values():
+            win.blit(sprites[color], (x, y))
+        win.blit(sprites["red"], (int(red_x[frame]), red_y))
+        if frame == death_frame:
+            win.blit(sprites["crash"], (int(red_x[frame]) - 13, red_y - 8))
+        if font is not None:
+            label = font.render("Gen {} Frame {}".format(int(replay.get("generation", -1)), frame), 1, (0, 0, 0))
+            win.blit(label, (2, 20))
+        yield win
+
+
+def render(filename, frames_dir=None, video=None, fps=30, every=1, image_dir="images"):
+    """
+    render a replay log to PNG frames and/or a video file
+    :param filename: location of the replay file
+    :param frames_dir: directory for the PNG frames, or None
+    :param video: location of the video file, or None
+    :param fps: frames per second of the video
+    :param every: only keep every n-th frame
+    :param image_dir: directory holding the game sprites
+    :return: number of frames written
+    """
+    replay = load_replay(filename)
+    pygame.font.init()
+    font = pygame.font.SysFont("lucidacalligraphy", 18)
+    sprites = load_sprites(image_dir)
+
+    if frames_dir is not None and not os.path.exists(frames_dir):
+        os.makedirs(frames_dir)
+
+    writer = None
+    if video is not None:
+        if imageio is None:
+            warnings.warn("Writing video is not available due to a missing optional dependency (imageio)")
+        else:
+            writer = imageio.get_writer(video, fps=fps)
+
+    written = 0
+    try:
+        for frame, win in enumerate(replay_frames(replay, sprites, font)):
+            if frame % every:
+                continue
+            if frames_dir is not None:
+                pygame.image.save(win, os.path.join(frames_dir, "frame-{:06d}.png".format(frame)))
+            if writer is not None:
+                writer.append_data(pygame.surfarray.array3d(win).swapaxes(0, 1))
+            written += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render a road fighter replay log.")
+    parser.add_argument("replay", help="replay file written during training")
+    parser.add_argument("--frames", help="directory for PNG frames")
+    parser.add_argument("--video", help="video file to write, e.g. winner.mp4")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--every", type=int, default=1, help="only keep every n-th frame")
+    args = parser.parse_args()
+
+    if args.frames is None and args.video is None:
+        parser.error("nothing to do, pass --frames and/or --video")
+    count = render(args.replay, args.frames, args.video, args.fps, args.every)
+    print("Rendered {} frames from {}".format(count, args.replay))
@@ -0,0 +1,141 @@
+"""
+Compact replay logs of training episodes.
+
+A replay holds the traffic seed, the actions of one red car on every frame,
+the frame it crashed on (-1 if the episode ended first) and the traffic as
+deltas (spawns, sideways moves and removals). Every other car moves down
+by the same amount each frame, so its y position never has to be stored.
+"""
+import numpy as np
+
+from artifacts import atomic_output
+
+ACTION_LEFT = -1
+ACTION_NONE = 0
+ACTION_RIGHT = 1
+
+COLORS = ["yellow", "blue", "otherred"]
+DIRECTIONS = [None, "left", "right"]
+
+
+class EpisodeLog:
+    """
+    Records one episode of a whole population. Actions are kept for every
+    red car until the best one is known at the end of the episode.
+    """
+
+    def __init__(self, seed, num_agents, start, red_vel, frame_vel):
+        """
+        Initialize the log
+        :param seed: seed of the traffic random generator (int)
+        :param num_agents: number of red cars in the episode (int)
+        :param start: (x, y) starting position of the red cars
+        :param red_vel: sideways speed of the red cars (int)
+        :param frame_vel: downward speed of the road and the other cars (int)
+        :return: None
+        """
+        self.seed = seed
+        self.num_agents = num_agents
+        self.start = start
+        self.red_vel = red_vel
+        self.frame_vel = frame_vel
+        self.actions = []
+        self.current = np.zeros(num_agents, dtype=np.int8)
+        self.death_frame = np.full(num_agents, -1, dtype=np.int32)
+        self.cars = {}
+        self.spawns = []
+        self.moves = []
+        self.removals = []
+
+    def act(self, agent, action):
+        """
+        record the action of a red car on the current frame
+        :param agent: index of the red car in the episode (int)
+        :param action: one of ACTION_LEFT, ACTION_NONE, ACTION_RIGHT
+        :return: None
+        """
+        self.current[agent] = action
+
+    def retire(self, agent):
+        """
+        record that a red car died on the current frame
+        :param agent: index of the red car in the episode (int)
+        :return: None
+        """
+        self.death_frame[agent] = len(self.actions)
+
+    def end_frame(self, othercars):
+        """
+        close the current frame, storing the actions and the traffic changes
+        :param othercars: List of other cars after they moved this frame
+        :return: None
+        """
+        frame = len(self.actions)
+        self.actions.append(self.current)
+        self.current = np.zeros(self.num_agents, dtype=np.int8)
+
+        seen = set()
+        for car in othercars:
+            uid = id(car)
+            seen.add(uid)
+            known = self.cars.get(uid)
+            if known is None:
+                # keep the car referenced so its id() can't be reused while tracked
+                self.cars[uid] = [len(self.spawns), car.x, car]
+                self.spawns.append((frame, COLORS.index(car.color), DIRECTIONS.index(car.dir), car.x, car.y))
+            elif known[1] != car.x:
+                known[1] = car.x
+                self.moves.append((frame, known[0], car.x))
+
+        for uid in [uid for uid in self.cars if uid not in seen]:
+            self.removals.append((frame, self.cars.pop(uid)[0]))
+
+    def extract(self, agent, **meta):
+        """
+        build the replay of a single red car, cut at the frame it died
+        :param agent: index of the red car in the episode (int)
+        :param meta: extra scalars stored with the replay (generation, fitness...)
+        :return: dict of numpy arrays
+        """
+        end = self.death_frame[agent] + 1 if self.death_frame[agent] >= 0 else len(self.actions)
+        end = min(int(end), len(self.actions))
+        actions = np.array([row[agent] for row in self.actions[:end]], dtype=np.int8)
+
+        spawns = np.array([s for s in self.spawns if s[0] < end], dtype=np.int32).reshape(-1, 5)
+        moves = np.array([m for m in self.moves if m[0] < end], dtype=np.int32).reshape(-1, 3)
+        removals = np.array([r for r in self.removals if r[0] < end], dtype=np.int32).reshape(-1, 2)
+
+        replay = {"seed": np.int64(self.seed),
+                  "start": np.array(self.start, dtype=np.int32),
+                  "red_vel": np.int32(self.red_vel),
+                  "frame_vel": np.int32(self.frame_vel),
+                  "actions": actions,
+                  "death_frame": np.int32(self.death_frame[agent]),
+                  "spawns": spawns,
+                  "moves": moves,
+                  "removals": removals}
+        for key, value in meta.items():
+            replay[key] = np.asarray(value)
+        return replay
+
+
+def save_replay(filename, replay):
+    """
+    atomically write a replay to a compressed .npz file
+    :param filename: location of the replay file
+    :param replay: dict of numpy arrays from EpisodeLog.extract
+    :return: None
+    """
+    with atomic_output(filename) as tmp:
+        with open(tmp, "wb") as f:
+            np.savez_compressed(f, **replay)
+
+
+def load_replay(filename):
+    """
+    read a replay written by save_replay
+    :param filename: location of the replay file
+    :return: dict of numpy arrays
+    """
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
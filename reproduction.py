@@ -0,0 +1,197 @@
+"""
+Reproduction that breeds the offspring in parallel chunks.
+
+neat.DefaultReproduction makes every child in turn: pick two parents, cross
+them over and mutate the child, gene by gene. ParallelReproduction does the
+bookkeeping the same way (stagnation, adjusted fitness, spawn amounts,
+elites, parent cut-off), then cuts the list of children to make into chunks
+of `chunk_size` and breeds the chunks on a process pool.
+
+Every chunk gets its own random stream, seeded from one number drawn from
+`random` per generation, and its own range of new node keys. The result
+therefore only depends on the random state, which is saved in every
+checkpoint, and not on the number of workers or the order chunks finish in.
+
+Use it through the Config constructor, with a [ParallelReproduction]
+section in the config file:
+
+    neat.config.Config(neat.DefaultGenome, ParallelReproduction,
+                       neat.DefaultSpeciesSet, neat.DefaultStagnation, config_file)
+"""
+import math
+import multiprocessing
+import random
+from itertools import count
+
+from neat.config import ConfigParameter, DefaultClassConfig
+from neat.math_util import mean
+from neat.reproduction import DefaultReproduction
+
+from shutdown import ignore_interrupts
+
+
+def breed(job):
+    """
+    make the children of one chunk. Runs in the worker processes.
+    :param job: (seed, genome type, genome config, first new node key, plans), a plan being
+                (parents as a List of (genome id, genome), ids of the children to make from them)
+    :return: List of (child id, child, (parent1 id, parent2 id))
+    """
+    seed, genome_type, genome_config, node_key, plans = job
+    state = random.getstate()
+    random.seed(seed)
+    genome_config.node_indexer = count(node_key)
+    try:
+        children = []
+        for parents, gids in plans:
+            for gid in gids:
+                parent1_id, parent1 = random.choice(parents)
+                parent2_id, parent2 = random.choice(parents)
+                child = genome_type(gid)
+                child.configure_crossover(parent1, parent2, genome_config)
+                child.mutate(genome_config)
+                children.append((gid, child, (parent1_id, parent2_id)))
+        return children
+    finally:
+        random.setstate(state)
+
+
+class ParallelReproduction(DefaultReproduction):
+    """ DefaultReproduction that breeds the offspring in chunks on a process pool. """
+
+    @classmethod
+    def parse_config(cls, param_dict):
+        return DefaultClassConfig(param_dict,
+                                  [ConfigParameter('elitism', int, 0),
+                                   ConfigParameter('survival_threshold', float, 0.2),
+                                   ConfigParameter('min_species_size', int, 2),
+                                   ConfigParameter('workers', int, 0),
+                                   ConfigParameter('chunk_size', int, 500)])
+
+    def __init__(self, config, reporters, stagnation):
+        DefaultReproduction.__init__(self, config, reporters, stagnation)
+        self.pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    def close(self):
+        """
+        stop the worker processes
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def reproduce(self, config, species, pop_size, generation):
+        """
+        Creates the next generation like DefaultReproduction.reproduce, breeding in parallel chunks.
+        """
+        # Filter out stagnated species and compute the adjusted fitness of the others.
+        all_fitnesses = []
+        remaining_species = []
+        for stag_sid, stag_s, stagnant in self.stagnation.update(species, generation):
+            if stagnant:
+                self.reporters.species_stagnant(stag_sid, stag_s)
+            else:
+                all_fitnesses.extend(m.fitness for m in stag_s.members.values())
+                remaining_species.append(stag_s)
+
+        # No species left.
+        if not remaining_species:
+            species.species = {}
+            return {}
+
+        min_fitness = min(all_fitnesses)
+        max_fitness = max(all_fitnesses)
+        fitness_range = max(1.0, max_fitness - min_fitness)
+        for afs in remaining_species:
+            msf = mean([m.fitness for m in afs.members.values()])
+            afs.adjusted_fitness = (msf - min_fitness) / fitness_range
+
+        adjusted_fitnesses = [s.adjusted_fitness for s in remaining_species]
+        avg_adjusted_fitness = mean(adjusted_fitnesses)
+        self.reporters.info("Average adjusted fitness: {:.3f}".format(avg_adjusted_fitness))
+
+        # Compute the number of new members for each species in the new generation.
+        previous_sizes = [len(s.members) for s in remaining_species]
+        elitism = self.reproduction_config.elitism
+        min_species_size = max(self.reproduction_config.min_species_size, elitism)
+        spawn_amounts = self.compute_spawn(adjusted_fitnesses, previous_sizes, pop_size, min_species_size)
+
+        # A population restored from a checkpoint comes with a fresh genome
+        # indexer; make sure children never reuse the key of a surviving genome.
+        last_key = max(key for s in remaining_species for key in s.members)
+        self.genome_indexer = count(max(next(self.genome_indexer), last_key + 1))
+
+        # Keep the elites and plan the children: (parents, child ids) per species.
+        new_population = {}
+        plans = []
+        species.species = {}
+        for spawn, s in zip(spawn_amounts, remaining_species):
+            spawn = max(spawn, elitism)
+            assert spawn > 0
+
+            old_members = list(s.members.items())
+            s.members = {}
+            species.species[s.key] = s
+            old_members.sort(reverse=True, key=lambda x: x[1].fitness)
+
+            for i, m in old_members[:elitism]:
+                new_population[i] = m
+                spawn -= 1
+
+            if spawn <= 0:
+                continue
+
+            repro_cutoff = int(math.ceil(self.reproduction_config.survival_threshold * len(old_members)))
+            repro_cutoff = max(repro_cutoff, 2)
+            plans.append((old_members[:repro_cutoff], [next(self.genome_indexer) for _ in range(spawn)]))
+
+        for gid, child, parents in self._breed(config, plans):
+            new_population[gid] = child
+            self.ancestors[gid] = parents
+
+        return new_population
+
+    def _breed(self, config, plans):
+        """ cut the plans into chunks, breed them and return the children in plan order """
+        if not plans:
+            return []
+        genome_config = config.genome_config
+        chunk_size = self.reproduction_config.chunk_size
+
+        chunks = [[]]
+        room = chunk_size
+        for parents, gids in plans:
+            while gids:
+                if room == 0:
+                    chunks.append([])
+                    room = chunk_size
+                part, gids = gids[:room], gids[room:]
+                chunks[-1].append((parents, part))
+                room -= len(part)
+
+        # every child adds at most one node, so chunk c may use the node keys
+        # first_node + c * chunk_size onwards without clashing with another chunk
+        if genome_config.node_indexer is None:
+            genome_config.node_indexer = count(max(max(g.nodes) for parents, _ in plans for _, g in parents) + 1)
+        first_node = next(genome_config.node_indexer)
+        seed = random.randrange(2 ** 32)
+        jobs = [((seed << 32) + c, config.genome_type, genome_config, first_node + c * chunk_size, chunk)
+                for c, chunk in enumerate(chunks)]
+
+        workers = self.reproduction_config.workers
+        if workers > 1 and len(jobs) > 1:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(workers, initializer=ignore_interrupts)
+            results = self.pool.map(breed, jobs, chunksize=1)
+        else:
+            results = [breed(job) for job in jobs]
+
+        genome_config.node_indexer = count(first_node + len(chunks) * chunk_size)
+        return [child for children in results for child in children]
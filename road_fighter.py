@@ -1,11 +1,22 @@
 """
 The classic game of road fighter
+
+    python road_fighter.py [--ghost outputs/winner-road-fighter.json] [--seed 7]
+
+With --ghost, an exported network races along as a translucent red car. Its
+whole run on the game's traffic seed is played headless before the game
+starts, and only its x position per frame is kept, so drawing the ghost is
+one blit per frame.
 """
+import argparse
 import pygame
 import random
 import os
 import numpy as np
 
+from network_export import NumpyNetwork
+from traffic import TrafficSchedule, turn_seed
+
 pygame.font.init()  # init font
 
 WIN_WIDTH = 400
@@ -15,6 +26,17 @@ ROAD_LEFT_BOUNDARY = 100
 ROAD_RIGHT_BOUNDARY = 340
 
 FRAME_VEL = 15
+FPS = 45
+
+GHOST_ALPHA = 110
+GHOST_MAX_FRAMES = 20000
+
+# states of the game loop
+READY = "ready"
+PLAYING = "playing"
+PAUSED = "paused"
+GAME_OVER = "game over"
+QUIT = "quit"
 
 STAT_FONT = pygame.font.SysFont("lucidacalligraphy", 18)
 SCORE_FONT = pygame.font.SysFont("lucidacalligraphy", 18)
@@ -31,6 +53,13 @@ regen = pygame.image.load(os.path.join("images", "regencar.png")).convert_alpha(
 truck = pygame.image.load(os.path.join("images", "truck.png")).convert_alpha()
 base_img = pygame.transform.scale(pygame.image.load(os.path.join("images", "base.png")).convert_alpha(), (400, 800))
 crash = pygame.transform.scale(pygame.image.load(os.path.join("images", "crash_1.png")), (60, 60))
+ghost = red.copy()
+ghost.set_alpha(GHOST_ALPHA)
+# two road images on top of each other, without alpha so a frame of road is
+# a single plain copy out of the strip
+road_strip = pygame.Surface((base_img.get_width(), 2 * base_img.get_height())).convert()
+road_strip.blit(base_img, (0, 0))
+road_strip.blit(base_img, (0, base_img.get_height()))
 
 
 class RedCar:
@@ -65,12 +94,13 @@ class RedCar:
 
 class OtherCar:
 
-    def __init__(self, color, id, y, dir=None):
+    def __init__(self, color, id, y, dir=None, x=None):
         """
         Initialize the antagonist Other Car object
         :param color: Str, one of [yellow, blue, otherred]
         :param y: starting y pos (int)
         :param dir: Str, one of the directions [left, right]
+        :param x: starting x pos (int), None draws a random one
         :return: None
         """
         self.color = color
@@ -82,7 +112,7 @@ class OtherCar:
             self.img = otherred
         self.width = self.img.get_width()
         self.id = id
-        self.x = random.randrange(ROAD_LEFT_BOUNDARY, ROAD_RIGHT_BOUNDARY - self.width)
+        self.x = random.randrange(ROAD_LEFT_BOUNDARY, ROAD_RIGHT_BOUNDARY - self.width) if x is None else x
         self.y = y
         self.origin = (self.x, self.y)
         self.dir = dir
@@ -192,133 +222,276 @@ class Base:
     def __init__(self):
         """
         Initialize the object
-        :param y: int
         :return: None
         """
         self.x = 0
-        self.y1 = 0
         self.vel = FRAME_VEL
-        self.y2 = self.HEIGHT
+        self.offset = 0
+        self.distance = 0
 
     def move(self):
         """
         move road so it looks like its scrolling
         :return: None
         """
-        self.y1 += self.vel
-        self.y2 += self.vel
-
-        if self.y1 > self.HEIGHT:
-            self.y1 = self.y2 - self.HEIGHT
-
-        if self.y2 > self.HEIGHT:
-            self.y2 = self.y1 - self.HEIGHT
+        self.offset = (self.offset + self.vel) % self.HEIGHT
+        self.distance += self.vel
 
     def draw(self, win):
         """
-        Draw the floor. This is two images that move together.
+        Draw the road, scrolled down by offset
         :param win: the pygame surface/window
         :return: None
         """
-        win.blit(self.IMG, (self.x, self.y1))
-        win.blit(self.IMG, (self.x, self.y2))
+        win.blit(road_strip, (self.x, 0), pygame.Rect(0, self.HEIGHT - self.offset, self.WIDTH, self.HEIGHT))
 
 
-def end_screen(win):
+def get_mask(img):
     """
-    display an end screen when the player loses
-    :param win: the pygame window surface
+    gets the mask for the current image
     :return: None
     """
-    run = True
-    text_label = STAT_FONT.render("Press Space to Restart", 1, (0, 0, 0))
-    while run:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                run = False
+    return pygame.mask.from_surface(img)
 
-            if event.type == pygame.KEYDOWN and event.key == pygame.K_SPACE:
-                main(win, True)
 
-        win.blit(text_label, ((ROAD_LEFT_BOUNDARY + ROAD_RIGHT_BOUNDARY)/ 2 - text_label.get_width() / 2, WIN_HEIGHT/2))
-        pygame.display.update()
+class GameView:
+    """
+    Draws the game. While the road scrolls every pixel changes, so a frame
+    is one copy of the road, the sprites and a full update; the still
+    screens (ready, paused, game over) are drawn once and then only their
+    changed rectangles are updated. Text surfaces are rendered once, or
+    when the score changes.
+    """
 
-    pygame.quit()
-    quit()
+    def __init__(self, win):
+        """
+        Initialize the view
+        :param win: pygame window surface
+        :return: None
+        """
+        self.win = win
+        self.score = None
+        self.score_label = None
+        self.labels = {READY: STAT_FONT.render("Press Space to Start", 1, (0, 0, 0)),
+                       PAUSED: STAT_FONT.render("Paused, Press Space to Resume", 1, (0, 0, 0)),
+                       GAME_OVER: STAT_FONT.render("Press Space to Restart", 1, (0, 0, 0))}
+        # the state the screen shows, None when it needs a full redraw
+        self.shown = None
+
+    def label(self, score):
+        """
+        returns the score text surface, rendering it only when the score changes
+        :param score: score of the game (int)
+        :return: pygame surface
+        """
+        if score != self.score:
+            self.score = score
+            self.score_label = SCORE_FONT.render("Score: " + str(score), 1, (0, 0, 0))
+        return self.score_label
+
+    def draw(self, state, redcar, othercars, base, score, crashed_at=None, ghost_x=None):
+        """
+        draw the current frame
+        :param state: one of READY, PLAYING, PAUSED, GAME_OVER
+        :param redcar: a Red Car object
+        :param othercars: List of other cars
+        :param base: Base object
+        :param score: score of the game (int)
+        :param crashed_at: (x, y) of the crash on the game over screen
+        :param ghost_x: x of the ghost car, None when there is none
+        :return: None
+        """
+        win = self.win
+        if state == PLAYING or self.shown is None:
+            base.draw(win)
+            for car in othercars:
+                car.draw(win)
+            if ghost_x is not None:
+                win.blit(ghost, (ghost_x, redcar.y))
+            redcar.draw(win)
+            win.blit(self.label(score), (2, 20))
+            if state == PLAYING:
+                self.shown = None
+                pygame.display.update()
+                return
+
+        if state == self.shown:
+            # nothing moves on a still screen
+            return
+        dirty = []
+        if crashed_at is not None:
+            win.blit(crash, crashed_at)
+            dirty.append(pygame.Rect(crashed_at, crash.get_size()))
+        text = self.labels[state]
+        at = ((ROAD_LEFT_BOUNDARY + ROAD_RIGHT_BOUNDARY) / 2 - text.get_width() / 2, WIN_HEIGHT / 2)
+        win.blit(text, at)
+        dirty.append(pygame.Rect(at, text.get_size()))
+        if self.shown is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(dirty)
+        self.shown = state
 
+    def invalidate(self):
+        """
+        redraw everything on the next frame
+        :return: None
+        """
+        self.shown = None
 
-def get_mask(img):
+
+class Game:
     """
-    gets the mask for the current image
-    :return: None
+    One game: the red car, the traffic and the score. The traffic comes from
+    the seed, as in road_fighter_ai.simulate, so a network trained there sees
+    the same game.
     """
-    return pygame.mask.from_surface(img)
 
+    def __init__(self, seed=None):
+        """
+        Initialize a new game
+        :param seed: seed of the traffic (int), None draws one
+        :return: None
+        """
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.rng = random.Random(turn_seed(self.seed))
+        self.traffic = TrafficSchedule(self.seed)
+        self.red = RedCar(250, 750)
+        self.base = Base()
+        self.othercars = [OtherCar(*spawn) for spawn in self.traffic.start()]
+        self.frame = 0
+        self.score = 0
+        self.crashed_at = None
+
+    def observation(self):
+        """
+        the inputs the networks get: red car x, and the centre of the car ahead
+        :return: tuple of 3 numbers
+        """
+        othercars = self.othercars
+        red = self.red
+        car_ind = 0
+        if len(othercars) > 1 and red.y < othercars[0].y:
+            car_ind = 1
+        elif len(othercars) > 2 and red.y < othercars[1].y:
+            car_ind = 2
+        elif len(othercars) > 3 and red.y < othercars[2].y:
+            car_ind = 3
+        return (red.x,
+                othercars[car_ind].x + round((2 * carsize[0] / 3)/2),
+                othercars[car_ind].y + round(carsize[1] / 2))
+
+    def step(self, move_left, move_right):
+        """
+        play one frame
+        :param move_left: the player steers left (Bool)
+        :param move_right: the player steers right (Bool)
+        :return: False once the red car crashed, else True
+        """
+        red = self.red
+        othercars = self.othercars
+        self.frame += 1
+        self.base.move()
+
+        if move_left:
+            red.turn("left")
+        if move_right:
+            red.turn("right")
+
+        rem = []
+        add_car = False
+
+        for car in othercars:
+            car.move()
+
+            if car.color == "blue" and car.y > self.rng.randint(400, 500):
+                car.turn()
+
+            if car.color == "otherred" and car.y > self.rng.randint(350, 450):
+                car.turn_and_reverse()
+
+            if car.collide(red, None):
+                self.crashed_at = (car.x, car.y)
+                return False
+
+            if car.y > WIN_HEIGHT:
+                rem.append(car)
+
+            if not car.passed and red.y < car.y:
+                car.passed = True
+                add_car = True
+
+        if add_car:
+            self.score += 1
 
-def draw_window(win, redcar, othercars, base, score):
+        for spawn in self.traffic.due(self.base.distance):
+            othercars.append(OtherCar(*spawn))
+
+        for r in rem:
+            othercars.remove(r)
+
+        if red.x < ROAD_LEFT_BOUNDARY or red.x + red.width > ROAD_RIGHT_BOUNDARY:
+            self.crashed_at = (red.x, red.y)
+            return False
+        return True
+
+
+def ghost_run(network, seed, max_frames=GHOST_MAX_FRAMES):
     """
-    draws the windows for the main game loop
-    :param win: pygame window surface
-    :param redcar: a Red Car object
-    :param othercars: List of other cars
-    :param score: score of the game (int)
-    :return: None
+    plays a network headless on the game of a seed
+    :param network: NumpyNetwork, e.g. the exported winner
+    :param seed: seed of the traffic (int)
+    :param max_frames: length limit of the run
+    :return: int16 numpy array with the x of the red car on every frame it survived
     """
-    win.blit(base_img, (0, 0))
-    base.draw(win)
-    for car in othercars:
-        car.draw(win)
-    redcar.draw(win)
-    score_label = SCORE_FONT.render("Score: " + str(score), 1, (0, 0, 0))
-    win.blit(score_label, (2, 20))
-    pygame.display.update()
+    game = Game(seed)
+    xs = []
+    while len(xs) < max_frames:
+        output = network.activate(game.observation())[0]
+        if not game.step(output < -0.5, output > 0.5):
+            break
+        xs.append(game.red.x)
+    return np.array(xs, dtype=np.int16)
 
 
-def main(win, restart=False):
+def main(win, network=None, seed=None):
     """
-    Runs the main game loop
+    Runs the game: a loop over the READY, PLAYING, PAUSED and GAME_OVER
+    states, where restarting just starts a new Game
     :param win: pygame window surface
+    :param network: NumpyNetwork to race as a ghost, None plays alone
+    :param seed: seed of the traffic of every game, None draws a new one per game
     :return: None
     """
-    red = RedCar(250, 750)
-    base = Base()
-
-    random_car = OtherCar("yellow", 4, random.randint(-700, -600))
-    random_car_int = random.randint(0, 2)
-    if random_car_int == 1:
-        random_car = OtherCar("blue", 4, random.randint(-700, -600), dir=random.choice(['left', 'right']))
-    elif random_car_int == 2:
-        random_car = OtherCar("otherred", 4, random.randint(-700, -600), dir=random.choice(['left', 'right']))
-
-    othercars = [OtherCar("yellow", 1, 0),
-                 OtherCar("yellow", 2, random.randint(-350, -200)),
-                 OtherCar("yellow", 3, random.randint(-550, -400)),
-                 random_car]
-
-    score = 0
+
+    def new_game():
+        game = Game(seed)
+        ghost_xs = ghost_run(network, game.seed) if network is not None else np.zeros(0, dtype=np.int16)
+        return game, ghost_xs
+
+    view = GameView(win)
+    game, ghost_xs = new_game()
     clock = pygame.time.Clock()
 
     move_left = False
     move_right = False
+    state = READY
 
-    run = True
-    start = restart
-    lost = False
-
-    while run:
+    while state != QUIT:
 
-        clock.tick(45)
+        clock.tick(FPS)
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                run = False
-                pygame.quit()
-                quit()
+                state = QUIT
                 break
 
             if event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
-                    start = not start
+                    if state == GAME_OVER:
+                        game, ghost_xs = new_game()
+                        view.invalidate()
+                    state = PAUSED if state == PLAYING else PLAYING
                 if event.key == pygame.K_LEFT or event.key == pygame.K_a:
                     move_left = True
                 elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
@@ -329,71 +502,21 @@ def main(win, restart=False):
                 elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
                     move_right = False
 
-        if start:
-            if not lost:
-
-                base.move()
-
-                #red.move()
-                if move_left:
-                    red.turn("left")
-                if move_right:
-                    red.turn("right")
-
-                rem = []
-                add_car = False
-                passed_car_id = 0
-
-                for car in othercars:
-                    car.move()
-
-                    if car.color == "blue" and car.y > random.randint(400, 500):
-                        car.turn()
-
-                    if car.color == "otherred" and car.y > random.randint(350, 450):
-                        car.turn_and_reverse()
-
-                    if car.collide(red, win):
-                        win.blit(crash, (car.x, car.y))
-                        end_screen(win)
-                        lost = True
+        if state == PLAYING and not game.step(move_left, move_right):
+            state = GAME_OVER
 
-                    if car.y > WIN_HEIGHT:
-                        rem.append(car)
+        if state != QUIT:
+            # the ghost is where it was after as many frames as the player has played
+            ghost_x = int(ghost_xs[game.frame - 1]) if 0 < game.frame <= len(ghost_xs) else None
+            view.draw(state, game.red, game.othercars, game.base, game.score,
+                      game.crashed_at if state == GAME_OVER else None, ghost_x)
 
-                    if not car.passed and red.y < car.y:
-                        car.passed = True
-                        add_car = True
-                        passed_car_id = car.id
-
-                        passed_car_id += 1
-                        passed_car_id = passed_car_id % 4
-
-                if add_car:
-                    score += 1
-                    added_car_y = 0
-                    car_to_be_added = OtherCar("yellow", passed_car_id, added_car_y)
-                    if passed_car_id == 4 or passed_car_id == 0:
-                        random_car_int = random.randint(0, 1)
-                        if random_car_int == 1:
-                            car_to_be_added = OtherCar("blue", 4, added_car_y,
-                                                       dir=random.choice(['left', 'right']))
-                        else:
-                            car_to_be_added = OtherCar("otherred", 4, added_car_y,
-                                                       dir=random.choice(['left', 'right']))
-                    othercars.append(car_to_be_added)
-
-                for r in rem:
-                    othercars.remove(r)
-
-        if red.x < ROAD_LEFT_BOUNDARY or red.x + red.width > ROAD_RIGHT_BOUNDARY:
-            win.blit(crash, (red.x, red.y))
-            break
-
-        draw_window(win, red, othercars, base, score)
-
-    end_screen(WIN)
+    pygame.quit()
 
 
 if __name__ == '__main__':
-    main(WIN)
+    parser = argparse.ArgumentParser(description="Play road fighter.")
+    parser.add_argument("--ghost", help="exported network (.json or .npz) to race against")
+    parser.add_argument("--seed", type=int, default=None, help="traffic seed, a new one per game by default")
+    args = parser.parse_args()
+    main(WIN, NumpyNetwork.load(args.ghost) if args.ghost else None, args.seed)
@@ -1,13 +1,30 @@
 """
 The classic game of road fighter
 """
+import argparse
 import neat
 import pygame
 import random
 import os
 import numpy as np
 import pickle
+import time
 import visualize
+import memory_profile
+from artifacts import ArtifactWriter, AsyncCheckpointer, atomic_write
+from compact_genome import PackedGenomes
+from eval_pool import EvaluationPool
+from fitness import EpisodeEvents, load_weights, DEFAULT_WEIGHTS, CRASH_COLLISION, CRASH_OFF_ROAD, NEAR_MISS_GAP
+from genome_graph import create_network
+from kernel import NetworkBatch, Traffic, play
+from hall_of_fame import HallOfFame
+from racing import race, uniform_episodes
+from network_export import export_genome
+from reproduction import ParallelReproduction
+from replay import EpisodeLog, save_replay, ACTION_LEFT, ACTION_NONE, ACTION_RIGHT
+from shutdown import GracefulShutdown, TrainingInterrupted, restored_state
+from speciation import FastSpeciesSet
+from traffic import TrafficSchedule, turn_seed
 
 pygame.font.init()  # init font
 
@@ -19,6 +36,43 @@ ROAD_RIGHT_BOUNDARY = 340
 
 FRAME_VEL = 15
 
+# Live view of training. "full" draws every red car on every frame, "sample"
+# draws at most RENDER_SAMPLE red cars and "heatstrip" draws a histogram of the
+# red car x positions instead of the cars. "none" draws nothing.
+RENDER_MODE = "full"
+RENDER_FPS = 10  # frames drawn per second in the sample and heatstrip modes
+RENDER_SAMPLE = 16
+SIM_FPS = 30  # cap on simulated frames per second in "full" mode, 0 runs as fast as possible
+HEATSTRIP_BINS = 24
+HEATSTRIP_HEIGHT = 12
+
+# headless evaluations (re-checking old genomes) stop after this many frames
+EVAL_MAX_FRAMES = 3000
+
+# length of a run, counting the generations before a resumed checkpoint
+GENERATIONS = 100
+
+# "episode" plays the population once, on one traffic seed, in the live view.
+# "racing" plays it headless on several seeds with successive halving (see
+# racing.py), spending most episodes on the genomes that can become elites.
+EVALUATION = "episode"
+RACE_ROUNDS = 3
+RACE_ETA = 2
+
+# headless evaluations copy the genes into flat arrays (see compact_genome.py)
+# and build the networks from those, instead of reading the genome objects
+COMPACT_GENOMES = False
+# print the memory used per genome, network and agent every generation
+MEMORY_PROFILE = False
+# headless evaluations run on this many worker processes, started once per
+# run (see eval_pool.py); 0 plays them in this process
+EVAL_WORKERS = 0
+# headless evaluations play on the array kernel (see kernel.py) instead of simulate
+EVAL_KERNEL = True
+
+# weights of the fitness counters (see fitness.py), read from the config file by run()
+FITNESS_WEIGHTS = dict(DEFAULT_WEIGHTS)
+
 STAT_FONT = pygame.font.SysFont("lucidacalligraphy", 18)
 SCORE_FONT = pygame.font.SysFont("lucidacalligraphy", 18)
 
@@ -38,6 +92,18 @@ crash = pygame.transform.scale(pygame.image.load(os.path.join("images", "crash_1
 gen = 0
 best_score = 0
 
+# traffic gets its own generator so an episode can be replayed from its seed
+# without touching the random state NEAT uses for evolution
+rng = random.Random()
+
+# set by run(); writes checkpoints, replays and plots off the training thread
+artifact_writer = None
+# set by run() when EVAL_WORKERS is set
+eval_pool = None
+# set by run(); stops training cleanly on SIGINT / SIGTERM (see shutdown.py)
+shutdown = None
+RECORD_REPLAYS = True
+
 class RedCar:
     def __init__(self, x, y):
         """
@@ -77,12 +143,13 @@ class RedCar:
 
 class OtherCar:
 
-    def __init__(self, color, id, y, dir=None):
+    def __init__(self, color, id, y, dir=None, x=None):
         """
         Initialize the antagonist Other Car object
         :param color: Str, one of [yellow, blue, otherred]
         :param y: starting y pos (int)
         :param dir: Str, one of the directions [left, right]
+        :param x: starting x pos (int), None draws a random one
         :return: None
         """
         self.color = color
@@ -94,7 +161,7 @@ class OtherCar:
             self.img = otherred
         self.width = self.img.get_width()
         self.id = id
-        self.x = random.randrange(ROAD_LEFT_BOUNDARY, ROAD_RIGHT_BOUNDARY - self.width)
+        self.x = rng.randrange(ROAD_LEFT_BOUNDARY, ROAD_RIGHT_BOUNDARY - self.width) if x is None else x
         self.y = y
         self.origin = (self.x, self.y)
         self.dir = dir
@@ -211,6 +278,7 @@ class Base:
         self.y1 = 0
         self.vel = FRAME_VEL
         self.y2 = self.HEIGHT
+        self.distance = 0
 
     def move(self):
         """
@@ -219,6 +287,7 @@ class Base:
         """
         self.y1 += self.vel
         self.y2 += self.vel
+        self.distance += self.vel
 
         if self.y1 > self.HEIGHT:
             self.y1 = self.y2 - self.HEIGHT
@@ -267,13 +336,14 @@ def get_mask(img):
     return pygame.mask.from_surface(img)
 
 
-def draw_window(win, redcars, othercars, base, score):
+def draw_window(win, redcars, othercars, base, score, score_label=None):
     """
     draws the windows for the main game loop
     :param win: pygame window surface
     :param redcars: a List of Red Car objects
     :param othercars: List of other cars
     :param score: score of the game (int)
+    :param score_label: pre-rendered score text surface, rendered from score if None
     :return: None
     """
     win.blit(base_img, (0, 0))
@@ -282,46 +352,207 @@ def draw_window(win, redcars, othercars, base, score):
         car.draw(win)
     for redcar in redcars:
         redcar.draw(win)
-    score_label = SCORE_FONT.render("Score: " + str(score), 1, (0, 0, 0))
+    if score_label is None:
+        score_label = SCORE_FONT.render("Score: " + str(score), 1, (0, 0, 0))
     win.blit(score_label, (2, 20))
     pygame.display.update()
 
 
-def main(genomes, config):
+class TrainingView:
     """
-    Runs the simulation of the current population of
-    red cars and sets their fitness based on the number of other cars
-    they reach in the game.
+    Draws a training episode at a fixed rate, independent of how fast
+    the simulation runs, so watching a large population stays cheap.
     """
-    global WIN, gen, best_score
-    win = WIN
+    # along the bottom of the window, where the red cars would be
+    STRIP_Y = WIN_HEIGHT - HEATSTRIP_HEIGHT
+
+    def __init__(self, win, mode=RENDER_MODE, fps=RENDER_FPS, sample=RENDER_SAMPLE):
+        """
+        Initialize the view
+        :param win: pygame window surface
+        :param mode: Str, one of [full, sample, heatstrip, none]
+        :param fps: frames drawn per second in the sample and heatstrip modes
+        :param sample: maximum number of red cars drawn in sample mode
+        :return: None
+        """
+        self.win = win
+        self.mode = mode
+        self.interval = 1.0 / fps if fps else 0
+        self.sample = sample
+        self.last_draw = -self.interval
+        self.score = None
+        self.label = None
+        self.dirty = []
+        self.background_drawn = False
+
+    def due(self):
+        """
+        returns if a frame should be drawn now
+        :return: Bool
+        """
+        if self.mode == "none":
+            return False
+        if self.mode == "full":
+            return True
+        now = time.perf_counter()
+        if now - self.last_draw < self.interval:
+            return False
+        self.last_draw = now
+        return True
+
+    def score_label(self, score):
+        """
+        returns the score text surface, rendering it only when the score changes
+        :param score: score of the game (int)
+        :return: pygame surface
+        """
+        if score != self.score:
+            self.score = score
+            self.label = SCORE_FONT.render("Score: " + str(score), 1, (0, 0, 0))
+        return self.label
+
+    def draw(self, redcars, othercars, base, score):
+        """
+        draw the current frame if one is due
+        :param redcars: a List of Red Car objects
+        :param othercars: List of other cars
+        :param base: Base object
+        :param score: score of the game (int)
+        :return: None
+        """
+        if not self.due():
+            return
+        if self.mode == "full":
+            draw_window(self.win, redcars, othercars, base, score, self.score_label(score))
+        elif self.mode == "sample":
+            step = -(-len(redcars) // self.sample) or 1
+            draw_window(self.win, redcars[::step], othercars, base, score, self.score_label(score))
+        else:
+            self.draw_heatstrip(redcars, othercars, score)
+
+    def draw_heatstrip(self, redcars, othercars, score):
+        """
+        draw the traffic over a still road and a strip showing how many red
+        cars are at each x position. Only the changed rectangles are updated.
+        :param redcars: a List of Red Car objects
+        :param othercars: List of other cars
+        :param score: score of the game (int)
+        :return: None
+        """
+        win = self.win
+        if not self.background_drawn:
+            win.blit(base_img, (0, 0))
+            pygame.display.update()
+            self.background_drawn = True
+
+        # restore the background under everything drawn last time
+        for rect in self.dirty:
+            win.blit(base_img, rect, rect)
+        dirty = self.dirty
+        self.dirty = []
 
+        for car in othercars:
+            car.draw(win)
+            self.dirty.append(pygame.Rect(car.x, car.y, carsize[0], carsize[1]))
+
+        bin_width = (ROAD_RIGHT_BOUNDARY - ROAD_LEFT_BOUNDARY) / HEATSTRIP_BINS
+        counts = np.bincount(np.clip(((np.array([r.x for r in redcars]) - ROAD_LEFT_BOUNDARY) // bin_width).astype(int),
+                                     0, HEATSTRIP_BINS - 1), minlength=HEATSTRIP_BINS)
+        peak = max(counts.max(), 1)
+        for i, count in enumerate(counts):
+            if count:
+                heat = int(255 * count / peak)
+                win.fill((heat, 0, 255 - heat), (ROAD_LEFT_BOUNDARY + i * bin_width, self.STRIP_Y,
+                                                 bin_width, HEATSTRIP_HEIGHT))
+        self.dirty.append(pygame.Rect(ROAD_LEFT_BOUNDARY, self.STRIP_Y,
+                                      ROAD_RIGHT_BOUNDARY - ROAD_LEFT_BOUNDARY, HEATSTRIP_HEIGHT))
+
+        label = self.score_label(score)
+        win.blit(label, (2, 20))
+        self.dirty.append(pygame.Rect(2, 20, label.get_width(), label.get_height()))
+
+        pygame.display.update(dirty + self.dirty)
+
+
+def collisions(red_x, red_y, car):
+    """
+    which red cars collide with an other car, OtherCar.collide for all of them at once
+    :param red_x: numpy array of the red cars' x
+    :param red_y: numpy array of the red cars' y
+    :param car: OtherCar
+    :return: bool numpy array, one per red car
+    """
+    car_width = round(2 * carsize[0] / 3 + 2)
+    currentcar_width = round(2 * carsize[0] / 3)
+    half_height = round(carsize[1] / 2)
+    level = (car.y + half_height >= red_y) & (car.y <= red_y + half_height)
+    return level & (car.x <= red_x + car_width) & (red_x <= car.x + currentcar_width)
+
+
+def near_misses(reds, othercars):
+    """
+    which red cars are level with another car and within NEAR_MISS_GAP
+    pixels of it, without touching it (see OtherCar.collide)
+    :param reds: List of RedCar
+    :param othercars: List of OtherCar
+    :return: bool numpy array, one per red car
+    """
+    red_x = np.array([red.x for red in reds])
+    red_y = np.array([red.y for red in reds])
+    near = np.zeros(len(reds), dtype=bool)
+    car_width = round(2 * carsize[0] / 3 + 2)
+    currentcar_width = round(2 * carsize[0] / 3)
+    half_height = round(carsize[1] / 2)
+    for car in othercars:
+        level = (car.y + half_height >= red_y) & (car.y <= red_y + half_height)
+        gap = np.maximum(car.x - (red_x + car_width), red_x - (car.x + currentcar_width))
+        near |= level & (gap > 0) & (gap <= NEAR_MISS_GAP)
+    return near
+
+
+def simulate(genomes, config, seed, view=None, record=False, max_frames=None):
+    """
+    Plays one episode with a red car per genome, on the traffic drawn from
+    seed, and sets their fitness based on the number of other cars they reach.
+    :param genomes: List of (genome id, genome) tuples, or PackedGenomes
+    :param config: neat.config.Config
+    :param seed: seed of the traffic random generator (int)
+    :param view: TrainingView drawing the episode, or None to run headless
+    :param record: keep an EpisodeLog of the episode
+    :param max_frames: end the episode after this many frames, None plays until every red car is dead
+    :return: (score of the episode, EpisodeLog or None)
+    """
+    # the live red cars, their networks and their index in genomes, in
+    # parallel; dead cars are dropped from all three once per frame
     nets = []
-    ge = []
     reds = []
 
-    for _, g in genomes:
-        net = neat.nn.FeedForwardNetwork.create(g, config)
-        nets.append(net)
+    packed = isinstance(genomes, PackedGenomes)
+    for i in range(len(genomes)):
+        if packed:
+            # build the network from the arrays, no gene objects outlive this loop
+            g = genomes.view(i)
+        else:
+            g = genomes[i][1]
+            g.fitness = 0
+        nets.append(create_network(g, config))
         reds.append(RedCar(250, 750))
-        g.fitness = 0
-        ge.append(g)
+    ids = np.arange(len(reds))
 
-    base = Base()
+    events = EpisodeEvents(len(ids))
+
+    rng.seed(turn_seed(seed))
+    log = None
+    if record:
+        log = EpisodeLog(seed, len(ids), (250, 750), reds[0].vel if reds else 0, FRAME_VEL)
 
-    random_car = OtherCar("yellow", 4, random.randint(-700, -600))
-    random_car_int = random.randint(0, 2)
-    if random_car_int == 1:
-        random_car = OtherCar("blue", 4, random.randint(-700, -600), dir=random.choice(['left', 'right']))
-    elif random_car_int == 2:
-        random_car = OtherCar("otherred", 4, random.randint(-700, -600), dir=random.choice(['left', 'right']))
+    base = Base()
 
-    othercars = [OtherCar("yellow", 1, 0),
-                 OtherCar("yellow", 2, random.randint(-350, -200)),
-                 OtherCar("yellow", 3, random.randint(-550, -400)),
-                 random_car]
+    traffic = TrafficSchedule(seed)
+    othercars = [OtherCar(*spawn) for spawn in traffic.start()]
 
     score = 0
+    frame = 0
     clock = pygame.time.Clock()
 
     move_left = False
@@ -331,25 +562,32 @@ def main(genomes, config):
 
     while run:
 
-        clock.tick(30)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                run = False
-                pygame.quit()
-                quit()
-                break
-
-            # if event.type == pygame.KEYDOWN:
-            #     if event.key == pygame.K_LEFT or event.key == pygame.K_a:
-            #         move_left = True
-            #     elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-            #         move_right = True
-            # if event.type == pygame.KEYUP:
-            #     if event.key == pygame.K_LEFT or event.key == pygame.K_a:
-            #         move_left = False
-            #     elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
-            #         move_right = False
+        if max_frames is not None and frame >= max_frames:
+            break
+        frame += 1
+        if shutdown is not None:
+            shutdown.check()
+
+        if view is not None:
+            # the other modes draw at their own rate, whatever the simulation speed
+            if SIM_FPS and view.mode == "full":
+                clock.tick(SIM_FPS)
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    # closing the window stops training like a second signal does
+                    raise TrainingInterrupted("window closed")
+
+                # if event.type == pygame.KEYDOWN:
+                #     if event.key == pygame.K_LEFT or event.key == pygame.K_a:
+                #         move_left = True
+                #     elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
+                #         move_right = True
+                # if event.type == pygame.KEYUP:
+                #     if event.key == pygame.K_LEFT or event.key == pygame.K_a:
+                #         move_left = False
+                #     elif event.key == pygame.K_RIGHT or event.key == pygame.K_d:
+                #         move_right = False
 
 
         base.move()
@@ -368,9 +606,10 @@ def main(genomes, config):
             run = False
             break
 
-        # give each red car a fitness of 0.1 for each frame it stays alive
+        # count the frames each red car stays alive
+        events.frames[ids] += 1
+        steering = []
         for x, red in enumerate(reds):
-            ge[x].fitness += 0.1
 
             # send red location, other car location and determine from network
             # where to turn if at all
@@ -379,10 +618,17 @@ def main(genomes, config):
                                        othercars[car_ind].y + round(carsize[1] / 2)))
 
             # we use a tanh activation function so result will be between -1 and 1.
+            action = ACTION_NONE
             if output[0] > 0.5:
                 red.turn("right")
+                action = ACTION_RIGHT
             if output[0] < -0.5:
                 red.turn("left")
+                action = ACTION_LEFT
+            steering.append(action)
+            if log is not None:
+                log.act(ids[x], action)
+        events.act(ids, steering)
 
         # if move_left:
         #     red.turn("left")
@@ -391,66 +637,68 @@ def main(genomes, config):
 
         rem = []
         add_car = False
-        passed_car_id = 0
+
+        red_x = np.array([red.x for red in reds])
+        red_y = np.array([red.y for red in reds])
+        dead = np.zeros(len(reds), dtype=bool)
 
         for car in othercars:
             car.move()
 
-            if car.color == "blue" and car.y > random.randint(400, 500):
+            if car.color == "blue" and car.y > rng.randint(400, 500):
                 car.turn()
 
-            if car.color == "otherred" and car.y > random.randint(350, 450):
+            if car.color == "otherred" and car.y > rng.randint(350, 450):
                 car.turn_and_reverse()
 
-            for x, redx in enumerate(reds):
-
-                if car.collide(redx, win):
-                    ge[x].fitness -= 1
-                    nets.pop(x)
-                    ge.pop(x)
-                    reds.pop(x)
+            # the cars still alive when this car is reached can pass it
+            if not car.passed and not dead.all() and red_y[0] < car.y:
+                car.passed = True
+                add_car = True
 
-                if not car.passed and redx.y < car.y:
-                    car.passed = True
-                    add_car = True
-                    passed_car_id = car.id
-                    passed_car_id += 1
-                    passed_car_id = passed_car_id % 4
+            crashed = collisions(red_x, red_y, car) & ~dead
+            if crashed.any():
+                events.crash[ids[crashed]] = CRASH_COLLISION
+                dead |= crashed
 
             if car.y > WIN_HEIGHT:
                 rem.append(car)
 
         if add_car:
             score += 1
-            for g in ge:
-                g.fitness += 5
-
-            added_car_y = 0
-            car_to_be_added = OtherCar("yellow", passed_car_id, added_car_y)
-            if passed_car_id == 4 or passed_car_id == 0:
-                random_car_int = random.randint(0, 1)
-                if random_car_int == 1:
-                    car_to_be_added = OtherCar("blue", 4, added_car_y,
-                                               dir=random.choice(['left', 'right']))
-                else:
-                    car_to_be_added = OtherCar("otherred", 4, added_car_y,
-                                               dir=random.choice(['left', 'right']))
-            othercars.append(car_to_be_added)
+            events.passed[ids[~dead]] += 1
+
+        # new cars come from the schedule, whether or not a red car is left to pass
+        for spawn in traffic.due(base.distance):
+            othercars.append(OtherCar(*spawn))
 
         for r in rem:
             othercars.remove(r)
 
-        for redz in reds:
-            if redz.x < ROAD_LEFT_BOUNDARY or redz.x + redz.width > ROAD_RIGHT_BOUNDARY:
-                nets.pop(reds.index(redz))
-                ge.pop(reds.index(redz))
-                reds.pop(reds.index(redz))
+        if reds:
+            near = near_misses(reds, othercars) & ~dead
+            events.near_misses[ids[near]] += 1
+
+            width = reds[0].width
+            off_road = ~dead & ((red_x < ROAD_LEFT_BOUNDARY) | (red_x + width > ROAD_RIGHT_BOUNDARY))
+            events.crash[ids[off_road]] = CRASH_OFF_ROAD
+            dead |= off_road
 
-        draw_window(win, reds, othercars, base, score)
+        # retire the dead red cars in one pass
+        if dead.any():
+            if log is not None:
+                for i in ids[dead].tolist():
+                    log.retire(i)
+            alive = np.flatnonzero(~dead).tolist()
+            nets = [nets[i] for i in alive]
+            reds = [reds[i] for i in alive]
+            ids = ids[alive]
 
-        if score > best_score:
-            best_score = score
-            print("Woohooo!!! Best Score! :D", score)
+        if log is not None:
+            log.end_frame(othercars)
+
+        if view is not None:
+            view.draw(reds, othercars, base, score)
 
         """ # break if score gets large enough
             if len(nets) > 0:
@@ -463,54 +711,326 @@ def main(genomes, config):
             break
         """
 
+    fitness = events.fitness(FITNESS_WEIGHTS)
+    if packed:
+        genomes.fitness[:] = fitness
+    else:
+        for (_, g), f in zip(genomes, fitness.tolist()):
+            g.fitness = f
+    return score, log
+
 
-def run(config_file):
+def roll_traffic(seed, frames, segment=250):
     """
-    runs the NEAT algorithm to train a neural network to play road fighter.
-    :param config_file: location of config file
+    plays the other cars of simulate's episode on seed, for the array kernel
+    :param seed: seed of the traffic random generator (int)
+    :param frames: number of frames to play
+    :param segment: frames per Traffic segment
+    :return: generator of kernel.Traffic segments, rolled as they are asked for
+    """
+    # the same draws as simulate's rng, in a generator of its own since the
+    # segments are rolled in between other episodes
+    draw = random.Random(turn_seed(seed))
+    base = Base()
+    traffic = TrafficSchedule(seed)
+    othercars = [OtherCar(*spawn) for spawn in traffic.start()]
+    red_y = 750
+
+    for start in range(0, frames, segment):
+        obs_x, obs_y = [], []
+        car_offsets = [0]
+        car_x, car_y, car_pass = [], [], []
+        for _ in range(start, min(start + segment, frames)):
+            base.move()
+
+            car_ind = 0
+            if len(othercars) > 1 and red_y < othercars[0].y:
+                car_ind = 1
+            elif len(othercars) > 2 and red_y < othercars[1].y:
+                car_ind = 2
+            elif len(othercars) > 3 and red_y < othercars[2].y:
+                car_ind = 3
+            obs_x.append(othercars[car_ind].x + round((2 * carsize[0] / 3)/2))
+            obs_y.append(othercars[car_ind].y + round(carsize[1] / 2))
+
+            rem = []
+            for car in othercars:
+                car.move()
+
+                if car.color == "blue" and car.y > draw.randint(400, 500):
+                    car.turn()
+
+                if car.color == "otherred" and car.y > draw.randint(350, 450):
+                    car.turn_and_reverse()
+
+                passes = not car.passed and red_y < car.y
+                car.passed |= passes
+                car_x.append(car.x)
+                car_y.append(car.y)
+                car_pass.append(passes)
+
+                if car.y > WIN_HEIGHT:
+                    rem.append(car)
+
+            for spawn in traffic.due(base.distance):
+                othercars.append(OtherCar(*spawn))
+
+            for r in rem:
+                othercars.remove(r)
+            car_offsets.append(len(car_x))
+
+        yield Traffic(np.array(obs_x, dtype=float), np.array(obs_y, dtype=float), np.array(car_offsets),
+                      np.array(car_x), np.array(car_y), np.array(car_pass, dtype=bool))
+
+
+def evaluate_genomes(genomes, config, seeds, max_frames=EVAL_MAX_FRAMES):
+    """
+    plays the genomes headless on every seed, e.g. to re-check old genomes on fresh traffic
+    :param genomes: List of (genome id, genome) tuples, or PackedGenomes; the fitness of genome objects is
+                    overwritten unless COMPACT_GENOMES is set or the evaluation runs on eval_pool
+    :param config: neat.config.Config
+    :param seeds: List of traffic seeds (int)
+    :param max_frames: frame limit of each episode
+    :return: (len(genomes), len(seeds)) numpy array of fitness
+    """
+    if eval_pool is not None:
+        return eval_pool.evaluate(genomes, seeds, max_frames)
+    packed = isinstance(genomes, PackedGenomes)
+    if COMPACT_GENOMES and not packed:
+        genomes = PackedGenomes.pack(genomes)
+        packed = True
+    fitness = np.zeros((len(genomes), len(seeds)))
+    if EVAL_KERNEL and max_frames is not None:
+        views = genomes.views() if packed else genomes
+        networks = NetworkBatch([export_genome(g, config) for _, g in views])
+        for j, seed in enumerate(seeds):
+            if shutdown is not None:
+                shutdown.check()
+            fitness[:, j] = play(networks, roll_traffic(seed, max_frames))[1].fitness(FITNESS_WEIGHTS)
+        if packed:
+            genomes.fitness[:] = fitness[:, -1] if len(seeds) else np.nan
+        else:
+            for (_, g), f in zip(genomes, fitness[:, -1].tolist() if len(seeds) else []):
+                g.fitness = f
+        return fitness
+    for j, seed in enumerate(seeds):
+        simulate(genomes, config, seed, max_frames=max_frames)
+        if packed:
+            fitness[:, j] = genomes.fitness
+        else:
+            fitness[:, j] = [g.fitness for _, g in genomes]
+    return fitness
+
+
+def evaluate_packed(genomes, state, seeds, max_frames):
+    """
+    evaluate_genomes in an eval_pool worker
+    :param genomes: PackedGenomes
+    :param state: (config, fitness weights) of the run
+    :param seeds: List of traffic seeds (int)
+    :param max_frames: frame limit of each episode
+    :return: (len(genomes), len(seeds)) numpy array of fitness
+    """
+    global FITNESS_WEIGHTS
+    config, FITNESS_WEIGHTS = state
+    return evaluate_genomes(genomes, config, seeds, max_frames)
+
+
+def race_genomes(genomes, config):
+    """
+    sets the fitness of the genomes by racing them over several seeds
+    :param genomes: List of (genome id, genome) tuples
+    :param config: neat.config.Config
     :return: None
     """
-    config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
-                                neat.DefaultSpeciesSet, neat.DefaultStagnation,
-                                config_file)
+    fitness, episodes = race(genomes, lambda gs, seeds: evaluate_genomes(gs, config, seeds),
+                             random.Random(random.randrange(2 ** 32)), rounds=RACE_ROUNDS, eta=RACE_ETA)
+    for (_, g), f in zip(genomes, fitness):
+        g.fitness = float(f)
+    print("Raced {} genomes in {} episodes ({} uniformly), at most {} per genome".format(
+        len(genomes), int(episodes.sum()), uniform_episodes(len(genomes), RACE_ROUNDS, RACE_ETA),
+        int(episodes.max(initial=0))))
 
-    # Create the population, which is the top-level object for a NEAT run.
-    p = neat.Population(config)
 
-    # Add a stdout reporter to show progress in the terminal.
-    p.add_reporter(neat.StdOutReporter(True))
-    stats = neat.StatisticsReporter()
-    p.add_reporter(stats)
-    if not os.path.exists("checkpoints//"):
-        os.makedirs("checkpoints")
-    p.add_reporter(neat.Checkpointer(generation_interval=5,
-                                     filename_prefix="checkpoints/ckpt-"))
+def main(genomes, config):
+    """
+    Runs the simulation of the current population of
+    red cars and sets their fitness based on the number of other cars
+    they reach in the game.
+    """
+    global WIN, gen, best_score
+
+    if MEMORY_PROFILE:
+        memory_profile.report(memory_profile.profile(genomes, config, lambda: RedCar(250, 750)), config.pop_size)
+
+    if EVALUATION == "racing":
+        race_genomes(genomes, config)
+        gen += 1
+        return
 
-    # Run for up to 100 generations.
-    winner = p.run(main, 100)
+    seed = random.randrange(2 ** 32)
+    view = TrainingView(WIN, RENDER_MODE, RENDER_FPS, RENDER_SAMPLE) if RENDER_MODE != "none" else None
+    score, log = simulate(genomes, config, seed, view, record=artifact_writer is not None and RECORD_REPLAYS)
 
-    # show final stats
-    print('\nBest genome:\n{!s}'.format(winner))
+    if score > best_score:
+        best_score = score
+        print("Woohooo!!! Best Score! :D", score)
 
+    population = [g for _, g in genomes]
+    if log is not None and population:
+        best = max(range(len(population)), key=lambda i: population[i].fitness)
+        artifact_writer.submit(save_replay, "replays/gen-{:04d}.npz".format(gen),
+                               log.extract(best, generation=gen, genome_key=population[best].key,
+                                           fitness=population[best].fitness),
+                               block=False)
+    gen += 1
 
-    if not os.path.exists("outputs//"):
-        os.makedirs("outputs")
-    # Save the winner.
-    with open('outputs/winner-road-fighter.pkl', 'wb') as f:
-        pickle.dump(winner, f)
 
-    visualize.plot_stats(stats, ylog=True, view=True, filename="outputs/fitness.svg")
-    visualize.plot_species(stats, view=True, filename="outputs/speciation.svg")
+def run_state():
+    """
+    the state of the run a neat checkpoint leaves out, saved with every checkpoint (see shutdown.py)
+    :return: dict
+    """
+    return {"best_score": best_score, "traffic_rng": rng.getstate()}
 
-    node_names = {-1: 'Red X', -2: 'Car X', -3: 'Car Y', 0: 'turn'}
-    visualize.draw_net(config, winner, True, node_names=node_names)
 
-    visualize.draw_net(config, winner, view=True, node_names=node_names,
-                       filename="outputs/winner.gv")
-    visualize.draw_net(config, winner, view=True, node_names=node_names,
-                       filename="outputs/winner-enabled.gv", show_disabled=False)
-    visualize.draw_net(config, winner, view=True, node_names=node_names,
-                       filename="outputs/winner-enabled-pruned.gv", show_disabled=False, prune_unused=True)
+def restore(checkpoint):
+    """
+    the population of a checkpoint, set up to go on with the run it was taken from
+    :param checkpoint: location of the checkpoint file
+    :return: (neat.Population, List of the reporters of the checkpointed run)
+    """
+    global gen, best_score
+    # also restores the random state the checkpoint was taken with
+    p = neat.Checkpointer.restore_checkpoint(checkpoint)
+    if not isinstance(p.species, FastSpeciesSet) or not isinstance(p.reproduction, ParallelReproduction):
+        # checkpoints of older runs carry the classes of their own config
+        print("{} was saved with {} and {}, which the run goes on with".format(
+            checkpoint, type(p.species).__name__, type(p.reproduction).__name__))
+    previous = p.species.reporters.reporters
+    # the restored species set still reports to the reporters of the old run
+    p.species.reporters = p.reporters
+    gen = p.generation
+    state = restored_state(previous)
+    if state is not None:
+        best_score = state["best_score"]
+        rng.setstate(state["traffic_rng"])
+    return p, previous
+
+
+def save_stats(stats):
+    """
+    write the fitness and speciation plots of the run in the background
+    :param stats: neat.StatisticsReporter
+    :return: None
+    """
+    if stats.most_fit_genomes:
+        artifact_writer.submit(visualize.plot_stats, stats, ylog=True, view=False, filename="outputs/fitness.svg")
+        artifact_writer.submit(visualize.plot_species, stats, view=False, filename="outputs/speciation.svg")
+
+
+def run(config_file, checkpoint=None):
+    """
+    runs the NEAT algorithm to train a neural network to play road fighter.
+    SIGINT / SIGTERM stop the run with a checkpoint to resume from.
+    :param config_file: location of config file
+    :param checkpoint: location of a checkpoint to resume from, None starts a new run
+    :return: None
+    """
+    global artifact_writer, eval_pool, shutdown, FITNESS_WEIGHTS
+    FITNESS_WEIGHTS = load_weights(config_file)
+
+    # Create the population, which is the top-level object for a NEAT run.
+    if checkpoint is None:
+        config = neat.config.Config(neat.DefaultGenome, ParallelReproduction,
+                                    FastSpeciesSet, neat.DefaultStagnation,
+                                    config_file)
+        p = neat.Population(config)
+        previous = []
+    else:
+        p, previous = restore(checkpoint)
+        config = p.config
+        print("Resuming from {} at generation {}".format(checkpoint, p.generation))
+
+    def resumed(reporter_type):
+        """ the reporter of the checkpointed run, which goes on with its history """
+        return next((r for r in previous if isinstance(r, reporter_type)), None)
+
+    # Checkpoints, replays and plots are written in the background so the
+    # next generation starts as soon as the previous one is evaluated.
+    artifact_writer = ArtifactWriter(maxsize=8)
+    if EVAL_WORKERS > 0:
+        eval_pool = EvaluationPool(EVAL_WORKERS, evaluate_packed, (config, FITNESS_WEIGHTS))
+
+    checkpointer = AsyncCheckpointer(artifact_writer, generation_interval=5,
+                                     filename_prefix="checkpoints/ckpt-")
+    # first, so it sees the end of the evaluation before the reporters that evaluate again
+    shutdown = GracefulShutdown(p, checkpointer, state=run_state)
+    p.add_reporter(shutdown)
+    # Add a stdout reporter to show progress in the terminal.
+    p.add_reporter(neat.StdOutReporter(True))
+    stats = resumed(neat.StatisticsReporter) or neat.StatisticsReporter()
+    p.add_reporter(stats)
+    p.add_reporter(checkpointer)
+    p.add_reporter(visualize.LivePlotReporter(artifact_writer, interval=5, ylog=True))
+    # best genomes of the run, replayed on fresh traffic to weed out lucky episodes
+    evaluate = lambda genomes, seeds: evaluate_genomes(genomes, config, seeds)
+    hall_of_fame = resumed(HallOfFame)
+    if hall_of_fame is None:
+        hall_of_fame = HallOfFame("outputs/hall_of_fame", writer=artifact_writer, evaluate=evaluate)
+    else:
+        hall_of_fame.writer = artifact_writer
+        hall_of_fame.evaluate = evaluate
+    p.add_reporter(hall_of_fame)
+
+    try:
+        if p.generation >= GENERATIONS:
+            print("{} already ran {} of GENERATIONS = {} generations".format(checkpoint, p.generation, GENERATIONS))
+            return
+        with shutdown:
+            try:
+                winner = p.run(main, GENERATIONS - p.generation)
+            except TrainingInterrupted as e:
+                print("\nTraining stopped ({}), resume with --resume {}".format(e, shutdown.save_aborted()))
+                save_stats(stats)
+                return
+
+        # The winner is the archived genome that does best on fresh seeds,
+        # not the one that happened to score highest in a single episode.
+        hall_of_fame.reevaluate()
+        if len(hall_of_fame):
+            entry, winner = hall_of_fame.best()[0]
+            print('\nHall of fame winner from generation {} scored {:.1f} over {} fresh episodes'.format(
+                entry["generation"], HallOfFame.score(entry), entry["evaluations"]))
+
+        # show final stats
+        print('\nBest genome:\n{!s}'.format(winner))
+
+        # Save the winner.
+        artifact_writer.submit(atomic_write, 'outputs/winner-road-fighter.pkl', pickle.dumps(winner))
+        artifact_writer.submit(export_genome(winner, config).save, 'outputs/winner-road-fighter.json')
+
+        save_stats(stats)
+
+        node_names = {-1: 'Red X', -2: 'Car X', -3: 'Car Y', 0: 'turn'}
+        for filename, show_disabled, prune_unused in [("outputs/Digraph.gv", True, False),
+                                                      ("outputs/winner.gv", True, False),
+                                                      ("outputs/winner-enabled.gv", False, False),
+                                                      ("outputs/winner-enabled-pruned.gv", False, True)]:
+            artifact_writer.submit(visualize.draw_net, config, winner, view=False, node_names=node_names,
+                                   filename=filename, show_disabled=show_disabled, prune_unused=prune_unused)
+    finally:
+        shutdown = None
+        # the species set and reproduction of older checkpoints have no workers to stop
+        for part in (p.species, p.reproduction):
+            close = getattr(part, "close", None)
+            if close is not None:
+                close()
+        if eval_pool is not None:
+            eval_pool.close()
+            eval_pool = None
+        artifact_writer.close()
+        artifact_writer = None
 
 if __name__ == '__main__':
     # Determine path to configuration file. This path manipulation is
@@ -518,4 +1038,6 @@ if __name__ == '__main__':
     # current working directory.
     local_dir = os.path.dirname(__file__)
     config_path = os.path.join(local_dir, 'config-feedforward.txt')
-    run(config_path)
+    parser = argparse.ArgumentParser(description="Train networks to play road fighter.")
+    parser.add_argument("--resume", metavar="CHECKPOINT", help="checkpoint to go on from, e.g. checkpoints/ckpt-20")
+    run(config_path, parser.parse_args().resume)
@@ -7,6 +7,8 @@ import random
 import os
 import numpy as np
 import pickle
+from distill import DecisionTable
+from network_export import NumpyNetwork
 import visualize
 
 pygame.font.init()  # init font
@@ -38,6 +40,14 @@ crash = pygame.transform.scale(pygame.image.load(os.path.join("images", "crash_1
 gen = 0
 best_score = 0
 
+# the exported winner (network_export.py) drives the red car when it exists,
+# otherwise the pickled genome is loaded. A decision table written by
+# distill.py takes precedence when set: one lookup per frame instead of
+# activating the network.
+WINNER_NETWORK = os.path.join("outputs", "winner-road-fighter.json")
+POLICY_TABLE = None
+policy = None
+
 class RedCar:
     def __init__(self, x, y):
         """
@@ -301,7 +311,10 @@ def main(genomes, config):
     reds = []
 
     for _, g in genomes:
-        net = neat.nn.FeedForwardNetwork.create(g, config)
+        if policy is not None:
+            net = policy
+        else:
+            net = neat.nn.FeedForwardNetwork.create(g, config)
         nets.append(net)
         reds.append(RedCar(250, 750))
         g.fitness = 0
@@ -459,14 +472,23 @@ def run(config_file):
     :param config_file: location of config file
     :return: None
     """
+    global policy
     config = neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
                                 neat.DefaultSpeciesSet, neat.DefaultStagnation,
                                 config_file)
 
-
-    # Unpickle saved winner
-    with open("winner-road-fighter.pkl", "rb") as f:
-        genome = pickle.load(f)
+    if POLICY_TABLE is not None:
+        policy = DecisionTable.load(POLICY_TABLE)
+    elif os.path.exists(WINNER_NETWORK):
+        policy = NumpyNetwork.load(WINNER_NETWORK)
+
+    if policy is not None:
+        # the genome only keeps score
+        genome = neat.DefaultGenome(1)
+    else:
+        # Unpickle saved winner
+        with open("winner-road-fighter.pkl", "rb") as f:
+            genome = pickle.load(f)
 
     # Convert loaded genome into required data structure
     genomes = [(1, genome)]
@@ -0,0 +1,167 @@
+"""
+Stopping a training run cleanly on SIGINT / SIGTERM.
+
+The first signal lets the current generation finish: once it is evaluated
+and the next population is bred, a checkpoint of that population is written
+and the run stops. A second signal aborts the generation being evaluated
+instead, and the checkpoint holds the population as it was when that
+generation started. Either way at most one generation of work is lost.
+
+    shutdown = GracefulShutdown(population, checkpointer, state=run_state)
+    population.add_reporter(shutdown)   # before the other reporters
+    with shutdown:               # installs the signal handlers
+        try:
+            population.run(fitness_function, n)
+        except TrainingInterrupted:
+            shutdown.save_aborted()
+
+Long evaluations call shutdown.check() now and then, which raises
+TrainingInterrupted once the generation is to be aborted. It only does so
+while the fitness function runs: the reporters that come after it, which
+may evaluate genomes too, always see a whole generation.
+
+Both checkpoints are numbered with the generation their population is
+evaluated as, and carry the random state at the start of that generation,
+so a resumed run makes the same draws as one that never stopped. Anything
+else the run needs to resume (counters, other generators) comes from the
+state function, and is kept with this reporter, which is pickled into every
+checkpoint along with the species set (see restored_state).
+"""
+import random
+import signal
+
+import neat
+
+FINISH = 1
+ABORT = 2
+
+
+class TrainingInterrupted(Exception):
+    """
+    Raised to end a run early
+    """
+
+
+def ignore_interrupts():
+    """
+    initializer of worker processes: Ctrl+C reaches the whole process group,
+    but only the training process should react to it
+    :return: None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def restored_state(reporters):
+    """
+    the run state kept by the GracefulShutdown of a restored checkpoint
+    :param reporters: List of the reporters of the restored species set
+    :return: dict, or None when the checkpoint has none
+    """
+    for reporter in reporters:
+        if isinstance(reporter, GracefulShutdown):
+            return reporter.saved_state
+    return None
+
+
+class GracefulShutdown(neat.reporting.BaseReporter):
+    """
+    Turns SIGINT / SIGTERM into a checkpoint and the end of the run (see the module docstring)
+    """
+
+    def __init__(self, population, checkpointer, state=None, signals=(signal.SIGINT, signal.SIGTERM)):
+        """
+        Initialize the reporter
+        :param population: neat.Population being run
+        :param checkpointer: neat.Checkpointer that writes the checkpoints
+        :param state: function returning a picklable dict of more state to resume with, or None
+        :param signals: signals that stop the run
+        :return: None
+        """
+        self.population = population
+        self.checkpointer = checkpointer
+        self.state = state
+        self.signals = signals
+        self.level = 0
+        self.saved = None
+        self.generation = None
+        self.random_state = None
+        self.evaluating = False
+        self.handlers = {}
+        # what the state function returned when this reporter was pickled
+        self.saved_state = None
+
+    def __getstate__(self):
+        # pickled into the checkpoints with the species set; only the state of
+        # the run travels, not the run itself
+        state = self.__dict__.copy()
+        state['saved_state'] = self.state() if self.state is not None else None
+        state['population'] = None
+        state['checkpointer'] = None
+        state['state'] = None
+        state['handlers'] = {}
+        return state
+
+    def __enter__(self):
+        for signum in self.signals:
+            self.handlers[signum] = signal.signal(signum, self._handle)
+        return self
+
+    def __exit__(self, *exc):
+        for signum, handler in self.handlers.items():
+            signal.signal(signum, handler)
+        self.handlers = {}
+        return False
+
+    def _handle(self, signum, frame):
+        if self.level == 0:
+            print("\nStopping after this generation, signal again to stop now")
+            self.level = FINISH
+        else:
+            print("\nStopping now")
+            self.level = ABORT
+
+    @property
+    def stopping(self):
+        """
+        :return: True once a stop is requested
+        """
+        return self.level > 0
+
+    def check(self):
+        """
+        raise TrainingInterrupted if the current generation is to be aborted
+        :return: None
+        """
+        if self.level >= ABORT and self.evaluating:
+            raise TrainingInterrupted("aborted in generation {}".format(self.generation))
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.random_state = random.getstate()
+        self.evaluating = True
+
+    def post_evaluate(self, config, population, species, best_genome):
+        self.evaluating = False
+
+    def end_generation(self, config, population, species_set):
+        if self.level:
+            # the population was just bred, and is evaluated as the next generation
+            self.saved = self._save(config, population, species_set, self.generation + 1)
+            raise TrainingInterrupted("stopped after generation {}".format(self.generation))
+
+    def save_aborted(self):
+        """
+        checkpoint the generation that was being evaluated, from its start
+        :return: location of the checkpoint, the one written on the way out if there was one already
+        """
+        if self.saved is not None or self.generation is None:
+            return self.saved
+        # the run is over, so the random state can be rewound to where the generation began
+        random.setstate(self.random_state)
+        p = self.population
+        self.saved = self._save(p.config, p.population, p.species, self.generation)
+        return self.saved
+
+    def _save(self, config, population, species_set, generation):
+        self.checkpointer.save_checkpoint(config, population, species_set, generation)
+        return '{0}{1}'.format(self.checkpointer.filename_prefix, generation)
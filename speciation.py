@@ -0,0 +1,339 @@
+"""
+Speciation with vectorized genome distances.
+
+neat.DefaultSpeciesSet compares genomes pair by pair, walking both gene
+dicts in Python. FastSpeciesSet gives every node key and connection key seen
+in the population a column, stores the representatives as dense rows over
+those columns and the genomes as sparse (column, value) lists, and computes
+the distance of many genomes to all representatives with a few NumPy
+gathers. The big block, every genome against the representatives carried
+over from the previous generation, can be split over worker processes.
+
+The distances of the final representatives are cached for the next
+generation, where elites come back unchanged and don't have to be compared
+again.
+
+Species are assigned with the same procedure and in the same order as
+neat.DefaultSpeciesSet.speciate, so the assignments are the same. Use it
+through the Config constructor, with a [FastSpeciesSet] section in the
+config file:
+
+    neat.config.Config(neat.DefaultGenome, neat.DefaultReproduction,
+                       FastSpeciesSet, neat.DefaultStagnation, config_file)
+"""
+import multiprocessing
+
+import numpy as np
+from neat.config import ConfigParameter, DefaultClassConfig
+from neat.species import DefaultSpeciesSet, Species
+
+from shutdown import ignore_interrupts
+
+# genomes per worker job
+CHUNK_SIZE = 2000
+
+
+class GeneColumns:
+    """
+    The genes of a set of genomes in flat arrays, with a column number for
+    every node key and connection key
+    """
+
+    def __init__(self, genomes):
+        """
+        Number the gene keys and pack the genes
+        :param genomes: List of genomes, a key seen twice is packed once
+        :return: None
+        """
+        unique = {}
+        for g in genomes:
+            unique.setdefault(g.key, g)
+        self.row = {key: i for i, key in enumerate(unique)}
+        genomes = list(unique.values())
+
+        nodes = [n for g in genomes for n in g.nodes.values()]
+        conns = [c for g in genomes for c in g.connections.values()]
+        self.node_offsets = np.concatenate(([0], np.cumsum([len(g.nodes) for g in genomes]))).astype(np.int64)
+        self.conn_offsets = np.concatenate(([0], np.cumsum([len(g.connections) for g in genomes]))).astype(np.int64)
+
+        self.num_node_cols, self.node_col = self._columns(np.array([n.key for n in nodes], dtype=np.int64))
+        self.bias = np.array([n.bias for n in nodes], dtype=np.float64)
+        self.response = np.array([n.response for n in nodes], dtype=np.float64)
+        functions = np.unique(np.array([n.activation for n in nodes] + [n.aggregation for n in nodes]),
+                              return_inverse=True)[1].reshape(-1)
+        self.activation = functions[:len(nodes)]
+        self.aggregation = functions[len(nodes):]
+
+        # connection keys are pairs of node keys, both well inside 32 bits
+        pairs = np.array([c.key for c in conns], dtype=np.int64).reshape(-1, 2)
+        self.num_conn_cols, self.conn_col = self._columns((pairs[:, 0] << 32) + (pairs[:, 1] & 0xffffffff))
+        self.weight = np.array([c.weight for c in conns], dtype=np.float64)
+        self.enabled = np.array([c.enabled for c in conns], dtype=bool)
+
+    @staticmethod
+    def _columns(keys):
+        columns, inverse = np.unique(keys, return_inverse=True)
+        return len(columns), inverse.reshape(-1)
+
+    @staticmethod
+    def _gather(offsets, rows):
+        """ indices of the genes of rows, and the offsets of each row in them """
+        lengths = offsets[rows + 1] - offsets[rows]
+        new_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        index = np.repeat(offsets[rows] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+        return index, new_offsets
+
+    def sparse(self, keys):
+        """
+        the genes of many genomes, concatenated
+        :param keys: genome keys
+        :return: dict of arrays; genome i owns node genes node_offsets[i]:node_offsets[i + 1],
+                 and connection genes conn_offsets[i]:conn_offsets[i + 1]
+        """
+        rows = np.array([self.row[k] for k in keys], dtype=np.int64)
+        nodes, node_offsets = self._gather(self.node_offsets, rows)
+        conns, conn_offsets = self._gather(self.conn_offsets, rows)
+        return {"node_offsets": node_offsets, "node_col": self.node_col[nodes], "bias": self.bias[nodes],
+                "response": self.response[nodes], "activation": self.activation[nodes],
+                "aggregation": self.aggregation[nodes],
+                "conn_offsets": conn_offsets, "conn_col": self.conn_col[conns], "weight": self.weight[conns],
+                "enabled": self.enabled[conns]}
+
+    def dense(self, keys):
+        """
+        the genes of a few genomes as full rows over all columns
+        :param keys: genome keys
+        :return: dict of (len(keys), columns) arrays, with a presence mask per gene type
+        """
+        n, kn, kc = len(keys), self.num_node_cols, self.num_conn_cols
+        out = {"node_present": np.zeros((n, kn), dtype=bool), "bias": np.zeros((n, kn)),
+               "response": np.zeros((n, kn)), "activation": np.zeros((n, kn), dtype=np.int64),
+               "aggregation": np.zeros((n, kn), dtype=np.int64),
+               "conn_present": np.zeros((n, kc), dtype=bool), "weight": np.zeros((n, kc)),
+               "enabled": np.zeros((n, kc), dtype=bool),
+               "num_nodes": np.zeros(n), "num_conns": np.zeros(n)}
+        for i, key in enumerate(keys):
+            r = self.row[key]
+            genes = slice(self.node_offsets[r], self.node_offsets[r + 1])
+            col = self.node_col[genes]
+            out["node_present"][i, col] = True
+            out["bias"][i, col] = self.bias[genes]
+            out["response"][i, col] = self.response[genes]
+            out["activation"][i, col] = self.activation[genes]
+            out["aggregation"][i, col] = self.aggregation[genes]
+            out["num_nodes"][i] = len(col)
+            genes = slice(self.conn_offsets[r], self.conn_offsets[r + 1])
+            col = self.conn_col[genes]
+            out["conn_present"][i, col] = True
+            out["weight"][i, col] = self.weight[genes]
+            out["enabled"][i, col] = self.enabled[genes]
+            out["num_conns"][i] = len(col)
+        return out
+
+
+def _segment_sums(values, offsets):
+    """
+    sum of values[:, offsets[i]:offsets[i + 1]] for every i
+    :return: (rows, len(offsets) - 1) array
+    """
+    out = np.zeros((values.shape[0], len(offsets) - 1))
+    nonempty = offsets[1:] > offsets[:-1]
+    if nonempty.any():
+        out[:, nonempty] = np.add.reduceat(values, offsets[:-1][nonempty], axis=1)
+    return out
+
+
+def _part_distance(homologous, gene_distance, offsets, num_reps, disjoint_coefficient):
+    counts = np.diff(offsets)
+    shared = _segment_sums(homologous.astype(np.float64), offsets)
+    total = _segment_sums(np.where(homologous, gene_distance, 0.0), offsets)
+    disjoint = counts[None, :] + num_reps[:, None] - 2 * shared
+    largest = np.maximum(counts[None, :], num_reps[:, None])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        d = (total + disjoint_coefficient * disjoint) / largest
+    return np.where(largest > 0, d, 0.0)
+
+
+def distances(reps, genes, disjoint_coefficient, weight_coefficient):
+    """
+    genome distances of neat.DefaultGenome.distance, between every representative and every genome
+    :param reps: dict from GeneColumns.dense
+    :param genes: dict from GeneColumns.sparse
+    :param disjoint_coefficient: compatibility_disjoint_coefficient
+    :param weight_coefficient: compatibility_weight_coefficient
+    :return: (genomes, representatives) numpy array
+    """
+    col = genes["node_col"]
+    d = np.abs(reps["bias"][:, col] - genes["bias"]) + np.abs(reps["response"][:, col] - genes["response"])
+    d = d + (reps["activation"][:, col] != genes["activation"])
+    d = d + (reps["aggregation"][:, col] != genes["aggregation"])
+    nodes = _part_distance(reps["node_present"][:, col], d * weight_coefficient, genes["node_offsets"],
+                           reps["num_nodes"], disjoint_coefficient)
+
+    col = genes["conn_col"]
+    d = np.abs(reps["weight"][:, col] - genes["weight"]) + (reps["enabled"][:, col] != genes["enabled"])
+    conns = _part_distance(reps["conn_present"][:, col], d * weight_coefficient, genes["conn_offsets"],
+                           reps["num_conns"], disjoint_coefficient)
+    return (nodes + conns).T
+
+
+def _distances_job(args):
+    return distances(*args)
+
+
+class FastSpeciesSet(DefaultSpeciesSet):
+    """ DefaultSpeciesSet with vectorized, cached and optionally parallel distances. """
+
+    def __init__(self, config, reporters):
+        DefaultSpeciesSet.__init__(self, config, reporters)
+        self.pool = None
+        # representative key -> (sorted genome keys, their distances), from the last speciation
+        self.cache = {}
+
+    def __getstate__(self):
+        # the species set is part of every checkpoint, the worker pool isn't
+        state = self.__dict__.copy()
+        state['pool'] = None
+        return state
+
+    @classmethod
+    def parse_config(cls, param_dict):
+        return DefaultClassConfig(param_dict,
+                                  [ConfigParameter('compatibility_threshold', float),
+                                   ConfigParameter('workers', int, 0)])
+
+    def close(self):
+        """
+        stop the worker processes
+        :return: None
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _block(self, columns, rep_keys, genome_keys, genome_config):
+        """ distances of the genomes to the representatives, split over the workers if it is worth it """
+        reps = columns.dense(rep_keys)
+        coefficients = (genome_config.compatibility_disjoint_coefficient,
+                        genome_config.compatibility_weight_coefficient)
+        workers = self.species_set_config.workers
+        if workers > 1 and len(genome_keys) > CHUNK_SIZE:
+            if self.pool is None:
+                self.pool = multiprocessing.Pool(workers, initializer=ignore_interrupts)
+            jobs = [(reps, columns.sparse(genome_keys[i:i + CHUNK_SIZE])) + coefficients
+                    for i in range(0, len(genome_keys), CHUNK_SIZE)]
+            return np.concatenate(self.pool.map(_distances_job, jobs))
+        return distances(reps, columns.sparse(genome_keys), *coefficients)
+
+    def _cached_block(self, columns, rep_key, genome_keys, genome_config):
+        """ distances of the genomes to one representative, reusing last generation's """
+        d = np.empty(len(genome_keys))
+        missing = np.ones(len(genome_keys), dtype=bool)
+        cached = self.cache.get(rep_key)
+        if cached is not None and len(cached[0]):
+            keys, values = cached
+            wanted = np.array(genome_keys, dtype=np.int64)
+            at = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+            hit = keys[at] == wanted
+            d[hit] = values[at[hit]]
+            missing = ~hit
+        if missing.any():
+            todo = [k for k, m in zip(genome_keys, missing) if m]
+            d[missing] = self._block(columns, [rep_key], todo, genome_config)[:, 0]
+        return d
+
+    def speciate(self, config, population, generation):
+        """
+        Place genomes into species by genetic similarity, like DefaultSpeciesSet.speciate.
+        """
+        assert isinstance(population, dict)
+
+        compatibility_threshold = self.species_set_config.compatibility_threshold
+        genome_config = config.genome_config
+        columns = GeneColumns([s.representative for s in self.species.values()] + list(population.values()))
+        computed = []
+
+        # Find the best representatives for each existing species.
+        unspeciated = set(population)
+        new_representatives = {}
+        new_members = {}
+        for sid, s in self.species.items():
+            candidates = list(unspeciated)
+            d = self._cached_block(columns, s.representative.key, candidates, genome_config)
+            computed.append(d)
+
+            # The new representative is the genome closest to the current representative.
+            new_rid = candidates[int(np.argmin(d))]
+            new_representatives[sid] = new_rid
+            new_members[sid] = [new_rid]
+            unspeciated.remove(new_rid)
+
+        # Partition population into species based on genetic similarity. The
+        # genomes against the representatives known so far is one block,
+        # representatives created along the way are compared one by one.
+        rep_keys = list(new_representatives.values())
+        rep_sids = list(new_representatives)
+        pending = list(unspeciated)
+        row = {gid: i for i, gid in enumerate(pending)}
+        block = (self._block(columns, rep_keys, pending, genome_config)
+                 if rep_keys and pending else np.zeros((len(pending), 0)))
+        computed.append(block.ravel())
+        extra_keys = []
+        extra_sids = []
+        while unspeciated:
+            gid = unspeciated.pop()
+
+            # Find the species with the most similar representative.
+            d = block[row[gid]]
+            if extra_keys:
+                more = distances(columns.dense(extra_keys), columns.sparse([gid]),
+                                 genome_config.compatibility_disjoint_coefficient,
+                                 genome_config.compatibility_weight_coefficient)[0]
+                computed.append(more)
+                d = np.concatenate((d, more))
+            d = np.where(d < compatibility_threshold, d, np.inf)
+
+            if len(d) and np.isfinite(d).any():
+                i = int(np.argmin(d))
+                sid = rep_sids[i] if i < len(rep_sids) else extra_sids[i - len(rep_sids)]
+                new_members[sid].append(gid)
+            else:
+                # No species is similar enough, create a new species, using
+                # this genome as its representative.
+                sid = next(self.indexer)
+                new_representatives[sid] = gid
+                new_members[sid] = [gid]
+                extra_keys.append(gid)
+                extra_sids.append(sid)
+
+        # Keep the block for the next generation, where these representatives
+        # are compared with a population that still holds the elites. When
+        # every genome became a representative there is nothing to keep.
+        self.cache = {}
+        if pending:
+            order = np.argsort(np.array(pending, dtype=np.int64), kind="stable")
+            sorted_keys = np.array(pending, dtype=np.int64)[order]
+            self.cache = {rid: (sorted_keys, block[order, j]) for j, rid in enumerate(rep_keys)}
+
+        # Update species collection based on new speciation.
+        self.genome_to_species = {}
+        for sid, rid in new_representatives.items():
+            s = self.species.get(sid)
+            if s is None:
+                s = Species(sid, generation)
+                self.species[sid] = s
+
+            members = new_members[sid]
+            for gid in members:
+                self.genome_to_species[gid] = sid
+
+            member_dict = dict((gid, population[gid]) for gid in members)
+            s.update(population[rid], member_dict)
+
+        computed = np.concatenate(computed) if computed else np.zeros(0)
+        if len(computed):
+            gdmean = np.mean(computed)
+            gdstdev = np.std(computed)
+            self.reporters.info(
+                'Mean genetic distance {0:.3f}, standard deviation {1:.3f}'.format(gdmean, gdstdev))
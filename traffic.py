@@ -0,0 +1,127 @@
+"""
+Traffic schedule of an episode, keyed by scrolled distance.
+
+In the game a new car drives in whenever the red car passes one: passing
+car 1 brings car 2, then 3, then a blue or red car (id 4), then car 1 again.
+The other cars all drive at FRAME_VEL, so the moment a car is passed only
+depends on when and where it appeared, not on the red cars. TrafficSchedule
+therefore works the whole chain out from the seed: every spawn is an event
+in a heap keyed by the distance the road has scrolled (Base.distance), and
+spawning a car schedules the next one at the distance it will be passed.
+
+    traffic = TrafficSchedule(seed)
+    othercars = [OtherCar(*spawn) for spawn in traffic.start()]
+    ...
+    for spawn in traffic.due(base.distance):
+        othercars.append(OtherCar(*spawn))
+
+Every agent, and every population size, gets the same traffic from a seed,
+and a spawn costs O(log n) in the number of pending events.
+
+The schedule and the turns of the blue and red cars each draw from their own
+generator, seeded with spawn_seed(seed) and turn_seed(seed), so the turns
+are not correlated with where and which cars spawn.
+"""
+import heapq
+import random
+from collections import namedtuple
+
+FRAME_VEL = 15
+RED_Y = 750
+
+ROAD_LEFT_BOUNDARY = 100
+ROAD_RIGHT_BOUNDARY = 340
+CAR_WIDTH = 33
+
+# the arguments of OtherCar
+Spawn = namedtuple("Spawn", ["color", "id", "y", "dir", "x"])
+
+
+def spawn_seed(seed):
+    """
+    :param seed: seed of the traffic of an episode (int)
+    :return: seed of the spawn generator of the episode
+    """
+    return (seed << 1) | 1
+
+
+def turn_seed(seed):
+    """
+    :param seed: seed of the traffic of an episode (int)
+    :return: seed of the generator the turns of the other cars are drawn from
+    """
+    return seed << 1
+
+
+def passed_at(distance, y):
+    """
+    scrolled distance at which a car is passed
+    :param distance: scrolled distance when the car is at y
+    :param y: y position of the car
+    :return: distance (int)
+    """
+    # a car is passed on the first frame it moves below the red car
+    frames = max(RED_Y - y, -1) // FRAME_VEL + 1
+    return distance + frames * FRAME_VEL
+
+
+class TrafficSchedule:
+    """
+    The spawns of an episode drawn from a seed (see the module docstring)
+    """
+
+    def __init__(self, seed):
+        """
+        Initialize the schedule
+        :param seed: seed of the traffic (int)
+        :return: None
+        """
+        self.rng = random.Random(spawn_seed(seed))
+        # (distance, order, id of the car to spawn)
+        self.queue = []
+        self.order = 0
+
+    def _spawn(self, color, car_id, distance, y, dir=None):
+        """ draw the position of a new car and schedule the car that follows it """
+        spawn = Spawn(color, car_id, y, dir, self.rng.randrange(ROAD_LEFT_BOUNDARY, ROAD_RIGHT_BOUNDARY - CAR_WIDTH))
+        heapq.heappush(self.queue, (passed_at(distance, y), self.order, (car_id + 1) % 4))
+        self.order += 1
+        return spawn
+
+    def _special(self, car_id, distance, y, colors):
+        """ a car that turns, blue or red, in a random direction """
+        color = self.rng.choice(colors)
+        if color == "yellow":
+            return self._spawn(color, car_id, distance, y)
+        return self._spawn(color, car_id, distance, y, dir=self.rng.choice(['left', 'right']))
+
+    def start(self):
+        """
+        the cars on the road when the episode starts
+        :return: List of Spawn
+        """
+        return [self._spawn("yellow", 1, 0, 0),
+                self._spawn("yellow", 2, 0, self.rng.randint(-350, -200)),
+                self._spawn("yellow", 3, 0, self.rng.randint(-550, -400)),
+                self._special(4, 0, self.rng.randint(-700, -600), ["yellow", "blue", "otherred"])]
+
+    def next_distance(self):
+        """
+        :return: scrolled distance of the next spawn
+        """
+        return self.queue[0][0]
+
+    def due(self, distance):
+        """
+        the cars that appear once the road has scrolled distance
+        :param distance: scrolled distance (Base.distance)
+        :return: List of Spawn, in spawn order
+        """
+        spawns = []
+        while self.queue and self.queue[0][0] <= distance:
+            at, _, car_id = heapq.heappop(self.queue)
+            if car_id == 0:
+                spawns.append(self._special(4, at, 0, ["blue", "otherred"]))
+            else:
+                spawns.append(self._spawn("yellow", car_id, at, 0))
+        return spawns
@@ -0,0 +1,407 @@
+"""
+Gym-style vectorized Road Fighter environment.
+
+RoadFighterVectorEnv runs N independent single-car episodes in lockstep,
+with the state of every episode in NumPy arrays: one row per episode, and
+MAX_CARS slots per row for the other cars. The traffic follows the rules of
+road_fighter_ai.simulate:
+
+- every episode draws a seed, and its cars come from a
+  traffic.TrafficSchedule of that seed: the same opening cars, and the same
+  spawns keyed by scrolled distance;
+- yellow cars drive straight, blue cars drift sideways, and the other red
+  cars swerve and come back.
+
+The moments the blue and red cars turn are drawn from the environment's
+NumPy generator, a batch at a time, and not from turn_seed(seed) car by car,
+so an episode plays by the same rules as simulate but is not the episode
+simulate plays on that seed.
+
+Rewards are the fitness terms of fitness.py, with the same default weights.
+
+    observation  (N, 3) float32: red car x, centre x and centre y of the car ahead,
+                 the same inputs the NEAT networks get
+    action       (N,) ints: 0 straight, 1 left, 2 right
+    terminated   the red car crashed into a car or left the road
+    truncated    the episode reached max_steps
+
+Episodes reset automatically: the observation returned for a finished
+episode is the first one of its next episode, and the last one is in
+info["final_observation"] (masked by info["_final_observation"]).
+
+With gymnasium installed the class is a gymnasium.vector.VectorEnv with the
+matching spaces. ProcessVectorEnv spreads the episodes over worker
+processes with the same interface.
+"""
+import multiprocessing
+
+import numpy as np
+
+from fitness import DEFAULT_WEIGHTS, NEAR_MISS_GAP
+from traffic import TrafficSchedule
+
+try:
+    import gymnasium
+    from gymnasium import spaces
+except ImportError:
+    gymnasium = None
+    spaces = None
+
+WIN_HEIGHT = 800
+
+ROAD_LEFT_BOUNDARY = 100
+ROAD_RIGHT_BOUNDARY = 340
+
+FRAME_VEL = 15
+RED_VEL = 5
+RED_START = (250, 750)
+
+carsize = (33, 44)
+CAR_WIDTH = round(2 * carsize[0] / 3 + 2)
+CURRENTCAR_WIDTH = round(2 * carsize[0] / 3)
+HALF_HEIGHT = round(carsize[1] / 2)
+
+# the other cars: at most this many are on the road at once
+MAX_CARS = 8
+YELLOW, BLUE, OTHERRED = 0, 1, 2
+LEFT, RIGHT = -1, 1
+KINDS = {"yellow": YELLOW, "blue": BLUE, "otherred": OTHERRED}
+DIRS = {None: 0, "left": LEFT, "right": RIGHT}
+
+ACTIONS = np.array([0, -1, 1], dtype=np.int64)
+
+_Base = gymnasium.vector.VectorEnv if gymnasium is not None else object
+
+
+class RoadFighterVectorEnv(_Base):
+    """
+    N Road Fighter episodes with batched NumPy state (see the module docstring)
+    """
+
+    def __init__(self, num_envs, max_steps=3000, weights=None, seed=None):
+        """
+        Initialize the episodes
+        :param num_envs: number of episodes run in lockstep
+        :param max_steps: episodes are truncated after this many steps
+        :param weights: reward weights, missing ones default to fitness.DEFAULT_WEIGHTS
+        :param seed: seed of the traffic
+        :return: None
+        """
+        self.num_envs = num_envs
+        self.max_steps = max_steps
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.rng = np.random.default_rng(seed)
+
+        if spaces is not None:
+            self.single_observation_space = spaces.Box(-np.inf, np.inf, (3,), np.float32)
+            self.single_action_space = spaces.Discrete(3)
+            self.observation_space = spaces.Box(-np.inf, np.inf, (num_envs, 3), np.float32)
+            self.action_space = spaces.MultiDiscrete(np.full(num_envs, 3))
+
+        n, k = num_envs, MAX_CARS
+        self.red_x = np.zeros(n, dtype=np.int64)
+        self.steering = np.zeros(n, dtype=np.int64)
+        self.steps = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n, dtype=np.int64)
+        self.returns = np.zeros(n)
+        self.next_seq = np.zeros(n, dtype=np.int64)
+        # the TrafficSchedule of every episode, and the scrolled distance of its next spawn
+        self.traffic = [None] * n
+        self.next_spawn = np.zeros(n, dtype=np.int64)
+
+        self.active = np.zeros((n, k), dtype=bool)
+        self.seq = np.zeros((n, k), dtype=np.int64)
+        self.kind = np.zeros((n, k), dtype=np.int64)
+        self.x = np.zeros((n, k), dtype=np.int64)
+        self.y = np.zeros((n, k), dtype=np.int64)
+        self.origin = np.zeros((n, k), dtype=np.int64)
+        self.dir = np.zeros((n, k), dtype=np.int64)
+        self.passed = np.zeros((n, k), dtype=bool)
+        self.shift = np.zeros((n, k), dtype=bool)
+        self.reverse = np.zeros((n, k), dtype=bool)
+        self.distance = np.zeros((n, k), dtype=np.int64)
+
+    def _spawn(self, envs, spawns):
+        """ put new cars, traffic.Spawn tuples, in free slots of the given envs, in spawn order """
+        slots = []
+        seq = []
+        for env in envs:
+            # an env can get more than one car at once
+            slot = int(np.argmin(self.active[env]))
+            if self.active[env, slot]:
+                raise RuntimeError("More than {} cars on the road".format(MAX_CARS))
+            self.active[env, slot] = True
+            slots.append(slot)
+            seq.append(self.next_seq[env])
+            self.next_seq[env] += 1
+        self.seq[envs, slots] = seq
+        self.kind[envs, slots] = [KINDS[spawn.color] for spawn in spawns]
+        self.x[envs, slots] = self.origin[envs, slots] = [spawn.x for spawn in spawns]
+        self.y[envs, slots] = [spawn.y for spawn in spawns]
+        self.dir[envs, slots] = [DIRS[spawn.dir] for spawn in spawns]
+        self.passed[envs, slots] = False
+        self.shift[envs, slots] = True
+        self.reverse[envs, slots] = False
+        self.distance[envs, slots] = 0
+
+    def _reset_envs(self, envs):
+        """ start new episodes in the given envs """
+        m = len(envs)
+        if m == 0:
+            return
+        self.red_x[envs] = RED_START[0]
+        self.steering[envs] = 0
+        self.steps[envs] = 0
+        self.score[envs] = 0
+        self.returns[envs] = 0.0
+        self.next_seq[envs] = 0
+        self.active[envs] = False
+
+        # the opening traffic of road_fighter_ai.simulate
+        spawn_envs = []
+        spawns = []
+        for env, seed in zip(envs.tolist(), self.rng.integers(2 ** 32, size=m).tolist()):
+            self.traffic[env] = TrafficSchedule(seed)
+            for spawn in self.traffic[env].start():
+                spawn_envs.append(env)
+                spawns.append(spawn)
+            self.next_spawn[env] = self.traffic[env].next_distance()
+        self._spawn(spawn_envs, spawns)
+
+    def _observe(self):
+        """ the network inputs: red car x and the centre of the car it looks at """
+        n = self.num_envs
+        # cars in the order they were spawned, like the othercars list
+        order = np.argsort(np.where(self.active, self.seq, np.iinfo(np.int64).max), axis=1)
+        count = self.active.sum(axis=1)
+        ys = np.take_along_axis(self.y, order[:, :3], axis=1)
+        red_y = RED_START[1]
+        index = np.select([(count > 1) & (red_y < ys[:, 0]),
+                           (count > 2) & (red_y < ys[:, 1]),
+                           (count > 3) & (red_y < ys[:, 2])], [1, 2, 3], 0)
+        slot = order[np.arange(n), index]
+        obs = np.empty((n, 3), dtype=np.float32)
+        obs[:, 0] = self.red_x
+        obs[:, 1] = self.x[np.arange(n), slot] + round(CURRENTCAR_WIDTH / 2)
+        obs[:, 2] = self.y[np.arange(n), slot] + round(carsize[1] / 2)
+        return obs
+
+    def reset(self, seed=None, options=None):
+        """
+        start all episodes
+        :param seed: reseed the traffic
+        :return: (observations, info)
+        """
+        if seed is not None:
+            self.rng = np.random.default_rng(seed)
+        self._reset_envs(np.arange(self.num_envs))
+        return self._observe(), {}
+
+    def _turn(self, mask):
+        """ OtherCar.turn for the blue cars in mask """
+        right_limit = np.minimum(ROAD_RIGHT_BOUNDARY - carsize[0], self.origin + 64)
+        left_limit = np.maximum(ROAD_LEFT_BOUNDARY, self.origin - 64)
+        self.x += 4 * (mask & (self.dir == RIGHT) & (self.x + 4 < right_limit))
+        self.x -= 4 * (mask & (self.dir == LEFT) & (self.x - 4 > left_limit))
+
+    def _turn_and_reverse(self, mask):
+        """ OtherCar.turn_and_reverse for the other red cars in mask """
+        right = mask & (self.dir == RIGHT)
+        left = mask & (self.dir == LEFT)
+        sign = np.where(right, 1, -1)
+
+        road = np.where(right, ROAD_RIGHT_BOUNDARY - carsize[0], ROAD_LEFT_BOUNDARY)
+        swerve = self.origin + 64 * sign
+        # np.argmin / np.argmax of the two bounds pick the road edge on ties
+        road_closer = np.where(right, road <= swerve, road >= swerve)
+        limit = np.where(road_closer, road, swerve)
+
+        step = (right | left) & self.shift & (sign * (self.x + 4 * sign - limit) < 0)
+        self.x += 4 * sign * step
+        self.distance += 4 * step
+
+        done = np.where(road_closer, sign * (self.x - (road - 4 * sign)) >= 0, self.distance >= 60)
+        done &= right | left
+        self.shift &= ~done
+        self.reverse |= done
+
+        back = self.reverse & (self.distance > 0)
+        self.x -= 4 * sign * back
+        self.distance -= 4 * back
+        stop = self.reverse & ~back
+        self.reverse &= ~stop
+        self.distance[stop] = 0
+
+    def step(self, actions):
+        """
+        advance every episode by one frame
+        :param actions: (N,) ints, 0 straight, 1 left, 2 right
+        :return: (observations, rewards, terminated, truncated, info)
+        """
+        n = self.num_envs
+        w = self.weights
+        steering = ACTIONS[np.asarray(actions, dtype=np.int64)]
+        rewards = np.full(n, w["frames"])
+        rewards += w["jerk"] * np.abs(steering - self.steering)
+        self.steering = steering
+        self.red_x += RED_VEL * steering
+        self.steps += 1
+
+        # traffic
+        active = self.active
+        self.y += FRAME_VEL * active
+        self._turn(active & (self.kind == BLUE) & (self.y > self.rng.integers(400, 501, active.shape)))
+        self._turn_and_reverse(active & (self.kind == OTHERRED) & (self.y > self.rng.integers(350, 451, active.shape)))
+
+        red_x = self.red_x[:, None]
+        red_y = RED_START[1]
+        level = (self.y + HALF_HEIGHT >= red_y) & (self.y <= red_y + HALF_HEIGHT)
+        gap = np.maximum(self.x - (red_x + CAR_WIDTH), red_x - (self.x + CURRENTCAR_WIDTH))
+        collided = (active & level & (gap <= 0)).any(axis=1)
+
+        passing = active & ~self.passed & (red_y < self.y)
+        self.passed |= passing
+        any_pass = passing.any(axis=1) & ~collided
+        self.score += any_pass
+        rewards += w["passed"] * any_pass
+
+        self.active &= self.y <= WIN_HEIGHT
+        # the cars the schedules bring once the road has scrolled this far
+        scrolled = self.steps * FRAME_VEL
+        spawn_envs = []
+        spawns = []
+        for env in np.flatnonzero(scrolled >= self.next_spawn).tolist():
+            for spawn in self.traffic[env].due(scrolled[env]):
+                spawn_envs.append(env)
+                spawns.append(spawn)
+            self.next_spawn[env] = self.traffic[env].next_distance()
+        if spawns:
+            self._spawn(spawn_envs, spawns)
+
+        alive = ~collided
+        near = (self.active & level & (gap > 0) & (gap <= NEAR_MISS_GAP)).any(axis=1)
+        rewards += w["near_misses"] * (near & alive)
+        off_road = alive & ((self.red_x < ROAD_LEFT_BOUNDARY) | (self.red_x + carsize[0] > ROAD_RIGHT_BOUNDARY))
+        rewards += w["collision"] * collided + w["off_road"] * off_road
+
+        terminated = collided | off_road
+        truncated = ~terminated & (self.steps >= self.max_steps)
+        self.returns += rewards
+
+        info = {}
+        done = np.flatnonzero(terminated | truncated)
+        obs = self._observe()
+        if len(done):
+            mask = np.zeros(n, dtype=bool)
+            mask[done] = True
+            info = {"final_observation": obs.copy(), "_final_observation": mask,
+                    "episode_return": self.returns.copy(), "episode_length": self.steps.copy(),
+                    "score": self.score.copy(), "_episode": mask}
+            self._reset_envs(done)
+            obs[done] = self._observe()[done]
+        return obs, rewards, terminated, truncated, info
+
+    def close(self, **kwargs):
+        pass
+
+
+def _worker(conn, num_envs, kwargs):
+    env = RoadFighterVectorEnv(num_envs, **kwargs)
+    while True:
+        command, data = conn.recv()
+        if command == "step":
+            conn.send(env.step(data))
+        elif command == "reset":
+            conn.send(env.reset(seed=data))
+        else:
+            conn.close()
+            return
+
+
+class ProcessVectorEnv(_Base):
+    """
+    RoadFighterVectorEnv split over worker processes; every worker steps its
+    share of the episodes and the results are concatenated
+    """
+
+    def __init__(self, num_envs, workers=None, seed=None, **kwargs):
+        """
+        Start the workers
+        :param num_envs: total number of episodes
+        :param workers: number of processes, defaults to the CPU count
+        :param seed: seed of the traffic; worker i uses seed + i
+        :param kwargs: other RoadFighterVectorEnv arguments
+        :return: None
+        """
+        workers = min(workers or multiprocessing.cpu_count(), num_envs)
+        self.num_envs = num_envs
+        self.sizes = [len(part) for part in np.array_split(np.arange(num_envs), workers)]
+        self.seed = seed
+        self.conns = []
+        self.processes = []
+        for i, size in enumerate(self.sizes):
+            parent, child = multiprocessing.Pipe()
+            worker_kwargs = dict(kwargs, seed=None if seed is None else seed + i)
+            process = multiprocessing.Process(target=_worker, args=(child, size, worker_kwargs), daemon=True)
+            process.start()
+            child.close()
+            self.conns.append(parent)
+            self.processes.append(process)
+
+        if spaces is not None:
+            self.single_observation_space = spaces.Box(-np.inf, np.inf, (3,), np.float32)
+            self.single_action_space = spaces.Discrete(3)
+            self.observation_space = spaces.Box(-np.inf, np.inf, (num_envs, 3), np.float32)
+            self.action_space = spaces.MultiDiscrete(np.full(num_envs, 3))
+
+    def reset(self, seed=None, options=None):
+        """
+        start all episodes
+        :param seed: reseed the traffic; worker i uses seed + i
+        :return: (observations, info)
+        """
+        for i, conn in enumerate(self.conns):
+            conn.send(("reset", None if seed is None else seed + i))
+        results = [conn.recv() for conn in self.conns]
+        return np.concatenate([obs for obs, _ in results]), {}
+
+    def step(self, actions):
+        """
+        advance every episode by one frame
+        :param actions: (N,) ints, 0 straight, 1 left, 2 right
+        :return: (observations, rewards, terminated, truncated, info)
+        """
+        start = 0
+        for conn, size in zip(self.conns, self.sizes):
+            conn.send(("step", np.asarray(actions)[start:start + size]))
+            start += size
+        results = [conn.recv() for conn in self.conns]
+        obs, rewards, terminated, truncated = (np.concatenate([r[i] for r in results]) for i in range(4))
+
+        info = {}
+        if any(r[4] for r in results):
+            for key in ("final_observation", "_final_observation", "episode_return", "episode_length",
+                        "score", "_episode"):
+                parts = []
+                for r, size in zip(results, self.sizes):
+                    if key in r[4]:
+                        parts.append(r[4][key])
+                    elif key.startswith("_"):
+                        parts.append(np.zeros(size, dtype=bool))
+                    else:
+                        parts.append(np.zeros((size, 3) if key == "final_observation" else size,
+                                              dtype=np.float32 if key == "final_observation" else np.float64))
+                info[key] = np.concatenate(parts)
+        return obs, rewards, terminated, truncated, info
+
+    def close(self, **kwargs):
+        """
+        stop the workers
+        :return: None
+        """
+        for conn in self.conns:
+            conn.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.conns = []
+        self.processes = []
@@ -1,11 +1,30 @@
 from __future__ import print_function
 
-import copy
 import warnings
 
 import graphviz
 import matplotlib.pyplot as plt
+import neat
 import numpy as np
+from matplotlib.collections import PolyCollection
+from matplotlib.figure import Figure
+
+from artifacts import atomic_output, atomic_write
+from genome_graph import GenomeGraph
+
+
+def new_figure(view):
+    """ A pyplot figure when it is going to be shown, otherwise a plain Figure that
+    never touches a GUI backend and can be drawn from any thread. """
+    if view:
+        return plt.figure()
+    return Figure()
+
+
+def save_figure(fig, filename):
+    """ Atomically writes a figure; the format comes from the file extension. """
+    with atomic_output(filename) as tmp:
+        fig.savefig(tmp)
 
 
 def plot_stats(statistics, ylog=False, view=False, filename='avg_fitness.svg'):
@@ -19,24 +38,25 @@ def plot_stats(statistics, ylog=False, view=False, filename='avg_fitness.svg'):
     avg_fitness = np.array(statistics.get_fitness_mean())
     stdev_fitness = np.array(statistics.get_fitness_stdev())
 
-    plt.plot(generation, avg_fitness, 'b-', label="average")
-    #plt.plot(generation, avg_fitness - stdev_fitness, 'g-.', label="-1 sd")
-    plt.plot(generation, avg_fitness + stdev_fitness, 'g-.', label="+1 sd")
-    plt.plot(generation, best_fitness, 'r-', label="best")
-
-    plt.title("Population's average and best fitness")
-    plt.xlabel("Generations")
-    plt.ylabel("Fitness")
-    plt.grid()
-    plt.legend(loc="best")
+    fig = new_figure(view)
+    ax = fig.add_subplot()
+    ax.plot(generation, avg_fitness, 'b-', label="average")
+    #ax.plot(generation, avg_fitness - stdev_fitness, 'g-.', label="-1 sd")
+    ax.plot(generation, avg_fitness + stdev_fitness, 'g-.', label="+1 sd")
+    ax.plot(generation, best_fitness, 'r-', label="best")
+
+    ax.set_title("Population's average and best fitness")
+    ax.set_xlabel("Generations")
+    ax.set_ylabel("Fitness")
+    ax.grid()
+    ax.legend(loc="best")
     if ylog:
-        plt.gca().set_yscale('symlog')
+        ax.set_yscale('symlog')
 
-    plt.savefig(filename)
+    save_figure(fig, filename)
     if view:
         plt.show()
-
-    plt.close()
+        plt.close(fig)
 
 
 def plot_spikes(spikes, view=False, filename=None, title=None):
@@ -95,19 +115,19 @@ def plot_species(statistics, view=False, filename='speciation.svg'):
     num_generations = len(species_sizes)
     curves = np.array(species_sizes).T
 
-    fig, ax = plt.subplots()
+    fig = new_figure(view)
+    ax = fig.add_subplot()
     ax.stackplot(range(num_generations), *curves)
 
-    plt.title("Speciation")
-    plt.ylabel("Size per Species")
-    plt.xlabel("Generations")
+    ax.set_title("Speciation")
+    ax.set_ylabel("Size per Species")
+    ax.set_xlabel("Generations")
 
-    plt.savefig(filename)
+    save_figure(fig, filename)
 
     if view:
         plt.show()
-
-    plt.close()
+        plt.close(fig)
 
 
 def draw_net(config, genome, view=False, filename=None, node_names=None, show_disabled=True, prune_unused=False,
@@ -151,21 +171,9 @@ def draw_net(config, genome, view=False, filename=None, node_names=None, show_di
 
         dot.node(name, _attributes=node_attrs)
 
+    graph = GenomeGraph(genome, config, include_disabled=show_disabled)
     if prune_unused:
-        connections = set()
-        for cg in genome.connections.values():
-            if cg.enabled or show_disabled:
-                connections.add(cg.key)
-
-        used_nodes = copy.copy(outputs)
-        pending = copy.copy(outputs)
-        while pending:
-            new_pending = set()
-            for a, b in connections:
-                if b in pending and a not in used_nodes:
-                    new_pending.add(a)
-                    used_nodes.add(a)
-            pending = new_pending
+        used_nodes = graph.ancestors(outputs)
     else:
         used_nodes = set(genome.nodes.keys())
 
@@ -176,18 +184,194 @@ def draw_net(config, genome, view=False, filename=None, node_names=None, show_di
         attrs = {'style': 'filled', 'fillcolor': node_colors.get(n, 'white')}
         dot.node(str(n), _attributes=attrs)
 
-    for cg in genome.connections.values():
-        if cg.enabled or show_disabled:
-            #if cg.input not in used_nodes or cg.output not in used_nodes:
-            #    continue
-            input, output = cg.key
-            a = node_names.get(input, str(input))
-            b = node_names.get(output, str(output))
-            style = 'solid' if cg.enabled else 'dotted'
-            color = 'green' if cg.weight > 0 else 'red'
-            width = str(0.1 + abs(cg.weight / 5.0))
-            dot.edge(a, b, _attributes={'style': style, 'color': color, 'penwidth': width})
-
-    dot.render(filename, view=view)
-
-    return dot
\ No newline at end of file
+    for input, output, attrs in graph.edge_attributes():
+        #if input not in used_nodes or output not in used_nodes:
+        #    continue
+        a = node_names.get(input, str(input))
+        b = node_names.get(output, str(output))
+        dot.edge(a, b, _attributes=attrs)
+
+    if filename is None:
+        dot.render(filename, view=view)
+    else:
+        # write the source and the rendered graph atomically, next to each other
+        # like Digraph.render does
+        atomic_write(filename, dot.source.encode('utf-8'))
+        atomic_write(filename + '.' + fmt, dot.pipe(format=fmt))
+        if view:
+            dot.view(filename)
+
+    return dot
+
+
+class MinMaxSeries(object):
+    """ A growing (x, y) series kept at a bounded number of points. Points fall into
+    buckets of equal width; only the lowest and highest point of each bucket are kept,
+    and neighbouring buckets are merged pairwise whenever there are too many of them.
+    Appending is O(1) amortized and the output never has more than max_points points. """
+
+    def __init__(self, max_points=1000):
+        self.max_buckets = max(1, max_points // 2)
+        self.width = 1
+        self.buckets = []  # [count, x_min, y_min, x_max, y_max]
+
+    def append(self, x, y):
+        if self.buckets and self.buckets[-1][0] < self.width:
+            b = self.buckets[-1]
+            b[0] += 1
+            if y < b[2]:
+                b[1], b[2] = x, y
+            if y > b[4]:
+                b[3], b[4] = x, y
+            return
+
+        self.buckets.append([1, x, y, x, y])
+        if len(self.buckets) > self.max_buckets:
+            merged = []
+            for i in range(0, len(self.buckets), 2):
+                pair = self.buckets[i:i + 2]
+                lo = min(pair, key=lambda b: b[2])
+                hi = max(pair, key=lambda b: b[4])
+                merged.append([sum(b[0] for b in pair), lo[1], lo[2], hi[3], hi[4]])
+            self.buckets = merged
+            self.width *= 2
+
+    def points(self):
+        """ Returns the kept points as (x, y) arrays in x order. """
+        xs, ys = [], []
+        for _, x_min, y_min, x_max, y_max in self.buckets:
+            if x_min == x_max:
+                xs.append(x_min)
+                ys.append(y_min)
+            elif x_min < x_max:
+                xs.extend((x_min, x_max))
+                ys.extend((y_min, y_max))
+            else:
+                xs.extend((x_max, x_min))
+                ys.extend((y_max, y_min))
+        return np.array(xs, dtype=float), np.array(ys, dtype=float)
+
+
+class LivePlotReporter(neat.reporting.BaseReporter):
+    """ Redraws fitness and speciation plots every `interval` generations while NEAT runs.
+
+    The figures and their artists are created once and only get new data, every
+    history is decimated to a bounded number of points, so an update costs the same
+    at generation 10 and at generation 10000. Figures are plain (non-GUI) Figures
+    and are saved atomically; pass an ArtifactWriter to draw them off the training
+    thread. """
+
+    def __init__(self, writer=None, interval=10, fitness_filename='outputs/fitness-live.png',
+                 species_filename='outputs/speciation-live.png', ylog=False, max_points=1000):
+        self.writer = writer
+        self.interval = interval
+        self.fitness_filename = fitness_filename
+        self.species_filename = species_filename
+        self.max_points = max_points
+        self.generation = None
+
+        self.avg = MinMaxSeries(max_points)
+        self.plus_sd = MinMaxSeries(max_points)
+        self.best = MinMaxSeries(max_points)
+
+        # species sizes are stacked, so every species shares the same sampled generations
+        self.species_stride = 1
+        self.species_generations = []
+        self.species_sizes = []
+        self.species_order = []
+
+        self.fitness_fig = Figure()
+        ax = self.fitness_fig.add_subplot()
+        self.avg_line, = ax.plot([], [], 'b-', label="average")
+        self.sd_line, = ax.plot([], [], 'g-.', label="+1 sd")
+        self.best_line, = ax.plot([], [], 'r-', label="best")
+        ax.set_title("Population's average and best fitness")
+        ax.set_xlabel("Generations")
+        ax.set_ylabel("Fitness")
+        ax.grid()
+        ax.legend(loc="best")
+        if ylog:
+            ax.set_yscale('symlog')
+
+        self.species_fig = Figure()
+        ax = self.species_fig.add_subplot()
+        ax.set_title("Speciation")
+        ax.set_ylabel("Size per Species")
+        ax.set_xlabel("Generations")
+        self.species_polys = {}
+
+    def __getstate__(self):
+        # reporters end up in checkpoints through the species set; the figures and
+        # the writer are only needed while running
+        state = self.__dict__.copy()
+        for key in ('writer', 'fitness_fig', 'avg_line', 'sd_line', 'best_line', 'species_fig', 'species_polys'):
+            state[key] = None
+        return state
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        fitnesses = np.array([g.fitness for g in population.values()], dtype=float)
+        mean = fitnesses.mean()
+        self.avg.append(self.generation, mean)
+        self.plus_sd.append(self.generation, mean + fitnesses.std())
+        self.best.append(self.generation, best_genome.fitness)
+
+        if self.generation % self.species_stride == 0:
+            sizes = {sid: len(s.members) for sid, s in species.species.items()}
+            for sid in sizes:
+                if sid not in self.species_order:
+                    self.species_order.append(sid)
+            self.species_generations.append(self.generation)
+            self.species_sizes.append(sizes)
+            if len(self.species_generations) > self.max_points:
+                self.species_generations = self.species_generations[::2]
+                self.species_sizes = self.species_sizes[::2]
+                self.species_stride *= 2
+                # extinct species that no longer show up in any sampled generation leave the stack
+                plotted = set().union(*self.species_sizes)
+                self.species_order = [sid for sid in self.species_order if sid in plotted]
+
+    def end_generation(self, config, population, species_set):
+        if self.generation is None or (self.generation + 1) % self.interval:
+            return
+
+        snapshot = (self.avg.points(), self.plus_sd.points(), self.best.points(),
+                    np.array(self.species_generations, dtype=float),
+                    np.array([[sizes.get(sid, 0) for sid in self.species_order] for sizes in self.species_sizes],
+                             dtype=float).reshape(len(self.species_sizes), len(self.species_order)),
+                    list(self.species_order))
+        if self.writer is None:
+            self.draw(*snapshot)
+        else:
+            self.writer.submit(self.draw, *snapshot)
+
+    def draw(self, avg, plus_sd, best, generations, sizes, order):
+        """ Puts a data snapshot into the persistent artists and saves both figures. """
+        self.avg_line.set_data(*avg)
+        self.sd_line.set_data(*plus_sd)
+        self.best_line.set_data(*best)
+        ax = self.fitness_fig.axes[0]
+        ax.relim()
+        ax.autoscale_view()
+        save_figure(self.fitness_fig, self.fitness_filename)
+
+        ax = self.species_fig.axes[0]
+        tops = np.cumsum(sizes, axis=1) if sizes.size else sizes
+        colors = plt.rcParams['axes.prop_cycle'].by_key()['color']
+        for sid in set(self.species_polys) - set(order):
+            self.species_polys.pop(sid).remove()
+        for i, sid in enumerate(order):
+            bottom = tops[:, i - 1] if i else np.zeros(len(generations))
+            verts = np.concatenate((np.column_stack((generations, tops[:, i])),
+                                    np.column_stack((generations[::-1], bottom[::-1]))))
+            if sid not in self.species_polys:
+                self.species_polys[sid] = ax.add_collection(
+                    PolyCollection([verts], facecolors=colors[sid % len(colors)]))
+            else:
+                self.species_polys[sid].set_verts([verts])
+        if len(generations):
+            ax.set_xlim(generations[0], max(generations[-1], generations[0] + 1))
+            ax.set_ylim(0, max(tops[:, -1].max() if tops.size else 1, 1))
+        save_figure(self.species_fig, self.species_filename)